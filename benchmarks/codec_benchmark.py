@@ -0,0 +1,51 @@
+"""
+Compares the wire formats on a local stand-in server.
+
+Run from the source checkout::
+
+    python -m benchmarks.codec_benchmark [--calls N] [--size N]
+
+Formats whose packages are not installed (msgpack, cbor2) are skipped.
+"""
+from __future__ import print_function
+
+import time
+import random
+import argparse
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.codec import CODECS
+from tests.server import StandInServer
+
+
+def bench(codec_name, calls, payload):
+    with StandInServer({'echo': lambda values: values}, codecs=(codec_name,)) as server:
+        proxy = ServerProxy(server.uri, codec=codec_name, pool_connections=True)
+        encoded = proxy.codec.dumps({'id': 1, 'method': 'echo', 'params': [payload]})
+        proxy.echo(payload)  # connect outside the timing
+        start = time.time()
+        for _ in range(calls):
+            proxy.echo(payload)
+        elapsed = time.time() - start
+    return calls / elapsed, len(encoded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--size', type=int, default=10000, help='Floats per call.')
+    args = parser.parse_args(argv)
+
+    payload = [random.random() * 1e6 for _ in range(args.size)]
+    print('%-8s %10s %12s' % ('format', 'calls/s', 'bytes/call'))
+    for name in sorted(CODECS):
+        try:
+            rate, size = bench(name, args.calls, payload)
+        except ImportError as x:
+            print('%-8s skipped (%s)' % (name, x))
+            continue
+        print('%-8s %10.1f %12d' % (name, rate, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares the memory (and decode time) of list results decoded into dicts and into records.
+
+Run from the source checkout::
+
+    python -m benchmarks.records_benchmark [--items N]
+
+The peak is the most memory allocated while decoding (so it includes the response body and
+any intermediate objects); the retained size is what the decoded result keeps alive.
+The times are inflated by the tracing of allocations, more so for the records.
+"""
+from __future__ import print_function
+
+import gc
+import sys
+import time
+import argparse
+import tracemalloc
+from collections import namedtuple
+
+from rpctools.jsonrpc.codec import JSON_CODEC
+from rpctools.jsonrpc.records import ResultSchema
+
+FIELDS = ('id', 'name', 'score', 'active')
+
+
+class SlottedRecord(object):
+    __slots__ = FIELDS
+
+
+TupleRecord = namedtuple('TupleRecord', FIELDS)
+
+
+def _record_types():
+    types = [('__slots__', SlottedRecord), ('namedtuple', TupleRecord)]
+    if sys.version_info >= (3, 10):
+        import dataclasses
+        types.append(('dataclass', dataclasses.make_dataclass('DataRecord', FIELDS, slots=True)))
+    return types
+
+
+def measure(body, schema):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    if schema is None:
+        decoded = JSON_CODEC.loads(body)
+    else:
+        decoded = JSON_CODEC.loads(body, object_pairs_hook=schema.object_pairs_hook)
+    elapsed = time.time() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded
+    return elapsed, retained, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    result = [{'id': i, 'name': 'user%d' % i, 'score': i * 0.5, 'active': bool(i % 2)} for i in range(args.items)]
+    body = JSON_CODEC.dumps({'id': 1, 'result': result, 'error': None}).encode('utf-8')
+    del result
+
+    print('%-10s %10s %14s %14s' % ('decoded to', 'seconds', 'retained MiB', 'peak MiB'))
+    for name, schema in [('dict', None)] + [(n, ResultSchema(cls)) for n, cls in _record_types()]:
+        elapsed, retained, peak = measure(body, schema)
+        print('%-10s %10.3f %14.1f %14.1f' % (name, elapsed, retained / 2.0 ** 20, peak / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
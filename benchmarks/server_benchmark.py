@@ -0,0 +1,100 @@
+"""
+Measures the throughput of the JSON-RPC server front ends.
+
+Run from the source checkout::
+
+    python -m benchmarks.server_benchmark [--calls N] [--batch N] [--concurrency N]
+
+'dispatch' calls the dispatcher in-process (decode, call, encode), 'wsgi' goes through the
+WSGI application without a network, and 'asyncio' (Python 3) is measured over HTTP with
+pooled client connections from several threads.
+"""
+from __future__ import print_function
+
+import io
+import sys
+import json
+import time
+import argparse
+import threading
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.server import Registry, Dispatcher, WSGIApplication
+
+
+def _registry():
+    registry = Registry()
+    registry.register(lambda a, b: a + b, 'add')
+    return registry
+
+
+def bench_dispatch(calls, batch):
+    dispatcher = Dispatcher(_registry())
+    body = _body(batch)
+    start = time.time()
+    for _ in range(calls):
+        dispatcher.handle(body, 'application/json')
+    return calls * batch / (time.time() - start)
+
+
+def bench_wsgi(calls, batch):
+    app = WSGIApplication(Dispatcher(_registry()))
+    body = _body(batch)
+    environ = {'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body))}
+    start_response = lambda status, headers: None
+    start = time.time()
+    for _ in range(calls):
+        environ['wsgi.input'] = io.BytesIO(body)
+        app(environ, start_response)
+    return calls * batch / (time.time() - start)
+
+
+def bench_asyncio(calls, concurrency):
+    import asyncio
+    from rpctools.jsonrpc.server.aio import AsyncDispatcher, serve
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(serve(AsyncDispatcher(_registry())))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    uri = 'http://127.0.0.1:%d/jsonrpc' % server.sockets[0].getsockname()[1]
+
+    def worker():
+        proxy = ServerProxy(uri, pool_connections=True)
+        for _ in range(calls // concurrency):
+            proxy.add(1, 2)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    loop.call_soon_threadsafe(loop.stop)
+    return (calls // concurrency) * concurrency / elapsed
+
+
+def _body(batch):
+    if batch == 1:
+        return json.dumps({'id': 1, 'method': 'add', 'params': [1, 2]}).encode('utf-8')
+    return json.dumps([{'id': i, 'method': 'add', 'params': [i, 2]} for i in range(batch)]).encode('utf-8')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=1, help='Requests per body (in-process front ends).')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client threads (asyncio).')
+    args = parser.parse_args(argv)
+
+    print('%-10s %12s' % ('front end', 'calls/s'))
+    print('%-10s %12.0f' % ('dispatch', bench_dispatch(args.calls, args.batch)))
+    print('%-10s %12.0f' % ('wsgi', bench_wsgi(args.calls, args.batch)))
+    if sys.version_info >= (3, 5):
+        print('%-10s %12.0f' % ('asyncio', bench_asyncio(args.calls // 4, args.concurrency)))
+
+
+if __name__ == '__main__':
+    main()
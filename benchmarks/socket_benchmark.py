@@ -0,0 +1,80 @@
+"""
+Compares the latency of small calls with and without the socket tuning.
+
+Run from the source checkout (Python 3)::
+
+    python -m benchmarks.socket_benchmark [--calls N]
+
+Each configuration makes sequential calls over one pooled connection to a local asyncio
+server (which answers in a single write):
+
+    split, Nagle      headers and body in separate writes, TCP_NODELAY off
+    split, nodelay    headers and body in separate writes, TCP_NODELAY on
+    single, Nagle     one write, TCP_NODELAY off
+    single write      the default: one write, TCP_NODELAY on
+
+With Nagle's algorithm on, the body waits for the ACK of the headers, which the server
+may delay (by about 40 ms on Linux).
+"""
+from __future__ import print_function
+
+import time
+import asyncio
+import argparse
+import threading
+
+from rpctools.jsonrpc import ssl_wrapper
+from rpctools.jsonrpc import pool as pool_module
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.server import Registry
+from rpctools.jsonrpc.server.aio import AsyncDispatcher, serve
+
+CONFIGURATIONS = (
+    ('split, Nagle', {'nodelay': False}, 0),
+    ('split, nodelay', {'nodelay': True}, 0),
+    ('single, Nagle', {'nodelay': False}, ssl_wrapper.HTTPConnection.coalesce_limit),
+    ('single write', {'nodelay': True}, ssl_wrapper.HTTPConnection.coalesce_limit),
+)
+
+
+def bench(uri, socket_opts, coalesce_limit, calls):
+    ssl_wrapper.HTTPConnection.coalesce_limit = coalesce_limit
+    proxy = ServerProxy(uri, pool_connections=True, socket_opts=socket_opts)
+    proxy.echo('warm up')
+    latencies = []
+    for i in range(calls):
+        start = time.time()
+        proxy.echo('call %d' % i)
+        latencies.append(time.time() - start)
+    pool_module.pool.connections.pop(proxy.host).close()  # The next configuration gets its own.
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], sum(latencies) / len(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    registry = Registry()
+    registry.register(lambda value: value, 'echo')
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(serve(AsyncDispatcher(registry)))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    uri = 'http://127.0.0.1:%d/jsonrpc' % server.sockets[0].getsockname()[1]
+
+    default_limit = ssl_wrapper.HTTPConnection.coalesce_limit
+    print('%-16s %10s %10s %10s' % ('configuration', 'p50 ms', 'p99 ms', 'mean ms'))
+    try:
+        for name, socket_opts, coalesce_limit in CONFIGURATIONS:
+            p50, p99, mean = bench(uri, socket_opts, coalesce_limit, args.calls)
+            print('%-16s %10.3f %10.3f %10.3f' % (name, p50 * 1000, p99 * 1000, mean * 1000))
+    finally:
+        ssl_wrapper.HTTPConnection.coalesce_limit = default_limit
+        loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Cross-thread micro-batching of JSON-RPC calls.
+
+Calls made from many threads within a short window are gathered and sent as a single
+JSON-RPC batch POST; each waiting thread then gets back its own response.  This trades a
+little latency (at most the window) for far fewer HTTP round trips under load.
+"""
+from __future__ import absolute_import
+
+import json
+import time
+import itertools
+import threading
+
+from rpctools.jsonrpc.exc import ResponseError
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class _Call(object):
+    """
+    A single call waiting in a batch.
+    """
+    __slots__ = ('data', 'on_response', 'done', 'response', 'error')
+
+    def __init__(self, data, on_response):
+        self.data = data
+        self.on_response = on_response
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class BatchDispatcher(object):
+    """
+    Gathers calls from many threads into JSON-RPC batch requests.
+
+    There is no dispatcher thread: the first caller to arrive in an empty window becomes
+    the batch's "leader", waits for the window to pass (or the batch to fill up) and then
+    sends the batch itself, while the other callers simply wait for their responses.
+    Several batches may therefore be in flight at once, each over the leader thread's
+    connection.
+
+    Request ids are replaced on the wire by ids unique to this dispatcher, so proxies
+    (and threads) whose ids overlap can safely share a dispatcher.
+
+    :ivar window: Seconds the leader waits for more calls to join its batch.
+    :type window: C{float}
+
+    :ivar max_calls: The number of calls that closes a batch before the window passes.
+    :type max_calls: C{int}
+
+    :ivar batches: The number of batch requests sent.
+    :type batches: C{int}
+
+    :ivar calls: The number of calls sent in those batches.
+    :type calls: C{int}
+    """
+
+    def __init__(self, transport, host, handler, window=0.002, max_calls=50):
+        """
+        :param transport: The transport used to send batches (a pooling transport is recommended).
+        :type transport: L{rpctools.jsonrpc.transport.Transport}
+
+        :param host: The host (optionally in "host:port" syntax).
+        :type host: C{str}
+
+        :param handler: Target RPC handler (e.g. '/jsonrpc').
+        :type handler: C{str}
+
+        :param window: Seconds to wait for more calls to join a batch.
+        :type window: C{float}
+
+        :param max_calls: The most calls to send in one batch.
+        :type max_calls: C{int}
+        """
+        self.transport = transport
+        self.host = host
+        self.handler = handler
+        self.window = window
+        self.max_calls = max(1, max_calls)
+        self.batches = 0
+        self.calls = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._closed = threading.Condition(self._lock)
+        self._open = {}
+
+    def call(self, data, headers, on_response=None):
+        """
+        Add a call to the current batch and wait for its response.
+
+        :param data: The request (with 'id', 'method' and 'params' keys).
+        :type data: C{dict}
+
+        :param headers: HTTP headers for the request; only calls with equal headers share a batch.
+        :type headers: C{dict}
+
+        :param on_response: Optional callable invoked with the HTTP response of the batch
+                            (e.g. L{ServerProxy._handle_response}).
+        :type on_response: C{callable}
+
+        :return: The decoded JSON-RPC response for this call (with the caller's id restored).
+        :rtype: C{dict}
+
+        :raise ConnectionError: If the batch could not be sent.
+        :raise ProtocolError: If the batch got a non-200 response.
+        :raise ResponseError: If the batch response cannot be parsed or lacks this call's response.
+        """
+        call = _Call(data, on_response)
+        key = tuple(sorted(headers.items()))
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = []
+            batch.append(call)
+            if len(batch) >= self.max_calls:
+                del self._open[key]
+                self._closed.notify_all()
+
+        if leader:
+            deadline = time.time() + self.window
+            with self._lock:
+                while self._open.get(key) is batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        del self._open[key]
+                        break
+                    self._closed.wait(remaining)
+            self._send(batch, headers)
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.response
+
+    def _send(self, batch, headers):
+        """
+        Send a closed batch and hand each waiting call its response (or error).
+        """
+        by_wire_id = {}
+        messages = []
+        for call in batch:
+            wire_id = next(self._ids)
+            by_wire_id[wire_id] = call
+            message = dict(call.data)
+            message['id'] = wire_id
+            messages.append(message)
+
+        try:
+            response = self.transport.request(self.host, self.handler, json.dumps(messages), headers=dict(headers),
+                                              method=[call.data.get('method') for call in batch])
+            hooks = set(call.on_response for call in batch if call.on_response is not None)
+            for hook in hooks:
+                hook(response)
+            data = response.read()
+            try:
+                decoded = json.loads(data.decode('utf-8'))
+            except Exception as x:
+                raise ResponseError("Unable to parse batch response data as JSON: %s" % x)
+            if not isinstance(decoded, list):
+                raise ResponseError('Malformed JSON-RPC batch response: %r' % (decoded,))
+            for item in decoded:
+                call = by_wire_id.pop(item.get('id') if isinstance(item, dict) else None, None)
+                if call is not None:
+                    item['id'] = call.data.get('id')
+                    call.response = item
+            for call in by_wire_id.values():
+                call.error = ResponseError('No response for %s in JSON-RPC batch response.' % call.data.get('method'))
+        except Exception as x:
+            for call in batch:
+                call.error = x
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.calls += len(batch)
+            for call in batch:
+                call.done.set()
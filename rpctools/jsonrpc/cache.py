@@ -0,0 +1,299 @@
+"""
+A result cache shared by all the processes on a host.
+
+Pre-fork servers (e.g. gunicorn with many workers) otherwise each fetch and hold their own
+copy of the same reference data.  L{SharedCache} keeps cached responses in a memory-mapped
+file instead, so one worker's call serves the others until its TTL runs out::
+
+    cache = SharedCache('/dev/shm/myservice-rpc.cache', size=64 * 2 ** 20)
+    proxy = ServerProxy(uri, cache=cache, cache_ttls={'countries.list': 3600})
+
+The file holds a set-associative index of entries and a ring buffer for the data: new
+values are appended at the write position, which wraps around, and entries whose data has
+been overwritten (or whose TTL has run out) are no longer found.  So the size is bounded
+and the oldest entries are evicted first.  Access is serialised with an exclusive
+C{flock} on the file (and a lock for the threads of each instance).  C{flock} locks
+belong to an open file rather than to a process, so that instances on the same file
+exclude each other within a process too.
+
+Any object with C{get(key)} and C{set(key, value, ttl)} methods that store C{bytes} may be
+used as a cache backend in place of L{SharedCache}.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX.
+    fcntl = None
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+MAGIC = b'RPCCACH1'
+
+# magic, buckets, ways, data capacity, write position, hits, misses, stores
+_HEADER = struct.Struct('<8sIIQQQQQ')
+_HEADER_SIZE = 64
+# Offsets of the header's counters.
+_WRITE_POS, _HITS, _MISSES, _STORES = 24, 32, 40, 48
+
+# key hash, data position, key length, value length, expiry time
+_ENTRY = struct.Struct('<QQIId')
+
+
+def cache_key(*parts):
+    """
+    Builds a cache key from JSON-serialisable parts (e.g. host, handler, method and params).
+
+    :rtype: C{str}
+    """
+    return json.dumps(parts, sort_keys=True, separators=(',', ':'))
+
+
+def _hash(key):
+    return struct.unpack('<Q', hashlib.sha1(key).digest()[:8])[0] | 1  # 0 marks an empty entry.
+
+
+class SharedCache(object):
+    """
+    A bounded cache of C{bytes} values with TTLs, in a memory-mapped file that every
+    process on the host can open.
+
+    The first process to open the file sets its geometry; others use what they find.
+
+    :ivar path: The cache file.
+    :type path: C{str}
+
+    :ivar capacity: The bytes available for keys and values.
+    :type capacity: C{int}
+
+    :ivar max_value_size: Larger values are not cached.
+    :type max_value_size: C{int}
+    """
+
+    def __init__(self, path, size=64 * 2 ** 20, entries=65536, ways=8):
+        """
+        :param path: The cache file (e.g. under /dev/shm, to keep it in memory).
+        :type path: C{str}
+
+        :param size: The bytes to set aside for keys and values.
+        :type size: C{int}
+
+        :param entries: The most entries the index holds.
+        :type entries: C{int}
+
+        :param ways: The entries per index bucket (a key may only be stored in its bucket).
+        :type ways: C{int}
+
+        :raise OSError: If the file cannot be opened.
+        :raise ValueError: If the file is not a cache file.
+        """
+        if fcntl is None:
+            raise OSError('SharedCache requires POSIX file locking (fcntl)')
+        self.path = path
+        self._abspath = os.path.abspath(path)  # (For reopening it after a fork.)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                header = os.read(self._fd, _HEADER.size)
+                if len(header) < _HEADER.size:
+                    buckets = max(1, entries // ways)
+                    os.ftruncate(self._fd, _HEADER_SIZE + buckets * ways * _ENTRY.size + size)
+                    header = _HEADER.pack(MAGIC, buckets, ways, size, 0, 0, 0, 0)
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    os.write(self._fd, header)
+                magic, self._buckets, self._ways, self.capacity = _HEADER.unpack(header)[:4]
+                if magic != MAGIC:
+                    raise ValueError('%s is not a cache file' % path)
+                self._index_size = self._buckets * self._ways * _ENTRY.size
+                self._data_offset = _HEADER_SIZE + self._index_size
+                self._map = mmap.mmap(self._fd, self._data_offset + self.capacity)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self.max_value_size = self.capacity // 4
+
+    def get(self, key):
+        """
+        :param key: The key.
+        :type key: C{str}
+
+        :return: The value, or C{None} if it is not cached (or has expired).
+        :rtype: C{bytes}
+        """
+        key = key.encode('utf-8')
+        h = _hash(key)
+        with self._locked():
+            write_pos = self._header_field(_WRITE_POS)
+            now = time.time()
+            for offset in self._bucket(h):
+                entry_hash, pos, key_len, value_len, expires = _ENTRY.unpack_from(self._map, offset)
+                if entry_hash == h and expires > now and write_pos - pos <= self.capacity:
+                    start = self._data_offset + pos % self.capacity
+                    if self._map[start:start + key_len] == key:
+                        self._count(_HITS)
+                        return self._map[start + key_len:start + key_len + value_len]
+            self._count(_MISSES)
+            return None
+
+    def set(self, key, value, ttl):
+        """
+        Stores a value (evicting the oldest values if need be).
+
+        :param key: The key.
+        :type key: C{str}
+
+        :param value: The value.
+        :type value: C{bytes}
+
+        :param ttl: Seconds until the value expires.
+        :type ttl: C{float}
+
+        :return: Whether the value was stored (it is not if it is larger than L{max_value_size}).
+        :rtype: C{bool}
+        """
+        key = key.encode('utf-8')
+        length = len(key) + len(value)
+        if length > self.max_value_size:
+            return False
+        h = _hash(key)
+        with self._locked():
+            write_pos = self._header_field(_WRITE_POS)
+            now = time.time()
+            # Replace this key's entry, or else a dead entry, or else the oldest.
+            target = target_pos = None
+            for offset in self._bucket(h):
+                entry_hash, pos, key_len, _, expires = _ENTRY.unpack_from(self._map, offset)
+                if entry_hash == h and key_len == len(key):
+                    start = self._data_offset + pos % self.capacity
+                    if self._map[start:start + key_len] == key:
+                        target = offset
+                        break
+                live = entry_hash and expires > now and write_pos - pos <= self.capacity
+                if not live:
+                    pos = -1
+                if target is None or pos < target_pos:
+                    target, target_pos = offset, pos
+
+            # Values do not wrap around the end of the ring.
+            pos = write_pos
+            if pos % self.capacity + length > self.capacity:
+                pos += self.capacity - pos % self.capacity
+            start = self._data_offset + pos % self.capacity
+            self._map[start:start + len(key)] = key
+            self._map[start + len(key):start + length] = value
+            _ENTRY.pack_into(self._map, target, h, pos, len(key), len(value), now + ttl)
+            self._set_header_field(_WRITE_POS, pos + length)
+            self._count(_STORES)
+            return True
+
+    def delete(self, key):
+        """
+        Removes a value, if it is cached.
+        """
+        key = key.encode('utf-8')
+        h = _hash(key)
+        with self._locked():
+            for offset in self._bucket(h):
+                entry_hash, pos, key_len, _, _ = _ENTRY.unpack_from(self._map, offset)
+                start = self._data_offset + pos % self.capacity
+                if entry_hash == h and self._map[start:start + key_len] == key:
+                    _ENTRY.pack_into(self._map, offset, 0, 0, 0, 0, 0.0)
+
+    def clear(self):
+        """
+        Removes every value.
+        """
+        with self._locked():
+            self._map[_HEADER_SIZE:self._data_offset] = b'\0' * self._index_size
+
+    def stats(self):
+        """
+        :return: The hits, misses and stores so far (by all processes), and the live entries.
+        :rtype: C{dict}
+        """
+        with self._locked():
+            write_pos, hits, misses, stores = _HEADER.unpack_from(self._map)[4:]
+            now = time.time()
+            entries = 0
+            for offset in range(_HEADER_SIZE, self._data_offset, _ENTRY.size):
+                entry_hash, pos, _, _, expires = _ENTRY.unpack_from(self._map, offset)
+                if entry_hash and expires > now and write_pos - pos <= self.capacity:
+                    entries += 1
+        return {'hits': hits, 'misses': misses, 'stores': stores, 'entries': entries}
+
+    def close(self):
+        """
+        Unmaps and closes the file (which is left for the other processes).
+        """
+        self._map.close()
+        os.close(self._fd)
+
+    def _bucket(self, h):
+        first = _HEADER_SIZE + (h % self._buckets) * self._ways * _ENTRY.size
+        return range(first, first + self._ways * _ENTRY.size, _ENTRY.size)
+
+    def _header_field(self, offset):
+        return struct.unpack_from('<Q', self._map, offset)[0]
+
+    def _set_header_field(self, offset, value):
+        struct.pack_into('<Q', self._map, offset, value)
+
+    def _count(self, offset):
+        self._set_header_field(offset, self._header_field(offset) + 1)
+
+    def _locked(self):
+        if self._pid != os.getpid():
+            # Another thread may have held the lock when this process was forked, and the
+            # inherited file shares its flock with the parent's: open the file anew.
+            self._lock = threading.Lock()
+            inherited, self._fd = self._fd, os.open(self._abspath, os.O_RDWR)
+            os.close(inherited)
+            self._pid = os.getpid()
+        return _FileLock(self._lock, self._fd)
+
+
+class _FileLock(object):
+    """
+    Holds a thread lock and, within it, an exclusive C{flock} on a file.
+    """
+
+    def __init__(self, lock, fd):
+        self.lock = lock
+        self.fd = fd
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except Exception:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.lock.release()
@@ -6,17 +6,30 @@ however, they also add support for using keep-alive connections.
 """
 from __future__ import absolute_import
 
+import socket
 import logging
+import functools
 import urllib
 import json
 import base64
+import hashlib
 import string
 import warnings
+import itertools
 
+from rpctools.six.moves import http_client as httplib
 from rpctools.six.moves.http_cookies import SimpleCookie
 from rpctools.six.moves.urllib.parse import urlparse, unquote
-from rpctools.jsonrpc.transport import Transport, SafeTransport, TLSConnectionPoolSafeTransport, TLSConnectionPoolTransport
-from rpctools.jsonrpc.exc import JsonRpcError, ResponseError, Fault
+from rpctools.jsonrpc.transport import Transport, SafeTransport, TLSConnectionPoolSafeTransport, TLSConnectionPoolTransport, \
+    SessionAffinityPoolTransport, SessionAffinityPoolSafeTransport
+from rpctools.jsonrpc.exc import JsonRpcError, ProtocolError, ResponseError, Fault, ConnectionError
+from rpctools.jsonrpc.notify import NotificationQueue
+from rpctools.jsonrpc.batch import BatchDispatcher
+from rpctools.jsonrpc.tracing import Tracer
+from rpctools.jsonrpc.streaming import DEFAULT_CHUNK_SIZE, is_streaming, iterencode
+from rpctools.jsonrpc.codec import JSON_CODEC, REFUSED_STATUSES, codec_for_content_type, get_codec
+from rpctools.jsonrpc.records import ResultSchema
+from rpctools.jsonrpc.cache import cache_key
 
 __license__ = """Licensed under the Apache License, Version 2.0 (the "License");
 you may not use this file except in compliance with the License.
@@ -30,6 +43,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
+# Request headers whose values are part of a result cache key.
+_CREDENTIAL_HEADERS = ('authorization', 'proxy-authorization', 'cookie')
+
 
 # -----------------------------------------------------------------------------
 # "INTERNAL" CLASSES
@@ -77,6 +93,31 @@ class _Method(object):
         return '<%s name=%s>' % (self.__class__.__name__, self._name)
 
 
+class _MethodNamespace(object):
+    """
+    The root of a tree of L{_Method} callables that share a send function.
+
+    This is what allows e.g. C{proxy.notify.examples.getStateName(...)} to route through
+    something other than the proxy's normal request method.
+    """
+    def __init__(self, send, method_class=_Method):
+        """
+        :param send: A callable that will perform the actual request.
+        :type send: C{callable}
+
+        :param method_class: The proxy class for the remote methods.
+        :type method_class: C{type}
+        """
+        self._send = send
+        self._method_class = method_class
+
+    def __getattr__(self, name):
+        """
+        :rtype: L{_Method}
+        """
+        return self._method_class(self._send, name)
+
+
 # -----------------------------------------------------------------------------
 # PUBLIC CLASSES
 # -----------------------------------------------------------------------------
@@ -105,12 +146,75 @@ class ServerProxy(object):
 
     :ivar method_class: The proxy class for the remote methods (default is L{_Method}).
     :type method_class: C{type}
+
+    :ivar notify_opts: Keyword arguments for the L{NotificationQueue} behind L{notify}.
+    :type notify_opts: C{dict}
+
+    :ivar dispatcher: An optional L{BatchDispatcher} that gathers calls from many threads
+                      into batch requests.  (It may be shared by several proxies.)
+    :type dispatcher: L{BatchDispatcher}
+
+    :ivar tracer: Starts a tracing span for every call (see L{rpctools.jsonrpc.tracing}).
+    :type tracer: L{Tracer}
+
+    :ivar chunk_size: The chunk size for requests streamed from iterator params.
+    :type chunk_size: C{int}
+
+    :ivar codec: The wire format for requests (see L{rpctools.jsonrpc.codec}).  It falls
+                 back to JSON for good if the server refuses it.
+    :type codec: L{rpctools.jsonrpc.codec.JSONCodec}
+
+    :ivar limiter: Adaptively limits the calls in flight to the host (optional; see
+                   L{rpctools.jsonrpc.limiter}).  Share one between proxies to limit them together.
+    :type limiter: L{rpctools.jsonrpc.limiter.AdaptiveLimiter}
+
+    :ivar socket_opts: Options applied to every socket opened, e.g. C{{'keepalive': True,
+                       'keepidle': 60}}, on top of the defaults (TCP_NODELAY, unless
+                       C{'nodelay': False}; see L{rpctools.jsonrpc.ssl_wrapper.configure_socket}).
+    :type socket_opts: C{dict}
+
+    :ivar rate_limiter: Limits the rate of calls to the host, and to particular methods
+                        (optional; see L{rpctools.jsonrpc.ratelimit}).
+    :type rate_limiter: L{rpctools.jsonrpc.ratelimit.RateLimiter}
+
+    :ivar priority: The priority of this proxy's calls when they wait for a L{limiter} slot
+                    (lower is served first; see L{with_priority} to override it per call).
+    :type priority: C{int}
+
+    :ivar hedger: Sends hedged copies of slow calls to idempotent methods (optional; see
+                  L{rpctools.jsonrpc.hedge}).
+    :type hedger: L{rpctools.jsonrpc.hedge.Hedger}
+
+    :ivar prewarmed: The number of connections opened ahead of time (see C{prewarm}).
+    :type prewarmed: C{int}
+
+    :ivar result_schemas: The record classes that results are decoded into, indexed by
+                          method name (see L{register_result_type}).
+    :type result_schemas: C{dict} of L{rpctools.jsonrpc.records.ResultSchema}
+
+    :ivar cache: Holds the responses of the methods in L{cache_ttls} (optional; see
+                 L{rpctools.jsonrpc.cache}).
+    :type cache: L{rpctools.jsonrpc.cache.SharedCache}
+
+    :ivar cache_ttls: The seconds to cache each method's responses for, by method name.
+    :type cache_ttls: C{dict}
+
+    :ivar cache_namespace: Keeps this proxy's cached responses apart from those of proxies
+                           with other namespaces.
+    :type cache_namespace: C{str}
     """
 
     method_class = _Method
 
+    default_ports = {'http': 80, 'https': 443}
+
+    chunk_size = DEFAULT_CHUNK_SIZE
+
     def __init__(self, uri, key_file=None, cert_file=None, ca_certs=None, validate_cert_hostname=True,
-                 extra_headers=None, timeout=None, pool_connections=False, ssl_opts=None):
+                 extra_headers=None, timeout=None, pool_connections=False, ssl_opts=None, notify_opts=None,
+                 batch_opts=None, tracer=None, codec=None, limiter=None, priority=None,
+                 hedger=None, prewarm=0, prewarm_timeout=10.0, result_types=None,
+                 rate_limiter=None, cache=None, cache_ttls=None, socket_opts=None, cache_namespace=None):
         """
         :param uri: The endpoint JSON-RPC server URL.
         :param key_file: (Deprecated) Secret key to use for ssl connection.
@@ -119,6 +223,24 @@ class ServerProxy(object):
         :param extra_headers: Any additional headers to include with all requests.
         :param pool_connections: Whether to use a thread-local connection pool for connections.
         :param ssl_opts: Dictionary of options passed to ssl.wrap_socket
+        :param notify_opts: Dictionary of options for the notification queue (e.g. maxsize, batch_size).
+        :param batch_opts: Dictionary of options (window, max_calls) that enables cross-thread micro-batching.
+        :param tracer: A L{Tracer} to report the phases of every call to.
+        :param codec: The wire format: 'json' (default), 'msgpack', 'cbor' or a codec instance.
+        :param limiter: An L{AdaptiveLimiter} bounding the calls in flight to each host.
+        :param priority: The priority of calls waiting for a limiter slot (e.g. PRIORITY_BATCH).
+        :param hedger: A L{Hedger} that hedges slow calls to the idempotent methods it lists.
+        :param prewarm: The number of pooled connections to open (in parallel) before returning.
+        :param prewarm_timeout: Seconds to allow for the pre-warmed connections to be opened.
+        :param result_types: Record classes to decode results into: a dict of method name to a class
+                             (or a tuple of classes, for nested records).
+        :param rate_limiter: A L{RateLimiter} keeping calls within per-host and per-method rates.
+        :param cache: A cache backend (e.g. a L{SharedCache}) for the responses of the methods in cache_ttls.
+        :param cache_ttls: Seconds to cache responses for, by method name.
+        :param cache_namespace: Keeps this proxy's cached responses apart from those of proxies
+                                with other namespaces (e.g. for credentials passed other than in
+                                the Authorization or Cookie headers).
+        :param socket_opts: Socket options (nodelay, keepalive, keepidle, keepintvl, keepcnt, sndbuf, rcvbuf).
         """
         self.logger = logging.getLogger('{0.__module__}.{0.__name__}'.format(self.__class__))
         if extra_headers is None:
@@ -127,11 +249,13 @@ class ServerProxy(object):
         parsed_uri = urlparse(uri)
 
         self.type = parsed_uri.scheme
-        if self.type not in ("http", "https"):
+        if self.type not in self.default_ports:
             raise JsonRpcError("unsupported JSON-RPC uri: %s" % uri)
 
         self.handler = parsed_uri.path
-        port = parsed_uri.port or (80 if self.type == 'http' else 443)
+        port = parsed_uri.port or self.default_ports[self.type]
+        if port is None:
+            raise JsonRpcError("JSON-RPC uri requires a port: %s" % uri)
         self.host = '{}:{}'.format(parsed_uri.hostname, port)
 
         if parsed_uri.username and parsed_uri.password:
@@ -148,22 +272,180 @@ class ServerProxy(object):
                 warnings.warn('key_file, cert_file, and ca_certs arguments are deprecated; use ssl_opts argument instead', DeprecationWarning)
                 self.ssl_opts.setdefault(opt, val)
 
-        # TODO: This could probably be a little cleaner :)
-        if pool_connections:
-            if self.type == "https":
-                self.transport = TLSConnectionPoolSafeTransport(timeout=timeout)
-            else:
-                self.transport = TLSConnectionPoolTransport(timeout=timeout)
-        else:
-            if self.type == "https":
-                self.transport = SafeTransport(timeout=timeout, ssl_opts=self.ssl_opts, validate_cert_hostname=self.validate_cert_hostname)
-            else:
-                self.transport = Transport(timeout=timeout)
+        self.timeout = timeout
+        self.socket_opts = socket_opts
+        self.tracer = tracer or Tracer()
+        self.codec = get_codec(codec)
+        self.limiter = limiter
+        self.rate_limiter = rate_limiter
+        self.priority = priority
+        self.hedger = hedger
+        self.transport = self._create_transport(pool_connections)
 
         self.extra_headers = extra_headers
         self.id = 0  # Initialize our request ID (gets incremented for every request)
 
-    def _request(self, methodname, params):
+        self.notify_opts = notify_opts or {}
+        self._notification_queue = None
+
+        self.cache = cache
+        self.cache_ttls = dict(cache_ttls or {})
+        self.cache_namespace = cache_namespace
+
+        self.result_schemas = {}
+        for methodname, types in (result_types or {}).items():
+            if not isinstance(types, tuple):
+                types = (types,)
+            self.register_result_type(methodname, *types)
+
+        self.prewarmed = 0
+        if prewarm:
+            if not pool_connections:
+                raise JsonRpcError("prewarm requires pool_connections")
+            self.prewarmed = self.transport.warm(self.host, prewarm, timeout=prewarm_timeout)
+
+        self.dispatcher = None
+        if batch_opts is not None:
+            self.dispatcher = BatchDispatcher(self._create_transport(pool_connections=True),
+                                              self.host, self.handler, **batch_opts)
+
+    def _create_transport(self, pool_connections):
+        """
+        Builds a transport suitable for this proxy's URI scheme.
+
+        :param pool_connections: Whether the transport should use the thread-local connection pool.
+        :type pool_connections: C{bool}
+
+        :rtype: L{Transport}
+        """
+        cls = self._transport_class(pool_connections)
+        if self.type == "https":
+            transport = cls(timeout=self.timeout, ssl_opts=self.ssl_opts, validate_cert_hostname=self.validate_cert_hostname,
+                            socket_opts=self.socket_opts)
+        else:
+            transport = cls(timeout=self.timeout, socket_opts=self.socket_opts)
+        transport.tracer = self.tracer
+        transport.limiter = self.limiter
+        transport.rate_limiter = self.rate_limiter
+        return transport
+
+    def _transport_class(self, pool_connections):
+        """
+        :return: The transport class for this proxy's URI scheme.
+        :rtype: C{type}
+        """
+        if self.type == "https":
+            return TLSConnectionPoolSafeTransport if pool_connections else SafeTransport
+        return TLSConnectionPoolTransport if pool_connections else Transport
+
+    @property
+    def notify(self):
+        """
+        Proxy callables that send JSON-RPC notifications instead of requests.
+
+        Notifications have no id and get no result, so calls return as soon as the
+        notification is queued (C{True}) or dropped because the queue is full (C{False}).
+        For example::
+
+            proxy.notify.audit.record('login', user_id)
+
+        :rtype: L{_MethodNamespace}
+        """
+        return _MethodNamespace(self._notify, self.method_class)
+
+    def with_priority(self, priority):
+        """
+        Proxy callables whose calls wait for a limiter slot with the given priority.
+
+        For example::
+
+            proxy.with_priority(PRIORITY_INTERACTIVE).search(query)
+
+        :param priority: The priority (lower is served first).
+        :type priority: C{int}
+
+        :rtype: L{_MethodNamespace}
+        """
+        return _MethodNamespace(functools.partial(self._request, priority=priority), self.method_class)
+
+    def register_result_type(self, methodname, *types):
+        """
+        Decodes the results of a method into record objects rather than dicts.
+
+        The decoder builds a record for each object whose keys are exactly the fields of
+        one of the classes, without creating the intermediate dict (see
+        L{rpctools.jsonrpc.records}).  For example::
+
+            Point = namedtuple('Point', 'x y')
+            proxy.register_result_type('shapes.vertices', Point)
+
+        :param methodname: The (dotted) method name.
+        :type methodname: C{str}
+
+        :param types: Record classes: namedtuples, dataclasses or classes with C{__slots__}.
+
+        :raise TypeError: If a class is not a suitable record class.
+        """
+        self.result_schemas[methodname] = ResultSchema(*types)
+
+    def close(self, timeout=None):
+        """
+        Sends any queued notifications and closes the proxy's connections.
+
+        Pooled connections belong to their threads, so only the calling thread's are
+        closed.  In particular the L{hedger} is not closed (it may be shared by other
+        proxies), and neither are the pooled connections of its worker threads; close it
+        yourself, and use L{rpctools.jsonrpc.pool.drain} to close every thread's connections.
+
+        A proxy can also be used as a context manager, which closes it on exit::
+
+            with ServerProxy(uri, pool_connections=True) as proxy:
+                proxy.someServerMethod()
+
+        :param timeout: The most seconds to wait for queued notifications to be sent.
+        :type timeout: C{float}
+        """
+        if self._notification_queue is not None:
+            self._notification_queue.close(timeout)
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def notification_queue(self):
+        """
+        The (lazily created) queue behind L{notify}; use it to flush or close pending notifications.
+
+        :rtype: L{NotificationQueue}
+        """
+        if self._notification_queue is None:
+            self._notification_queue = NotificationQueue(self._create_transport(pool_connections=True),
+                                                         self.host, self.handler, **self.notify_opts)
+        return self._notification_queue
+
+    def _notify(self, methodname, params):
+        """
+        Encodes a notification and hands it to the notification queue.
+
+        :param methodname: Name of method to be called.
+        :type methodname: C{str}
+
+        :param params: Parameters list to send to method.
+        :type params: C{list}
+
+        :return: Whether the notification was queued.
+        :rtype: C{bool}
+        """
+        data = dict(method=methodname, params=params)
+        headers = dict(self.extra_headers)
+        self._prepare_request(data, headers)
+        return self.notification_queue.put(json.dumps(data), self._codec_headers(headers, JSON_CODEC))
+
+    def _request(self, methodname, params, priority=None):
         """
         Overriden __request method which introduced the request_cookie parameter
         that allows cookie headers to propagated through JSON-RPC requests.
@@ -174,6 +456,9 @@ class ServerProxy(object):
         :param params: Parameters list to send to method.
         :type params: C{list}
 
+        :param priority: The call's priority (defaults to L{priority}).
+        :type priority: C{int}
+
         :return: The decoded result.
 
         :raise ResponseError: If the response cannot be parsed or is not proper JSON-RPC 1.0 response format.
@@ -188,19 +473,284 @@ class ServerProxy(object):
 
         self._prepare_request(data, headers)
 
-        body = json.dumps(data)
+        if priority is None:
+            priority = self.priority
+
+        if self.cache is not None and methodname in self.cache_ttls and not is_streaming(params):
+            key = self._cache_key(methodname, params, headers)
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                content_type, body = cached.split(b'\n', 1)
+                decoded = self._parse_response(body, content_type.decode('latin-1') or None,
+                                               self.result_schemas.get(methodname))
+                return self._handle_result(methodname, decoded)
+
+        if self.dispatcher is not None and not is_streaming(params):
+            decoded = self.dispatcher.call(data, self._codec_headers(headers, JSON_CODEC), self._handle_response)
+            self._cache_decoded(data, headers, decoded)
+            if methodname in self.result_schemas:
+                # Batch responses are decoded together, so the records are built afterwards.
+                decoded = self.result_schemas[methodname].convert(decoded)
+        elif self.hedger is not None and self.hedger.should_hedge(methodname) and not is_streaming(params):
+            decoded = self._send_hedged(data, dict(headers), priority)
+        else:
+            decoded = self._send(data, headers, priority)
+
+        return self._handle_result(methodname, decoded)
+
+    def _send(self, data, headers, priority=None, host=None):
+        """
+        Encodes and sends a single request and decodes the response.
 
-        response = self.transport.request(self.host, self.handler, body, headers=headers)
+        If the server refuses the request format (406 or 415) and it is not JSON, the
+        proxy switches to JSON and sends the request again.
 
-        self._handle_response(response)
+        :param data: The request data (C{dict}).
+        :type data: C{dict}
+
+        :param headers: Headers that will be sent with the request.
+        :type headers: C{dict}
+
+        :param priority: The request's priority when waiting for a limiter slot.
+        :type priority: C{int}
+
+        :param host: The host to send the request to (defaults to L{host}).
+        :type host: C{str}
+
+        :return: The decoded JSON-RPC response.
+
+        :raise ResponseError: If the response cannot be parsed.
+        :raise ProtocolError: Re-raises exception if non-200 response received.
+        """
+        return self._falling_back(lambda: self._send_once(data, headers, priority, host))
+
+    def _send_hedged(self, data, headers, priority=None):
+        """
+        Sends a request through the L{hedger}, which may send a second copy of it.
+
+        The attempts run on the hedger's threads and only read the response; the winner's
+        response is handled (see L{_handle_response}) and decoded here, on the caller's
+        thread, so that the proxy's state is never touched from two threads at once.
+
+        :return: The decoded JSON-RPC response.
+        """
+        def send():
+            fetched = self.hedger.call(data['method'], lambda host: self._fetch(data, dict(headers), priority, host),
+                                       self.host, discard=self._discard)
+            return self._finish(data, fetched)
+        return self._falling_back(send)
+
+    def _falling_back(self, send):
+        """
+        Sends a request, and sends it again as JSON if the server refuses the request
+        format (406 or 415) and it is not JSON.
+
+        :param send: Sends the request and returns the decoded response.
+        :type send: C{callable}
+        """
+        try:
+            return send()
+        except ProtocolError as x:
+            if x.errcode not in REFUSED_STATUSES or self.codec is JSON_CODEC:
+                raise
+            self.logger.info('Server %s%s refused %s (%s); falling back to JSON.' % (
+                self.host, self.handler, self.codec.content_type, x.errcode))
+            self.codec = JSON_CODEC
+            return send()
+
+    def _send_once(self, data, headers, priority=None, host=None):
+        return self._finish(data, self._fetch(data, headers, priority, host))
+
+    def _fetch(self, data, headers, priority=None, host=None):
+        """
+        Encodes and sends a request and reads the response body, leaving the response to
+        L{_finish}.  (It only reads the proxy's settings, so hedged attempts may run it on
+        other threads.)
+
+        :return: The request's tracing span, the response, its body and the headers sent.
+        :rtype: C{tuple}
+        """
+        host = host or self.host
+        span = self.tracer.start_span(host, self.handler, data.get('method'))
+        try:
+            body = self._encode(data)
+            headers = self._codec_headers(headers)
+
+            response = self.transport.request(host, self.handler, body, headers=headers, span=span,
+                                              priority=priority, method=data.get('method'))
+
+            try:
+                body = response.read()
+            except (socket.error, httplib.HTTPException) as x:
+                # The connection broke mid-response (e.g. reset or truncated), so it cannot be reused.
+                slot = getattr(response, 'limit_slot', None)
+                if slot is not None:
+                    slot.release(failed=True)
+                self.transport.handle_connection_error(host, x)
+                raise ConnectionError("Error reading response from host %s: %r" % (host, x))
+            span.mark('read_end')
+        except Exception as x:
+            span.end(x)
+            raise
+        return span, response, body, headers
+
+    def _finish(self, data, fetched):
+        """
+        Handles and decodes a response read by L{_fetch} (and caches it, if need be).
+
+        :return: The decoded JSON-RPC response.
+        """
+        span, response, body, headers = fetched
+        try:
+            self._handle_response(response)
+            decoded = self._parse_response(body, response.getheader('Content-Type'),
+                                           self.result_schemas.get(data.get('method')))
+            span.mark('decode_end')
+            if self.cache is not None and data.get('method') in self.cache_ttls:
+                self._cache_response(data, headers, response.getheader('Content-Type'), body, decoded)
+        except Exception as x:
+            span.end(x)
+            raise
+        span.end()
+        return decoded
+
+    def _discard(self, fetched):
+        """
+        Lets go of the response to a hedged attempt that lost (see L{_fetch}).
+        """
+        fetched[0].end()
+
+    def _codec_headers(self, headers, codec=None):
+        """
+        Returns a copy of the request headers with the Content-Type and Accept of a codec.
+
+        (The copy keeps the codec's headers out of L{extra_headers}, which notifications and
+        batches, always sent as JSON, share.)  A Content-Type or Accept header the caller set
+        is left alone for JSON.
+
+        :param headers: The request headers.
+        :type headers: C{dict}
 
-        data = response.read()
+        :param codec: The codec the body is encoded with (defaults to L{codec}).
 
+        :rtype: C{dict}
+        """
+        codec = codec or self.codec
+        headers = dict(headers)
+        for name in ('Content-Type', 'Accept'):
+            existing = [k for k in headers if k.lower() == name.lower()]
+            if existing and codec is JSON_CODEC:
+                continue
+            for k in existing:
+                del headers[k]
+            headers[name] = codec.content_type
+        return headers
+
+    def _cache_key(self, methodname, params, headers):
+        """
+        Builds the L{cache} key for a call.
+
+        Besides the host, handler, method and params, the key holds a digest of the
+        credentials sent (the Authorization, Proxy-Authorization and Cookie headers) and the
+        L{cache_namespace}, since the cache may be shared with proxies of other users.
+
+        :return: The key, or C{None} if the params cannot be serialised into one (e.g.
+                 C{bytes} for a binary codec), in which case the call is not cached.
+        :rtype: C{str}
+        """
+        credentials = hashlib.sha1()
+        for name, value in sorted((k.lower(), v) for k, v in headers.items()):
+            if name in _CREDENTIAL_HEADERS:
+                if not isinstance(value, bytes):
+                    value = str(value).encode('utf-8')
+                credentials.update(name.encode('ascii') + b':' + value + b'\n')
+        try:
+            return cache_key(self.host, self.handler, self.cache_namespace, credentials.hexdigest(),
+                             methodname, params)
+        except (TypeError, ValueError):
+            return None
+
+    def _cache_response(self, data, headers, content_type, body, decoded):
+        """
+        Stores a successful response in the L{cache}.
+
+        The encoded body is stored (with its content type), so that the other processes
+        sharing the cache decode it as they would a response from the server.
+        """
+        if is_streaming(data.get('params')) or not isinstance(decoded, dict) or decoded.get('error') \
+                or 'result' not in decoded:
+            return
+        key = self._cache_key(data['method'], data['params'], headers)
+        if key is not None:
+            self.cache.set(key, (content_type or '').encode('latin-1') + b'\n' + body,
+                           self.cache_ttls[data['method']])
+
+    def _cache_decoded(self, data, headers, decoded):
+        """
+        Stores a successful response that arrived without a body of its own (e.g. in a
+        batch) in the L{cache}, encoded as JSON.
+        """
+        if self.cache is not None and data.get('method') in self.cache_ttls:
+            self._cache_response(data, headers, JSON_CODEC.content_type,
+                                 JSON_CODEC.dumps(decoded).encode('utf-8'), decoded)
+
+    def _encode(self, data):
+        """
+        Encodes the request body.
+
+        Requests whose params are (or directly contain) iterators are encoded lazily,
+        into chunks that the transport streams to the server.  (This is only supported
+        by the JSON codec.)
+
+        :param data: The request data (C{dict}).
+        :type data: C{dict}
+
+        :return: The encoded request, or an iterator of encoded chunks.
+        """
+        if self.codec is JSON_CODEC and is_streaming(data.get('params')):
+            return iterencode(data, self.chunk_size)
+        return self.codec.dumps(data)
+
+    def _parse_response(self, data, content_type=None, schema=None):
+        """
+        Decodes the raw response body.
+
+        :param data: The response body.
+        :type data: C{bytes}
+
+        :param content_type: The response Content-Type, which picks the codec (default is L{codec}).
+        :type content_type: C{str}
+
+        :param schema: The record classes to decode objects into (optional).
+        :type schema: L{rpctools.jsonrpc.records.ResultSchema}
+
+        :return: The decoded JSON-RPC response.
+
+        :raise ResponseError: If the response cannot be parsed.
+        """
+        codec = codec_for_content_type(content_type, self.codec)
         try:
-            decoded = json.loads(data.decode('utf-8'))
+            if schema is not None:
+                return codec.loads(data, object_pairs_hook=schema.object_pairs_hook)
+            return codec.loads(data)
         except Exception as x:
-            raise ResponseError("Unable to parse response data as JSON: %s" % x)
+            raise ResponseError("Unable to parse response data as %s: %s" % (codec.content_type, x))
 
+    def _handle_result(self, methodname, decoded):
+        """
+        Extracts the result from a decoded JSON-RPC response.
+
+        :param methodname: Name of method that was called.
+        :type methodname: C{str}
+
+        :param decoded: The decoded JSON-RPC response.
+        :type decoded: C{dict}
+
+        :return: The decoded result.
+
+        :raise ResponseError: If the response is not proper JSON-RPC 1.0 response format.
+        :raise Fault: If the response is an error message from remote application.
+        """
         # This special casing for non-compliant systems like DD that sometimes
         # just return NULL from actions and think they're communicating w/ valid
         # JSON-RPC.
@@ -268,7 +818,7 @@ class RawServerProxy(ServerProxy):
     message, but simply returns the response data and file-like object.
     """
 
-    def _request(self, methodname, params):
+    def _request(self, methodname, params, priority=None):
         """
         Overriden __request method which stops short of performing any parsing of the response.
 
@@ -290,15 +840,136 @@ class RawServerProxy(ServerProxy):
 
         self._prepare_request(data, headers)
 
-        body = json.dumps(data)
+        body = self._encode(data)
+        headers = self._codec_headers(headers)
 
-        response = self.transport.request(self.host, self.handler, body, headers=headers)
+        if priority is None:
+            priority = self.priority
+
+        response = self.transport.request(self.host, self.handler, body, headers=headers, priority=priority)
 
         self._handle_response(response)
 
         return response
 
 
+class CookieJar(dict):
+    """
+    A dict of cookies (indexed by cookie name) that keeps track of changes.
+
+    Every mutation bumps L{version}, which lets L{CookieKeeperMixin} compile its
+    C{Cookie} header once and re-use it until the cookies actually change.
+
+    :ivar version: Incremented whenever the cookies change.
+    :type version: C{int}
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CookieJar, self).__init__(*args, **kwargs)
+        self.version = 0
+        self._merged = {}
+
+    def __setitem__(self, name, cookie):
+        super(CookieJar, self).__setitem__(name, cookie)
+        self.version += 1
+
+    def __delitem__(self, name):
+        super(CookieJar, self).__delitem__(name)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        super(CookieJar, self).update(*args, **kwargs)
+        self.version += 1
+
+    def setdefault(self, name, cookie=None):
+        if name not in self:
+            self[name] = cookie
+        return self[name]
+
+    def pop(self, *args):
+        result = super(CookieJar, self).pop(*args)
+        self.version += 1
+        return result
+
+    def popitem(self):
+        result = super(CookieJar, self).popitem()
+        self.version += 1
+        return result
+
+    def clear(self):
+        super(CookieJar, self).clear()
+        self.version += 1
+
+    def merge_set_cookie(self, header):
+        """
+        Merges the cookie from a C{Set-Cookie} header value, replacing any cookie of
+        the same name (or removing it, if the server expired it with C{Max-Age=0}).
+
+        Servers often repeat the same C{Set-Cookie} header on every response; a header
+        whose cookie is still the current one for its name is neither parsed again nor
+        counted as a change.
+
+        :param header: The C{Set-Cookie} header value.
+        :type header: C{str}
+        """
+        merged = self._merged.get(header)
+        if merged is not None and all(self.get(name) is cookie for name, cookie in merged):
+            return
+        if len(self._merged) > 64:
+            self._merged.clear()
+        merged = []
+        for name, morsel in SimpleCookie(header).items():
+            if morsel['max-age'] == '0':
+                self.pop(name, None)
+                merged.append((name, None))
+            else:
+                cookie = SimpleCookie(morsel.OutputString())
+                self[name] = cookie
+                merged.append((name, cookie))
+        self._merged[header] = merged
+
+    def morsels(self):
+        """
+        :return: (name, morsel) pairs for every cookie in the jar.
+        :rtype: C{list}
+        """
+        return [item for cookie in self.values() for item in cookie.items()]
+
+
+def compile_cookie_header(*jars):
+    """
+    Builds a C{Cookie} request header value from cookie jars.
+
+    Later jars win when several hold a cookie with the same name.
+
+    :param jars: The cookie jars (e.g. response cookies, then request cookies).
+    :type jars: C{dict} of C{str} to C{Cookie.SimpleCookie}
+
+    :return: The header value (empty if there are no cookies).
+    :rtype: C{str}
+    """
+    values = {}
+    names = []
+    for jar in jars:
+        for name, morsel in jar.morsels():
+            if name not in values:
+                names.append(name)
+            values[name] = morsel.coded_value
+    return '; '.join('%s=%s' % (name, values[name]) for name in names)
+
+
+def _get_all_headers(msg, name):
+    """
+    Returns all values of a (repeated) header from an httplib message.
+    """
+    if hasattr(msg, 'get_all'):
+        return msg.get_all(name) or []
+    return msg.getheaders(name)
+
+
+_session_ids = itertools.count(1)
+
+
 class CookieKeeperMixin(object):
     """
     A L{ServerProxy} that supports receiving and setting cookies.
@@ -306,18 +977,25 @@ class CookieKeeperMixin(object):
     IMPORTANT: If this class is being used to support cookie-based sessions,
     it should be noted that it will only support a single session.  I.e. a
     single instance of this class should only pool connections for a single
-    session!
+    session!  To keep connections for many sessions, give each session its own
+    instance and share a L{SessionPool} between them (C{session_pool}); each
+    session's calls then reuse the same connection.
 
     THIS CLASS IS NOT THREAD SAFE.
 
-    :ivar response_cookies: A dict of all cookies sent from server (Set-Cookie headers), indexed by cookie name.
-    :type response_cookies: C{dict} of C{str} to C{Cookie.SimpleCookie}
+    :ivar response_cookies: All cookies sent from server (Set-Cookie headers), indexed by cookie name.
+    :type response_cookies: L{CookieJar}
 
-    :ivar request_cookies: A dict of all cookies that will be sent to server, indexed by cookie name.
-    :type request_cookies: C{dict} of C{str} to C{Cookie.SimpleCookie}
+    :ivar request_cookies: All cookies that will be sent to server, indexed by cookie name.
+    :type request_cookies: L{CookieJar}
 
     :ivar auto_add_cookies: Whether to automatically append any received response cookies to requests.
     :type auto_add_cookies: C{bool}
+
+    :ivar session_pool: The pool that keeps this session's connections (if any).
+    :type session_pool: L{rpctools.jsonrpc.pool.SessionPool}
+
+    :ivar session_key: Identifies this session in the L{session_pool}.
     """
     auto_add_cookies = False
 
@@ -325,13 +1003,63 @@ class CookieKeeperMixin(object):
         """
         :keyword request_cookies: A dict of request cookies that should be included.
         :type request_cookies: C{dict}
+
+        :keyword session_pool: A pool shared by the proxies of many sessions, which keeps a
+                               connection for each session (implies connection pooling).
+        :type session_pool: L{rpctools.jsonrpc.pool.SessionPool}
+
+        :keyword session_key: Identifies the session in the pool (e.g. a user id), so that
+                              later proxies for the same session reuse its connection.
+                              (Defaults to a key unique to this proxy.)
         """
-        self.response_cookies = {}
-        self.request_cookies = {}
-        if 'request_cookies' in kwargs:
-            self.request_cookies = kwargs.pop('request_cookies')
+        self._cookie_header_key = None
+        self._cookie_header = ''
+        self._cookie_written = None
+        self.response_cookies = CookieJar()
+        self.request_cookies = kwargs.pop('request_cookies', {})
+        self.session_pool = kwargs.pop('session_pool', None)
+        self.session_key = kwargs.pop('session_key', None)
+        if self.session_key is None:
+            self.session_key = 'session-%d' % next(_session_ids)
         super(CookieKeeperMixin, self).__init__(*args, **kwargs)
 
+    @property
+    def request_cookies(self):
+        return self._request_cookies
+
+    @request_cookies.setter
+    def request_cookies(self, cookies):
+        # (A plain dict is copied into a jar, so that its changes can be tracked.)
+        self._request_cookies = cookies if isinstance(cookies, CookieJar) else CookieJar(cookies)
+        self._cookie_header_key = None
+
+    @property
+    def response_cookies(self):
+        return self._response_cookies
+
+    @response_cookies.setter
+    def response_cookies(self, cookies):
+        self._response_cookies = cookies if isinstance(cookies, CookieJar) else CookieJar(cookies)
+        self._cookie_header_key = None
+
+    def _transport_class(self, pool_connections):
+        """
+        Extends base implementation to use a session-affine transport with a L{session_pool}.
+        """
+        if self.session_pool is None:
+            return super(CookieKeeperMixin, self)._transport_class(pool_connections)
+        return SessionAffinityPoolSafeTransport if self.type == "https" else SessionAffinityPoolTransport
+
+    def _create_transport(self, pool_connections):
+        """
+        Extends base implementation to tie session-affine transports to this session.
+        """
+        transport = super(CookieKeeperMixin, self)._create_transport(pool_connections)
+        if self.session_pool is not None:
+            transport.session_pool = self.session_pool
+            transport.session_key = self.session_key
+        return transport
+
     def add_cookie(self, cookie):
         """
         Adds a *copy* of specified cookie to the request.
@@ -344,12 +1072,14 @@ class CookieKeeperMixin(object):
         :type cookie: C{Cookie.SimpleCookie}
         """
         for (name, morsel) in cookie.items():
-            self.request_cookies[name] = SimpleCookie(morsel.output())
+            self.request_cookies[name] = SimpleCookie(morsel.OutputString())
 
     def _prepare_request(self, data, headers):
         """
         Extends base implementation to add any saved cookies to the request headers.
 
+        The C{Cookie} header is only recompiled when the cookies have changed.
+
         :param data: The request data (C{dict}) that will be sent to server.
         :type data: C{dict}
 
@@ -359,39 +1089,34 @@ class CookieKeeperMixin(object):
         """
         super(CookieKeeperMixin, self)._prepare_request(data, headers)
 
-        req_cookies = {}
-        if self.auto_add_cookies and self.response_cookies:
-            req_cookies.update(self.response_cookies)
-
-        if self.request_cookies:
-            req_cookies.update(self.request_cookies)
+        auto_add = self.auto_add_cookies
+        key = (self.request_cookies.version, self.response_cookies.version if auto_add else None)
+        if key != self._cookie_header_key:
+            if auto_add:
+                self._cookie_header = compile_cookie_header(self.response_cookies, self.request_cookies)
+            else:
+                self._cookie_header = compile_cookie_header(self.request_cookies)
+            self._cookie_header_key = key
 
-        for cookie in req_cookies.values():
-            for name, morsel in cookie.items():
-                headers["Cookie"] = "%s=%s" % (name, morsel.value)
+        if self._cookie_header:
+            headers["Cookie"] = self._cookie_written = self._cookie_header
+        elif self._cookie_written is not None:
+            # Only a Cookie header this proxy wrote (e.g. into extra_headers) is removed.
+            if headers.get("Cookie") == self._cookie_written:
+                del headers["Cookie"]
+            self._cookie_written = None
 
     def _handle_response(self, response):
         """
-        Extends base implementation to extract any cookies from the response.
+        Extends base implementation to merge any cookies from the response (by name)
+        into L{response_cookies}.
 
         :param response: The HTTP response object.
         :type response: C{httplib.HTTPResponse}
         """
         super(CookieKeeperMixin, self)._handle_response(response)
-        if len(response.msg.getheaders("Set-Cookie")):
-            # Build a dict of cookies; we only want to keep the *last* cookie
-            # set with a specific name.
-            cookies = {}
-            for hdr in response.msg.getheaders("Set-Cookie"):
-                cookie = SimpleCookie(hdr)
-                # XXX: This is a bit ugly looking.  Basically we are only going to
-                # get one cookie at a time from this header; however, the SimpleCookie
-
-                # object is designed to support multiple cookie names/values.
-                key = cookie.keys()[0]
-                cookies[key] = cookie
-
-            self.response_cookies = cookies
+        for hdr in _get_all_headers(response.msg, "Set-Cookie"):
+            self.response_cookies.merge_set_cookie(hdr)
 
 
 class CookieAwareServerProxy(CookieKeeperMixin, ServerProxy):
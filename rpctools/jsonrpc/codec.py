@@ -0,0 +1,140 @@
+"""
+Wire formats for JSON-RPC messages.
+
+JSON is the default.  For numeric-heavy payloads a binary format such as MessagePack
+(requires the C{msgpack} package) or CBOR (requires C{cbor2}) is smaller and much
+cheaper to encode and decode.  The message structure, and so the L{Fault} and
+L{ResponseError} semantics, is the same whatever the format.
+"""
+from __future__ import absolute_import
+
+import json
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# Statuses with which a server refuses a request body format it does not support.
+REFUSED_STATUSES = (406, 415)
+
+
+class JSONCodec(object):
+    """
+    The default (JSON) wire format.
+
+    :ivar content_type: The MIME type sent in the Content-Type and Accept headers.
+    :type content_type: C{str}
+    """
+    name = 'json'
+    content_type = 'application/json'
+
+    def dumps(self, data):
+        """
+        :return: The encoded message.
+        :rtype: C{str}
+        """
+        return json.dumps(data)
+
+    def loads(self, data, object_pairs_hook=None):
+        """
+        :param data: The encoded message.
+        :type data: C{bytes}
+
+        :param object_pairs_hook: Called with the (key, value) pairs of each decoded object,
+                                  in place of building a dict (see L{rpctools.jsonrpc.records}).
+        :type object_pairs_hook: C{callable}
+        """
+        return json.loads(data.decode('utf-8'), object_pairs_hook=object_pairs_hook)
+
+
+class MsgpackCodec(object):
+    """
+    The MessagePack wire format (requires the C{msgpack} package).
+    """
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, data):
+        return self._msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, data, object_pairs_hook=None):
+        return self._msgpack.unpackb(data, raw=False, object_pairs_hook=object_pairs_hook)
+
+
+class CBORCodec(object):
+    """
+    The CBOR wire format (requires the C{cbor2} package).
+    """
+    name = 'cbor'
+    content_type = 'application/cbor'
+
+    def __init__(self):
+        import cbor2
+        self._cbor2 = cbor2
+
+    def dumps(self, data):
+        return self._cbor2.dumps(data)
+
+    def loads(self, data, object_pairs_hook=None):
+        if object_pairs_hook is None:
+            return self._cbor2.loads(data)
+        # cbor2 only offers a hook for the finished dicts.
+        return self._cbor2.loads(data, object_hook=lambda decoder, value: object_pairs_hook(list(value.items())))
+
+
+JSON_CODEC = JSONCodec()
+
+CODECS = {
+    'json': JSONCodec,
+    'msgpack': MsgpackCodec,
+    'cbor': CBORCodec,
+}
+
+
+def get_codec(codec):
+    """
+    Returns a codec instance.
+
+    :param codec: A codec name ('json', 'msgpack' or 'cbor'), a codec instance, or
+                  C{None} for JSON.
+
+    :raise ValueError: If the name is not known.
+    :raise ImportError: If the codec's package is not installed.
+    """
+    if codec is None or codec == 'json':
+        return JSON_CODEC
+    if isinstance(codec, str):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec %r (expected one of %s)' % (codec, ', '.join(sorted(CODECS))))
+        return CODECS[codec]()
+    return codec
+
+
+def codec_for_content_type(content_type, default):
+    """
+    Picks the codec matching a response Content-Type header.
+
+    :param content_type: The header value (may include parameters, or be C{None}).
+    :type content_type: C{str}
+
+    :param default: The codec to use if the type is missing or not recognised.
+    """
+    if content_type:
+        mime = content_type.split(';', 1)[0].strip().lower()
+        if mime == default.content_type:
+            return default
+        if mime == JSON_CODEC.content_type:
+            return JSON_CODEC
+    return default
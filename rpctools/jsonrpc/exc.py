@@ -32,18 +32,50 @@ class ConnectionError(JsonRpcError):
     """
 
 
+class ConcurrencyLimitExceeded(JsonRpcError):
+    """
+    Indicates that a request was not sent because too many requests to the host were
+    already in flight (see L{rpctools.jsonrpc.limiter}).
+    """
+
+
+class PoolClosed(JsonRpcError):
+    """
+    Indicates that a request was not sent because the connection pools are being (or have
+    been) drained (see L{rpctools.jsonrpc.pool.drain}).
+    """
+
+
+class RateLimitExceeded(JsonRpcError):
+    """
+    Indicates that a request was not sent because it would exceed the client-side rate
+    limit for the host or method (see L{rpctools.jsonrpc.ratelimit}).
+
+    :ivar retry_after: The seconds until a request would be allowed.
+    :type retry_after: C{float}
+    """
+    def __init__(self, message, retry_after):
+        JsonRpcError.__init__(self, message)
+        self.retry_after = retry_after
+
+
 class ProtocolError(JsonRpcError):
     """
     Indicates an HTTP protocol error.
 
     This exception is raised when a non-200 response is received from the server.
+
+    :ivar retry_after: The seconds the response's Retry-After header asked the client to
+                       wait (C{None} if it had none).
+    :type retry_after: C{float}
     """
-    def __init__(self, url, errcode, errmsg, headers):
+    def __init__(self, url, errcode, errmsg, headers, retry_after=None):
         JsonRpcError.__init__(self, url, errcode, errmsg, headers)
         self.url = url
         self.errcode = errcode
         self.errmsg = errmsg
         self.headers = headers
+        self.retry_after = retry_after
 
     def __repr__(self):
         return (
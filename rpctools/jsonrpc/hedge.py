@@ -0,0 +1,318 @@
+"""
+Hedged requests for idempotent methods.
+
+When a call has not been answered within a delay, a second copy is sent (on another
+connection, or to another endpoint) and whichever answers first is used.  Because the
+delay follows each method's observed 95th percentile latency, only about the slowest 5%
+of calls are hedged; a budget caps hedges at a fraction of all calls so that a slow
+backend is not also hit with double the load.
+
+Only methods known to be idempotent are hedged, since both copies may be executed.
+"""
+from __future__ import absolute_import
+
+import sys
+import time
+import logging
+import itertools
+import threading
+from collections import deque
+
+from rpctools.six import reraise
+from rpctools.jsonrpc.stats import percentile
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class _Race(object):
+    """
+    The attempts at one call; the first to succeed wins.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.launched = 0
+        self.finished = 0
+        self.result = None
+        self.won = False
+        self.errors = []
+
+    def report(self, result=None, exc_info=None):
+        with self.condition:
+            self.finished += 1
+            if exc_info is not None:
+                self.errors.append(exc_info)
+            elif not self.won:
+                self.won = True
+                self.result = result
+            self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Waits (up to C{timeout}) until there is a winner or every attempt has failed.
+
+        :return: Whether the race is over.
+        :rtype: C{bool}
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not self.won and self.finished < self.launched:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+
+class _MethodLatency(object):
+    """
+    Recent latencies of one method and the hedge delay derived from them.
+    """
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.delay = None
+        self.since_update = 0
+
+
+class _Thread(object):
+    """
+    A worker thread's hand-off point: the attempt it is to run next.
+    """
+    __slots__ = ('ready', 'task')
+
+    def __init__(self, task):
+        self.ready = threading.Event()
+        self.task = task
+
+
+class Hedger(object):
+    """
+    Sends hedged copies of slow calls to idempotent methods.
+
+    A hedger runs the attempts on worker threads, so that the caller can return as soon as
+    either attempt answers.  Every attempt starts at once on a thread of its own: an idle
+    worker is reused, or else another is started, so calls never wait behind each other and
+    the hedge delay is not eaten into by queueing.  (Up to C{workers} idle threads are kept
+    for reuse; the rest exit.)  With a pooling transport every worker keeps its own
+    keep-alive connections, so a hedge always goes out on a different connection than the
+    attempt it backs up.  The losing attempt is not interrupted (that would cost its
+    connection); its response is read and discarded.
+
+    A hedger may be shared by several proxies (and threads); L{close} stops its threads.
+
+    :ivar idempotent: The names of the methods that may be hedged.
+    :type idempotent: C{set}
+
+    :ivar endpoints: Hosts (in "host:port" syntax) to send hedges to, in turn.  If empty,
+                     hedges go to the proxy's own host.
+    :type endpoints: C{list}
+
+    :ivar quantile: The latency percentile after which a call is hedged.
+    :type quantile: C{float}
+
+    :ivar budget: The most hedges to send, as a fraction of all hedgeable calls.
+    :type budget: C{float}
+
+    :ivar calls: The number of hedgeable calls made.
+    :type calls: C{int}
+
+    :ivar hedges: The number of hedges sent.
+    :type hedges: C{int}
+
+    :ivar hedge_wins: The number of calls answered by a hedge rather than the first attempt.
+    :type hedge_wins: C{int}
+    """
+
+    def __init__(self, idempotent=(), endpoints=None, quantile=95, budget=0.05, initial_delay=0.05,
+                 min_delay=0.001, max_delay=1.0, min_samples=20, window=1000, workers=16, idle_timeout=30.0):
+        """
+        :param initial_delay: The hedge delay used until a method has C{min_samples} latencies.
+        :param min_delay: The shortest hedge delay.
+        :param max_delay: The longest hedge delay.
+        :param window: How many recent latencies per method the delay is computed from.
+        :param workers: The most idle worker threads to keep for reuse.  (This does not
+                        limit the attempts in flight.)
+        :param idle_timeout: Seconds an idle worker thread waits for another attempt before exiting.
+        """
+        self.logger = logging.getLogger('{0.__module__}.{0.__name__}'.format(self.__class__))
+        self.idempotent = set(idempotent)
+        self.endpoints = list(endpoints or [])
+        self.quantile = quantile
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = {}
+        self._next_endpoint = 0
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.closed = False
+        self._lock = threading.Lock()
+        self._idle = []
+        self._threads = itertools.count(1)
+
+    def should_hedge(self, methodname):
+        """
+        :rtype: C{bool}
+        """
+        return methodname in self.idempotent
+
+    def delay(self, methodname):
+        """
+        :return: Seconds to wait for a call to the method before hedging it.
+        :rtype: C{float}
+        """
+        stats = self._latencies.get(methodname)
+        if stats is None or stats.delay is None:
+            return self.initial_delay
+        return stats.delay
+
+    def call(self, methodname, send, host, discard=None):
+        """
+        Makes a call, hedging it if it is slow.
+
+        :param methodname: The method being called.
+        :type methodname: C{str}
+
+        :param send: Performs one attempt; called with the host to send it to.
+        :type send: C{callable}
+
+        :param host: The host for the first attempt.
+        :type host: C{str}
+
+        :param discard: Called (on a worker thread) with the result of each attempt that
+                        succeeds after another has won.
+        :type discard: C{callable}
+
+        :return: The result of the first attempt to succeed.
+
+        :raise Exception: The first attempt's error, if every attempt fails.  (An attempt
+                          that fails before the delay is not hedged.)
+        """
+        if self.closed:
+            return send(host)
+        race = _Race()
+        with self._lock:
+            self.calls += 1
+        self._launch(race, methodname, send, host, discard, hedge=False)
+
+        if not race.wait(self.delay(methodname)) and self._take_hedge():
+            self._launch(race, methodname, send, self._hedge_host(host), discard, hedge=True)
+        race.wait()
+
+        if race.won:
+            return race.result
+        reraise(*race.errors[0])
+
+    def close(self):
+        """
+        Stops the idle worker threads (busy ones exit once their attempt is done).  Calls
+        made afterwards are sent once, on the caller's thread, without hedging.
+        """
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for thread in idle:
+            thread.ready.set()
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def _hedge_host(self, host):
+        if not self.endpoints:
+            return host
+        with self._lock:
+            endpoint = self.endpoints[self._next_endpoint % len(self.endpoints)]
+            self._next_endpoint += 1
+            return endpoint
+
+    def _launch(self, race, methodname, send, host, discard, hedge):
+        """
+        Starts an attempt on an idle worker thread, or on a new one.
+        """
+        with race.condition:
+            race.launched += 1
+        task = (race, methodname, send, host, discard, hedge)
+        with self._lock:
+            if self._idle:
+                thread = self._idle.pop()
+                thread.task = task
+                thread.ready.set()
+                return
+        thread = _Thread(task)
+        t = threading.Thread(target=self._work, args=(thread,),
+                             name='%s-%d' % (self.__class__.__name__, next(self._threads)))
+        t.daemon = True
+        t.start()
+
+    def _work(self, thread):
+        while True:
+            task, thread.task = thread.task, None
+            self._attempt(*task)
+            with self._lock:
+                if self.closed or len(self._idle) >= self.workers:
+                    return
+                thread.ready.clear()
+                self._idle.append(thread)
+            thread.ready.wait(self.idle_timeout)
+            with self._lock:
+                if thread.task is None:  # (Timed out, or the hedger was closed.)
+                    if thread in self._idle:
+                        self._idle.remove(thread)
+                    return
+
+    def _attempt(self, race, methodname, send, host, discard, hedge):
+        started = time.time()
+        try:
+            result = send(host)
+        except Exception:
+            race.report(exc_info=sys.exc_info())
+            return
+        self._observe(methodname, time.time() - started)
+        with race.condition:
+            first = not race.won
+            race.report(result)
+        if first and hedge:
+            with self._lock:
+                self.hedge_wins += 1
+        elif not first and discard is not None:
+            try:
+                discard(result)
+            except Exception:
+                self.logger.exception('Error discarding the result of a losing attempt')
+
+    def _observe(self, methodname, latency):
+        """
+        Records an attempt's latency and periodically refreshes the method's hedge delay.
+        """
+        with self._lock:
+            stats = self._latencies.get(methodname)
+            if stats is None:
+                stats = self._latencies[methodname] = _MethodLatency(self.window)
+            stats.samples.append(latency)
+            stats.since_update += 1
+            if len(stats.samples) >= self.min_samples and (stats.delay is None or
+                                                           stats.since_update >= max(1, self.window // 20)):
+                delay = percentile(sorted(stats.samples), self.quantile)
+                stats.delay = min(self.max_delay, max(self.min_delay, delay))
+                stats.since_update = 0
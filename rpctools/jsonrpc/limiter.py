@@ -0,0 +1,345 @@
+"""
+Adaptive limits on the number of requests in flight to each host.
+
+A fixed pool size is either too small (leaving throughput unused) or too large
+(overloading the backend when it slows down).  L{AdaptiveLimiter} instead adjusts a
+per-host limit with AIMD: while latency stays near its long-term level the limit grows
+by about one per round trip; when latency rises well above that level, or requests fail,
+it is cut multiplicatively.  Callers beyond the limit wait in line (up to a timeout) or
+are rejected at once with L{ConcurrencyLimitExceeded}.  Waiting callers are served by
+priority, so interactive calls need not queue behind background batch work.
+"""
+from __future__ import absolute_import
+
+import time
+import heapq
+import itertools
+import threading
+
+from rpctools.jsonrpc.exc import ConcurrencyLimitExceeded
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# Priorities for calls; lower values are served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BATCH = 10
+
+
+class _Waiter(object):
+    """
+    A caller waiting in line for a slot.
+    """
+    __slots__ = ('condition', 'granted', 'cancelled')
+
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)
+        self.granted = False
+        self.cancelled = False
+
+    def wait(self, timeout):
+        self.condition.wait(timeout)
+
+    def notify(self):
+        self.condition.notify()
+
+
+class HostLimit(object):
+    """
+    The adaptive limit for one host.
+
+    :ivar limit: The current limit (fractional; the integer part is enforced).
+    :type limit: C{float}
+
+    :ivar in_flight: Requests currently in flight.
+    :type in_flight: C{int}
+
+    :ivar queued: Callers currently waiting for a slot.
+    :type queued: C{int}
+
+    :ivar rejected: Callers turned away since creation.
+    :type rejected: C{int}
+    """
+
+    def __init__(self, owner, host):
+        self.owner = owner
+        self.host = host
+        self.limit = float(owner.initial_limit)
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.short_latency = None
+        self.long_latency = None
+        self._since_decrease = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=None):
+        """
+        Take a slot, waiting in line if the limit has been reached.
+
+        Waiters are served in priority order (lowest value first).  To keep low-priority
+        callers from starving, a waiter's priority improves by one level for every
+        C{aging} seconds it has waited.
+
+        :param priority: The caller's priority (default L{PRIORITY_NORMAL}).
+        :type priority: C{int}
+
+        :return: Seconds spent waiting for the slot.
+        :rtype: C{float}
+
+        :raise ConcurrencyLimitExceeded: If no slot frees up in time (or at once, when
+                                         the limiter does not queue).
+        """
+        owner = self.owner
+        if priority is None:
+            priority = PRIORITY_NORMAL
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return 0.0
+            if not owner.block or self.queued >= owner.max_queue:
+                self.rejected += 1
+                raise ConcurrencyLimitExceeded('Too many requests in flight to host %s (limit %d)' % (self.host, int(self.limit)))
+            enqueued = time.time()
+            deadline = None if owner.queue_timeout is None else enqueued + owner.queue_timeout
+            waiter = _Waiter(self._lock)
+            # Aging makes the effective priority (priority - waited / aging) fall at the
+            # same rate for everyone, so the order fixed at enqueue time stays correct.
+            key = priority + enqueued / owner.aging if owner.aging else priority
+            heapq.heappush(self._waiters, (key, next(self._sequence), waiter))
+            self.queued += 1
+            try:
+                while not waiter.granted:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        waiter.cancelled = True
+                        self.rejected += 1
+                        raise ConcurrencyLimitExceeded('Timed out waiting for a request slot to host %s (limit %d)' % (self.host, int(self.limit)))
+                    waiter.wait(remaining)
+            finally:
+                self.queued -= 1
+            return time.time() - enqueued
+
+    def release(self, latency, failed=False):
+        """
+        Give back a slot and adjust the limit.
+
+        :param latency: Seconds the request took (ignored if it failed).
+        :type latency: C{float}
+
+        :param failed: Whether the request failed in a way that suggests overload.
+        :type failed: C{bool}
+        """
+        owner = self.owner
+        with self._lock:
+            limited = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self._since_decrease += 1
+            if failed:
+                self._decrease()
+            elif latency is not None:
+                if self.long_latency is None:
+                    self.short_latency = self.long_latency = latency
+                else:
+                    self.short_latency += owner.short_weight * (latency - self.short_latency)
+                    self.long_latency += owner.long_weight * (latency - self.long_latency)
+                if self.short_latency > self.long_latency * owner.tolerance:
+                    self._decrease()
+                elif limited:
+                    # Only grow when the limit was actually holding callers back.
+                    self.limit = min(owner.max_limit, self.limit + 1.0 / self.limit)
+            self._grant()
+
+    def _grant(self):
+        """
+        Hands free slots to the best waiters.  (Called with the lock held.)
+        """
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, waiter = heapq.heappop(self._waiters)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.notify()
+
+    def _decrease(self):
+        # Cut at most once per round trip's worth of completions, so that one slow
+        # burst does not collapse the limit.
+        if self._since_decrease >= max(1, self.in_flight):
+            self.limit = max(self.owner.min_limit, self.limit * self.owner.backoff)
+            self._since_decrease = 0
+
+    def stats(self):
+        """
+        :return: The current limit, requests in flight, waiting callers and rejections.
+        :rtype: C{dict}
+        """
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'rejected': self.rejected,
+                'latency': self.short_latency,
+            }
+
+
+class _Slot(object):
+    """
+    A request's slot, given back once its response has been read (or has failed).
+    """
+    __slots__ = ('limit', 'started')
+
+    def __init__(self, limit, started):
+        self.limit = limit
+        self.started = started
+
+    def release(self, failed=False):
+        limit, self.limit = self.limit, None
+        if limit is not None:
+            limit.release(time.time() - self.started, failed)
+
+
+class _ReleasingFile(object):
+    """
+    A response's file, which gives back the request's slot when it is closed (as
+    C{httplib.HTTPResponse} does at the end of the body).
+
+    The response also closes its file when the body turns out to be short, just before
+    raising C{IncompleteRead}, so the request only counts as a success if the whole body
+    was read: the declared length was used up, or (for a chunked body) the blank line
+    ending the trailer was seen.
+    """
+
+    def __init__(self, fp, slot, response):
+        self.fp = fp
+        self.slot = slot
+        self.response = response
+        self.ended = False
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+    def readline(self, *args):
+        line = self.fp.readline(*args)
+        if line in (b'\r\n', b'\n'):
+            # (Chunk sizes are never blank, so this can only be the end of the trailer.)
+            self.ended = True
+        return line
+
+    def complete(self):
+        """
+        :return: Whether the response body was read to the end.
+        :rtype: C{bool}
+        """
+        if getattr(self.response, 'chunked', False):
+            return self.ended
+        # (Without a declared length, the body ends when the connection does.)
+        return not getattr(self.response, 'length', None)
+
+    def close(self):
+        try:
+            self.fp.close()
+        finally:
+            self.slot.release(failed=not self.complete())
+
+
+def hold_until_read(response, limit, started):
+    """
+    Keeps a request's slot until its response body has been read to the end (or the
+    response is closed), so that the body transfer counts towards the requests in flight
+    and the latency.  A response closed before the end of its body (e.g. a truncated
+    one) gives back the slot as failed.
+
+    The slot is set as the response's C{limit_slot}; release it with C{failed=True} if
+    reading the body fails.
+
+    :param response: The response, whose body has not been read.
+    :type response: C{httplib.HTTPResponse}
+
+    :param limit: The limit the slot was acquired from.
+    :type limit: L{HostLimit}
+
+    :param started: When the request was sent.
+    :type started: C{float}
+    """
+    slot = response.limit_slot = _Slot(limit, started)
+    fp = getattr(response, 'fp', None)
+    if fp is None:
+        slot.release()  # (There is nothing left to read.)
+    else:
+        response.fp = _ReleasingFile(fp, slot, response)
+
+
+class AdaptiveLimiter(object):
+    """
+    Keeps an adaptive in-flight limit for every host a transport talks to.
+
+    Assign one to a transport's C{limiter} attribute (or pass it to L{ServerProxy}).
+    It may be shared by many transports and threads.
+
+    :ivar initial_limit: The limit a host starts with.
+    :ivar min_limit: The limit never drops below this.
+    :ivar max_limit: The limit never grows beyond this.
+    :ivar backoff: The factor the limit is multiplied by when it is cut.
+    :ivar tolerance: How far above its long-term level short-term latency may rise
+                     before the limit is cut (e.g. 2.0 for double).
+    :ivar block: Whether callers beyond the limit wait (C{True}) or are rejected at once.
+    :ivar queue_timeout: Seconds a caller may wait for a slot (C{None} for no limit).
+    :ivar max_queue: The most callers that may wait per host; more are rejected.
+    :ivar aging: Seconds of waiting that raise a waiter's priority by one level (C{0} to
+                 serve strictly by priority).
+    """
+
+    short_weight = 0.2
+    long_weight = 0.01
+
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=200, backoff=0.9, tolerance=2.0,
+                 block=True, queue_timeout=None, max_queue=1000, aging=0.1):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.block = block
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.aging = aging
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host):
+        """
+        :rtype: L{HostLimit}
+        """
+        try:
+            return self._hosts[host]
+        except KeyError:
+            with self._lock:
+                return self._hosts.setdefault(host, HostLimit(self, host))
+
+    def limit(self, host):
+        """
+        :return: The current in-flight limit for a host.
+        :rtype: C{int}
+        """
+        return int(self.for_host(host).limit)
+
+    def stats(self):
+        """
+        :return: L{HostLimit.stats} for every host, indexed by host.
+        :rtype: C{dict}
+        """
+        return dict((host, h.stats()) for host, h in list(self._hosts.items()))
@@ -0,0 +1,174 @@
+"""
+A load generator built on L{ServerProxy} and the pooled transports.
+
+Usage::
+
+    python -m rpctools.jsonrpc.loadgen https://example.com/jsonrpc someMethod \\
+        --params params.json --concurrency 32 --rate 500 --duration 30
+
+With C{--rate} the generator runs open-loop: calls are scheduled at fixed intervals
+whether or not earlier calls have finished, and each call's latency is measured from
+its scheduled start.  A slow backend therefore shows up as tail latency instead of
+silently lowering the request rate ("coordinated omission").  Without C{--rate} each
+worker calls back-to-back (closed loop) to find the maximum throughput.
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import json
+import time
+import argparse
+import threading
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.stats import LoadReport
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class LoadGenerator(object):
+    """
+    Calls one method repeatedly from several threads and collects latencies.
+
+    Every worker thread has its own pooling L{ServerProxy} (proxies are not thread-safe),
+    so each worker keeps one keep-alive connection open.
+
+    :ivar concurrency: The number of worker threads (the most calls in flight).
+    :type concurrency: C{int}
+
+    :ivar duration: Seconds to generate load for.
+    :type duration: C{float}
+
+    :ivar rate: Calls per second to schedule (open loop), or C{None} for closed loop.
+    :type rate: C{float}
+
+    :ivar total: Stop after this many calls (optional).
+    :type total: C{int}
+    """
+
+    def __init__(self, proxy_factory, method, params=None, concurrency=1, duration=10.0, rate=None, total=None):
+        """
+        :param proxy_factory: Returns a new L{ServerProxy} (called once per worker).
+        :type proxy_factory: C{callable}
+
+        :param method: The (dotted) method name to call.
+        :type method: C{str}
+
+        :param params: The positional (C{list}) or keyword (C{dict}) parameters.
+        """
+        self.proxy_factory = proxy_factory
+        self.method = method
+        self.params = params if params is not None else []
+        self.concurrency = max(1, concurrency)
+        self.duration = duration
+        self.rate = rate
+        self.total = total
+
+    def run(self):
+        """
+        Generates the load and waits for the calls in flight to finish.
+
+        :rtype: L{LoadReport}
+        """
+        lock = threading.Lock()
+        latencies = []
+        errors = {}
+        counter = [0]
+        proxies = [self.proxy_factory() for _ in range(self.concurrency)]
+        start = time.time()
+        stop = start + self.duration if self.duration else None
+        interval = 1.0 / self.rate if self.rate else None
+
+        def next_due():
+            """
+            Claims the next call; returns its scheduled start, or None when done.
+            """
+            with lock:
+                i = counter[0]
+                if self.total is not None and i >= self.total:
+                    return None
+                counter[0] += 1
+            due = start + i * interval if interval else time.time()
+            if stop is not None and due >= stop:
+                return None
+            return due
+
+        def worker(proxy):
+            call = getattr(proxy, self.method)
+            positional = isinstance(self.params, (list, tuple))
+            while True:
+                due = next_due()
+                if due is None:
+                    return
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    if positional:
+                        call(*self.params)
+                    else:
+                        call(**self.params)
+                except Exception as x:
+                    with lock:
+                        name = x.__class__.__name__
+                        errors[name] = errors.get(name, 0) + 1
+                else:
+                    latency = time.time() - due
+                    with lock:
+                        latencies.append(latency)
+
+        threads = [threading.Thread(target=worker, args=(proxy,)) for proxy in proxies]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        return LoadReport(len(latencies), errors, time.time() - start, latencies)
+
+
+def main(argv=None):
+    """
+    Command-line entry point.
+    """
+    parser = argparse.ArgumentParser(prog='python -m rpctools.jsonrpc.loadgen',
+                                     description='Generate JSON-RPC load and report throughput and latency.')
+    parser.add_argument('uri', help='The JSON-RPC endpoint URI.')
+    parser.add_argument('method', help='The (dotted) method name to call.')
+    parser.add_argument('--params', metavar='FILE', help='A JSON file holding the params list or object.')
+    parser.add_argument('--concurrency', '-c', type=int, default=1, help='Worker threads (default: %(default)s).')
+    parser.add_argument('--duration', '-d', type=float, default=10.0, help='Seconds to run (default: %(default)s).')
+    parser.add_argument('--rate', '-r', type=float, help='Target calls/s (open loop); default is closed loop.')
+    parser.add_argument('--requests', '-n', type=int, help='Stop after this many calls.')
+    parser.add_argument('--timeout', type=float, help='Socket timeout in seconds.')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    args = parser.parse_args(argv)
+
+    params = []
+    if args.params:
+        with open(args.params) as f:
+            params = json.load(f)
+
+    def proxy_factory():
+        return ServerProxy(args.uri, pool_connections=True, timeout=args.timeout)
+
+    report = LoadGenerator(proxy_factory, args.method, params, concurrency=args.concurrency,
+                           duration=args.duration, rate=args.rate, total=args.requests).run()
+    if args.json:
+        print(json.dumps(report.as_dict(), sort_keys=True))
+    else:
+        print(report)
+    return 1 if report.errors and not report.completed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Support for fire-and-forget JSON-RPC notifications.
+
+Notifications are requests without an id; the server sends no result back, so there is
+no reason to make the caller wait for the round trip.  They are instead put on a bounded
+queue and sent by a background worker thread.
+"""
+from __future__ import absolute_import
+
+import time
+import logging
+import threading
+
+from rpctools.six.moves import queue
+from rpctools.jsonrpc.exc import JsonRpcError
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+_STOP = object()
+
+
+class NotificationQueue(object):
+    """
+    A bounded queue of encoded notifications that is drained by a worker thread.
+
+    The worker is started on the first L{put} and sends with its own transport; when
+    that is a pooling transport the worker keeps a single keep-alive connection open.
+
+    :ivar overflows: The number of notifications dropped because the queue was full.
+    :type overflows: C{int}
+
+    :ivar sent: The number of notifications the server accepted.
+    :type sent: C{int}
+
+    :ivar errors: The number of notifications lost to connection or protocol errors.
+    :type errors: C{int}
+    """
+
+    def __init__(self, transport, host, handler, maxsize=1000, batch_size=1, block=False):
+        """
+        :param transport: The transport the worker sends with.
+        :type transport: L{rpctools.jsonrpc.transport.Transport}
+
+        :param host: The host (optionally in "host:port" syntax).
+        :type host: C{str}
+
+        :param handler: Target RPC handler (e.g. '/jsonrpc').
+        :type handler: C{str}
+
+        :param maxsize: The most notifications that may wait to be sent.
+        :type maxsize: C{int}
+
+        :param batch_size: The most queued notifications to coalesce into one batch POST.
+                           (The default of 1 sends every notification on its own.)
+        :type batch_size: C{int}
+
+        :param block: Whether L{put} should wait for room rather than drop the notification.
+        :type block: C{bool}
+        """
+        self.logger = logging.getLogger('{0.__module__}.{0.__name__}'.format(self.__class__))
+        self.transport = transport
+        self.host = host
+        self.handler = handler
+        self.batch_size = max(1, batch_size)
+        self.block = block
+        self.overflows = 0
+        self.sent = 0
+        self.errors = 0
+        self.closed = False
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._abandon = False
+        self._stopped = False
+
+    def put(self, body, headers):
+        """
+        Queue an encoded notification for sending.
+
+        :param body: The encoded JSON-RPC notification.
+        :type body: C{str}
+
+        :param headers: HTTP headers to send with the notification.
+        :type headers: C{dict}
+
+        :return: Whether the notification was queued (C{False} if it was dropped).
+        :rtype: C{bool}
+
+        :raise JsonRpcError: If the queue has been closed.
+        """
+        if self.closed or (self._worker is None and not self._start()):
+            raise JsonRpcError('Notification queue for %s%s is closed.' % (self.host, self.handler))
+        try:
+            self._queue.put((body, headers), self.block)
+        except queue.Full:
+            with self._lock:
+                self.overflows += 1
+            return False
+        with self._lock:
+            stranded = self._stopped
+        if stranded:
+            # The queue was closed meanwhile, and the worker has already stopped.
+            self._drop_queued(0)
+            raise JsonRpcError('Notification queue for %s%s is closed.' % (self.host, self.handler))
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued notification has been sent (or has failed).
+
+        :param timeout: The most seconds to wait (default is to wait forever).
+        :type timeout: C{float}
+
+        :return: Whether the queue was drained in time.
+        :rtype: C{bool}
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Stop accepting notifications, send the ones already queued and stop the worker.
+
+        If the queue is still full when the timeout runs out, the notifications that have
+        not been sent by then are dropped (and counted in L{errors}).  Closing again only
+        waits for the worker.
+
+        :param timeout: The most seconds to wait for the worker to finish.
+        :type timeout: C{float}
+
+        :return: Whether the worker finished in time.
+        :rtype: C{bool}
+        """
+        with self._lock:
+            stopping = not self.closed
+            self.closed = True
+        if self._worker is None:
+            return True
+        if stopping:
+            try:
+                self._queue.put(_STOP, True, timeout)
+            except queue.Full:
+                # The worker is falling behind: have it stop after what it is sending now.
+                self._abandon = True
+                try:
+                    self._queue.put_nowait(_STOP)  # (In case it has drained the queue meanwhile.)
+                except queue.Full:
+                    pass
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+    def _start(self):
+        """
+        :return: Whether the worker is running (it is not started once the queue is closed).
+        :rtype: C{bool}
+        """
+        with self._lock:
+            if self.closed:
+                return False
+            if self._worker is None:
+                worker = threading.Thread(target=self._run, name='rpctools-notify-%s' % self.host)
+                worker.daemon = True
+                worker.start()
+                self._worker = worker
+            return True
+
+    def _run(self):
+        """
+        Worker loop: take notifications off the queue, coalescing consecutive ones that
+        share headers into a batch, until the stop marker is seen.
+        """
+        pending = None
+        while True:
+            item = pending if pending is not None else self._queue.get()
+            pending = None
+            if item is _STOP or self._abandon:
+                self._queue.task_done()
+                with self._lock:
+                    # (From now on, a put that raced close() drops what it queued itself.)
+                    self._stopped = True
+                self._drop_queued(0 if item is _STOP else 1)
+                self.transport.close()  # (Pooled connections belong to this thread.)
+                return
+            bodies = [item[0]]
+            headers = item[1]
+            while len(bodies) < self.batch_size:
+                try:
+                    pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is _STOP or pending[1] != headers:
+                    break
+                bodies.append(pending[0])
+                pending = None
+            try:
+                self._send(bodies, headers)
+            finally:
+                for _ in bodies:
+                    self._queue.task_done()
+
+    def _drop_queued(self, dropped):
+        """
+        Empties the queue once the worker is stopping, counting the dropped notifications.
+        """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if item is not _STOP:
+                dropped += 1
+        if dropped:
+            self.logger.warning('Dropped %d queued notification(s) to %s%s on close' % (dropped, self.host,
+                                                                                         self.handler))
+            with self._lock:
+                self.errors += dropped
+
+    def _send(self, bodies, headers):
+        """
+        Send one notification or a batch of them, discarding whatever the server returns.
+        """
+        if len(bodies) == 1:
+            body = bodies[0]
+        else:
+            body = '[' + ','.join(bodies) + ']'
+        try:
+            response = self.transport.request(self.host, self.handler, body, headers=dict(headers))
+            response.read()
+        except Exception as x:  # (Not just JsonRpcError: nothing may stop the worker.)
+            self.logger.warning('Dropped %d notification(s) to %s%s: %r' % (len(bodies), self.host, self.handler, x))
+            with self._lock:
+                self.errors += len(bodies)
+        else:
+            with self._lock:
+                self.sent += len(bodies)
@@ -1,8 +1,37 @@
 """
 Support for connection pooling.  (BETA!)
+
+Pools are fork-aware: a forked child (e.g. a gunicorn or uWSGI pre-fork worker) drops
+the connections it inherited from its parent, so that two processes never end up sharing
+one (TLS) stream.  Connections registered with L{warm_after_fork} are re-opened lazily in
+each child, on the first pool checkout after the fork.
+
+L{TLSConnectionPoolMixin.warm} opens connections ahead of time (e.g. on deploy, so that
+the first calls do not pay for TCP and TLS handshakes).  They are kept as spares and
+handed to threads whose pools have no connection to the host yet.
+
+L{pool_stats} reports on the pooled connections of every thread, by host (e.g. for a
+health endpoint).  L{drain} shuts the pools down gracefully: it stops new checkouts, waits
+for the requests in progress and closes the connections.
+
+L{SessionPool} keeps connections for many sessions (e.g. of cookie-based logins), with
+affinity: each session's calls go over the same warm connection to the same backend,
+within a bound on the connections per host.  See L{SessionAffinityPoolMixin}.
 """
 from __future__ import absolute_import
+
+import os
+import time
+import select
+import socket
+import weakref
+import threading
 from threading import local as ThreadLocal
+from collections import deque, OrderedDict
+
+from rpctools.six.moves import http_client as httplib
+from rpctools.jsonrpc.exc import PoolClosed
+from rpctools.jsonrpc.stats import summarize
 
 __license__ = """Licensed under the Apache License, Version 2.0 (the "License");
 you may not use this file except in compliance with the License.
@@ -24,13 +53,347 @@ class Pool(ThreadLocal):
 
     @ivar connections: Thread-local connection pool.
     :type connections: C{dict} of C{str} to C{httplib.HTTPConnection}
+
+    :ivar pid: The process that opened the connections.
+    :type pid: C{int}
+
+    :ivar pending_warmup: (transport, host) pairs whose connections should be opened on next checkout.
+    :type pending_warmup: C{list}
+
+    :ivar session_connections: The connection this thread's latest request through each
+                               session-affine transport went over, by host (see
+                               L{SessionAffinityPoolMixin}).
+    :type session_connections: C{weakref.WeakKeyDictionary}
     """
     def __init__(self):
         self.connections = {}
+        self.session_connections = weakref.WeakKeyDictionary()
+        self.pid = os.getpid()
+        self.pending_warmup = list(_warmups) if _forked else []
+        _pools.add(self)
+
+    def reset(self):
+        """
+        Forget this thread's connections without shutting them down.
+
+        Used in forked children: the inherited sockets still belong to the parent, so
+        they are merely dereferenced.  (Collecting them only closes the child's copy of
+        the file descriptor, which does not affect the parent's stream.)
+        """
+        self.connections = {}
+        self.session_connections = weakref.WeakKeyDictionary()
+        self.pid = os.getpid()
+        self.pending_warmup = list(_warmups)
+
+
+_pools = weakref.WeakSet()
+_session_pools = weakref.WeakSet()
+_warmups = []
+_forked = False
+_spares = {}
+_spares_lock = threading.Lock()
+
+# The number of recent checkout waits kept per host (see pool_stats).
+WAIT_SAMPLES = 1000
+
+# Every connection handed out by a pool (in any thread), and the counters for each host.
+_live = weakref.WeakSet()
+_host_stats = {}
+_stats_lock = threading.Lock()
+# Set by drain(): no more connections are handed out.
+_closed = False
+
+
+class _HostStats(object):
+    """
+    Counters for the pooled connections to one host, in all threads.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.creations = 0
+        self.evictions = 0
+        self.dropped = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+
+def _host_stats_for(host):
+    """
+    :return: The counters for a host (call with L{_stats_lock} held).
+    :rtype: L{_HostStats}
+    """
+    stats = _host_stats.get(host)
+    if stats is None:
+        stats = _host_stats[host] = _HostStats()
+    return stats
+
+
+def _checked_out(conn, host, dropped, started):
+    """
+    Records that a pooled connection has been handed out for a request.
+
+    :param dropped: Whether the server had closed the connection (so it will be reopened).
+    :param started: When the request began (so the wait until checkout is known), if it did.
+    """
+    now = time.time()
+    with _stats_lock:
+        if _closed:
+            raise PoolClosed("Connection pools are closed; not connecting to host %s" % host)
+        stats = _host_stats_for(host)
+        stats.checkouts += 1
+        if dropped:
+            stats.dropped += 1
+        if conn.sock is None:
+            # (It is opened when the request is sent.)
+            stats.creations += 1
+            conn.pool_created = now
+        elif getattr(conn, 'pool_created', None) is None:
+            conn.pool_created = now
+        if started is not None:
+            stats.waits.append(now - started)
+        conn.pool_host = host
+        conn.pool_thread = threading.current_thread().name
+        conn.pool_checkouts = getattr(conn, 'pool_checkouts', 0) + 1
+        conn.pool_last_used = now
+        conn.pool_busy = True
+        conn.pool_response = None
+        _live.add(conn)
+
+
+def _released(conn, response):
+    """
+    Records that the request a connection was checked out for has returned.
+
+    :param response: The response, which keeps the connection in use until it has been read.
+    :type response: C{httplib.HTTPResponse}
+    """
+    if getattr(conn, 'pool_busy', False):
+        conn.pool_busy = False
+        conn.pool_response = response
+        conn.pool_last_used = time.time()
+
+
+def _in_use(conn):
+    if getattr(conn, 'pool_busy', False):
+        return True
+    response = getattr(conn, 'pool_response', None)
+    return response is not None and not response.isclosed()
+
+
+def _evicted(host, conn):
+    """
+    Records that a connection has been removed from a pool after an error.
+    """
+    with _stats_lock:
+        _host_stats_for(host).evictions += 1
+        if conn is not None:
+            _live.discard(conn)
+
+
+def pool_stats(connections=True):
+    """
+    Reports on the pooled connections of every thread in this process, by host.
+
+    For each host (as the pools key it, e.g. "example.com:443") the report has:
+
+        open          connections with an open socket (including spares)
+        in_use        open connections with a request in progress or a response being read
+        idle          open connections that are not in use
+        spare         connections opened by L{TLSConnectionPoolMixin.warm} and not yet taken
+        checkouts     connections handed out for requests
+        creations     connections opened (or reopened)
+        evictions     connections removed from a pool after an error
+        dropped       idle connections and spares found closed by the server (and reopened
+                      or discarded)
+        wait          seconds from the start of a request until its connection was handed
+                      out (including any rate limiter and concurrency limiter waits), over
+                      the last L{WAIT_SAMPLES} checkouts (see L{rpctools.jsonrpc.stats.summarize})
+        connections   for each open connection: the thread that holds it (C{None} for
+                      spares), its age, whether it is in use, when it was last used (a
+                      C{time.time()} timestamp), the seconds it has been idle and its checkouts
+
+    Nothing is locked while requests are in flight, so this is cheap enough to poll.
+
+    :param connections: Whether to list the connections (or only count them).
+    :type connections: C{bool}
+
+    :rtype: C{dict} of C{str} to C{dict}
+    """
+    now = time.time()
+    with _stats_lock:
+        tracked = [conn for conn in list(_live) if conn.sock is not None]
+        counters = dict((host, (s.checkouts, s.creations, s.evictions, s.dropped, list(s.waits)))
+                        for host, s in _host_stats.items())
+    spares = {}
+    with _spares_lock:
+        for key, conns in _spares.items():
+            spares.setdefault(key[1], []).extend(conn for conn in conns if conn.sock is not None)
+
+    report = {}
+
+    def for_host(host):
+        entry = report.get(host)
+        if entry is None:
+            checkouts, creations, evictions, dropped, waits = counters.get(host, (0, 0, 0, 0, []))
+            entry = report[host] = {
+                'open': 0, 'in_use': 0, 'idle': 0, 'spare': 0,
+                'checkouts': checkouts, 'creations': creations, 'evictions': evictions, 'dropped': dropped,
+                'wait': summarize(waits),
+            }
+            if connections:
+                entry['connections'] = []
+        return entry
+
+    for host in counters:
+        for_host(host)
+    for conn in tracked:
+        entry = for_host(conn.pool_host)
+        in_use = _in_use(conn)
+        entry['open'] += 1
+        entry['in_use' if in_use else 'idle'] += 1
+        if connections:
+            entry['connections'].append({
+                'thread': conn.pool_thread,
+                'age': now - conn.pool_created,
+                'in_use': in_use,
+                'last_used': conn.pool_last_used,
+                'idle': 0.0 if in_use else now - conn.pool_last_used,
+                'checkouts': conn.pool_checkouts,
+            })
+    for host, conns in spares.items():
+        if not conns:
+            continue
+        entry = for_host(host)
+        entry['open'] += len(conns)
+        entry['idle'] += len(conns)
+        entry['spare'] += len(conns)
+        if connections:
+            for conn in conns:
+                created = getattr(conn, 'pool_created', now)
+                entry['connections'].append({'thread': None, 'age': now - created, 'in_use': False,
+                                             'last_used': created, 'idle': now - created, 'checkouts': 0})
+    return report
+
+
+def warm_after_fork(transport, host):
+    """
+    Register a connection to open in each forked child before its first request.
+
+    Call this in the parent, before forking workers.  The connection is opened lazily,
+    on the first pool checkout in each thread of the child, so that the TCP (and TLS)
+    handshakes happen after the fork and never on an inherited socket.
+
+    :param transport: A pooling transport (e.g. L{TLSConnectionPoolSafeTransport}) used to
+                      create the connection.
+    :type transport: L{TLSConnectionPoolMixin}
+
+    :param host: The host (optionally in "host:port" syntax).
+    :type host: C{str}
+    """
+    _warmups.append((transport, host))
+
+
+def _after_fork_in_child():
+    """
+    Drop connections inherited from the parent process in every pool.
+    """
+    global _forked
+    _forked = True
+    _spares.clear()
+    _live.clear()
+    _host_stats.clear()
+    for p in list(_pools):
+        p.reset()
+    for p in list(_session_pools):
+        p.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+    _check_pid = False
+else:
+    # Older Pythons have no fork hooks; compare pids on checkout instead.
+    _check_pid = True
 
 pool = Pool()
 
 
+def is_connection_dropped(conn):
+    """
+    Checks whether an idle pooled connection has been closed by the server.
+
+    An idle keep-alive socket should have nothing to read; if it is readable, the server
+    has closed (or half-closed) it, or sent something unexpected.  Either way it cannot
+    carry another request.
+
+    :param conn: The connection.
+    :type conn: C{httplib.HTTPConnection}
+
+    :rtype: C{bool}
+    """
+    sock = conn.sock
+    if sock is None:
+        return False
+    try:
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return bool(poller.poll(0))
+        return bool(select.select([sock], [], [], 0)[0])
+    except (ValueError, select.error, socket.error):
+        return True
+
+
+def drain(timeout=None):
+    """
+    Shuts down the connection pools of every thread (e.g. before a process exits).
+
+    New checkouts are refused at once (requests fail with L{PoolClosed}).  Then the
+    requests in progress are given until the timeout to finish (including reading their
+    responses), and the idle connections and spares are closed.  Connections still in use
+    when the timeout runs out are left to their requests, and closed by their threads'
+    next attempt to check one out.
+
+    :param timeout: The most seconds to wait for the requests in progress (default is to
+                    wait for as long as they take).
+    :type timeout: C{float}
+
+    :return: Whether every request in progress finished in time.
+    :rtype: C{bool}
+    """
+    global _closed
+    deadline = None if timeout is None else time.time() + timeout
+    with _stats_lock:
+        _closed = True
+    while True:
+        with _stats_lock:
+            # (A connection checked out but not yet connected has no socket, and is busy too.)
+            busy = [conn for conn in list(_live) if _in_use(conn)]
+        if not busy or (deadline is not None and time.time() >= deadline):
+            break
+        time.sleep(0.01)
+    with _stats_lock:
+        idle = [conn for conn in list(_live) if not _in_use(conn)]
+        for conn in idle:
+            _live.discard(conn)
+    with _spares_lock:
+        for conns in _spares.values():
+            idle.extend(conns)
+        _spares.clear()
+    for conn in idle:
+        conn.close()
+    return not busy
+
+
+def reopen():
+    """
+    Lets the pools hand out connections again after L{drain}.
+    """
+    global _closed
+    with _stats_lock:
+        _closed = False
+
+
 class TLSConnectionPoolMixin(object):
     """
     A mixin for Transport classes that attempts to use connections from a thread-local-storage
@@ -46,32 +409,477 @@ class TLSConnectionPoolMixin(object):
     :rtype: C{httplib.HTTPConnection}
     """
 
-    def request(self, host, handler, body, headers=None, verbose=False):
+    def request(self, host, handler, body, headers=None, verbose=False, span=None, priority=None, method=None):
         """
         Override to add Connection: keep-alive header to request.
         """
         if headers is None:
             headers = {}
         headers['Connection'] = 'keep-alive'
-        return super(TLSConnectionPoolMixin, self).request(host, handler, body, headers=headers, verbose=verbose)
+        pool.request_started = time.time()
+        response = None
+        try:
+            response = super(TLSConnectionPoolMixin, self).request(host, handler, body, headers=headers, verbose=verbose,
+                                                                   span=span, priority=priority, method=method)
+            return response
+        finally:
+            pool.request_started = None
+            conn = self._checked_out_connection(host)
+            if conn is not None:
+                _released(conn, response)
 
     def connect(self, host):
         """
         Overrides method to return an existing connection from thread-local pool
         instead of creating a new one.
+
+        :raise PoolClosed: If the pools have been drained (see L{drain}).
         """
+        if _check_pid and pool.pid != os.getpid():
+            _after_fork_in_child()
+        started, pool.request_started = getattr(pool, 'request_started', None), None
+        if pool.pending_warmup:
+            self._warm_up()
+        dropped = False
         if host not in pool.connections:
-            self.logger.debug("No connection in pool for %s, creating." % host)
-            conn = super(TLSConnectionPoolMixin, self).connect(host)
+            conn = self._take_spare(host)
+            if conn is None:
+                self.logger.debug("No connection in pool for %s, creating." % host)
+                conn = super(TLSConnectionPoolMixin, self).connect(host)
+            else:
+                self.logger.debug("Using pre-warmed connection for %s." % host)
             pool.connections[host] = conn
         else:
             self.logger.debug("Found EXISTING connection in pool for %s." % host)
             conn = pool.connections[host]
+            dropped = is_connection_dropped(conn)
+            if dropped:
+                self.logger.debug("Pooled connection to %s was closed by the server; reopening." % host)
+                conn.close()
+        self.__dict__.setdefault('_hosts', set()).add(host)
+        try:
+            _checked_out(conn, host, dropped, started)
+        except PoolClosed:
+            pool.connections.pop(host, None)
+            conn.close()
+            raise
         return conn
 
+    def close(self):
+        """
+        Closes the calling thread's pooled connections to the hosts this transport has
+        connected to.  (Other threads' connections are theirs to close; see L{drain}.)
+        """
+        for host in list(self.__dict__.get('_hosts', ())):
+            conn = pool.connections.pop(host, None)
+            if conn is not None:
+                with _stats_lock:
+                    _live.discard(conn)
+                conn.close()
+
+    def _hand_off(self, conn):
+        """
+        Overrides method to keep the connection for the next request.
+        """
+
+    def _checked_out_connection(self, host):
+        """
+        :return: The connection that the calling thread's request to the host was sent on.
+        :rtype: C{httplib.HTTPConnection}
+        """
+        return pool.connections.get(host)
+
+    def handle_connection_error(self, host, x):
+        """
+        Remove the offending connection from the pool, and close it.
+        """
+        self.logger.info('Deleting bad connection to host %s' % host)
+        conn = pool.connections.pop(host, None)
+        _evicted(host, conn)
+        if conn is not None:
+            conn.close()
+
+    def warm(self, host, n, timeout=10.0):
+        """
+        Open (and, for HTTPS, handshake) connections to a host ahead of time, in parallel.
+
+        The connections are kept as spares; a thread whose pool has no connection to the
+        host takes one instead of opening its own.  Spares are dropped in forked children.
+
+        :param host: The host (optionally in "host:port" syntax).
+        :type host: C{str}
+
+        :param n: The number of connections to open.
+        :type n: C{int}
+
+        :param timeout: Seconds to allow for all of the connections to be opened (those that
+                        are not ready by then are closed and not counted).
+        :type timeout: C{float}
+
+        :return: The number of connections opened.
+        :rtype: C{int}
+        """
+        deadline = time.time() + timeout
+        opened = []
+        accepting = [True]
+        lock = threading.Lock()
+
+        def open_one():
+            conn = super(TLSConnectionPoolMixin, self).connect(host)
+            socket_timeout = conn.timeout
+            conn.timeout = timeout
+            try:
+                conn.connect()
+            except (socket.error, httplib.HTTPException) as x:
+                self.logger.info('Unable to warm up connection to host %s: %r' % (host, x))
+                return
+            conn.sock.settimeout(socket.getdefaulttimeout() if socket_timeout is socket._GLOBAL_DEFAULT_TIMEOUT
+                                 else socket_timeout)
+            conn.timeout = socket_timeout
+            conn.pool_created = time.time()
+            with lock:
+                if accepting[0] and time.time() <= deadline:
+                    opened.append(conn)
+                    return
+            conn.close()
+
+        threads = [threading.Thread(target=open_one) for _ in range(n)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join(max(0, deadline - time.time()))
+        with lock:
+            # Connections that are still being opened will close themselves.
+            accepting[0] = False
+            ready = list(opened)
+        with _spares_lock:
+            _spares.setdefault(self._spare_key(host), []).extend(ready)
+        with _stats_lock:
+            _host_stats_for(host).creations += len(ready)
+        self.logger.debug('Warmed up %d of %d connections to host %s' % (len(ready), n, host))
+        return len(ready)
+
+    def _take_spare(self, host):
+        """
+        Spares are idle longer than any other connection, often past the server's
+        keep-alive timeout, so those the server has closed are dropped rather than handed out.
+
+        :return: A pre-warmed connection to the host, or C{None}.
+        """
+        conn = None
+        dead = []
+        with _spares_lock:
+            spares = _spares.get(self._spare_key(host))
+            while spares:
+                candidate = spares.pop()
+                if not is_connection_dropped(candidate):
+                    conn = candidate
+                    break
+                dead.append(candidate)
+        if dead:
+            self.logger.debug("%d pre-warmed connections to %s were closed by the server; dropping." % (len(dead), host))
+            with _stats_lock:
+                _host_stats_for(host).dropped += len(dead)
+            for candidate in dead:
+                candidate.close()
+        return conn
+
+    def _spare_key(self, host):
+        """
+        Spares are only shared by transports of the same class with the same connection
+        settings, so that a connection opened (and validated) with one transport's TLS
+        options is never taken by a transport with others.
+
+        :return: The key of the host's spares for this transport.
+        :rtype: C{tuple}
+        """
+        ssl_opts = getattr(self, 'ssl_opts', None) or {}
+        return (self.__class__, host, repr(sorted(ssl_opts.items())), getattr(self, 'validate_cert_hostname', None),
+                repr(sorted((self.socket_opts or {}).items())))
+
+    def _warm_up(self):
+        """
+        Open the connections registered with L{warm_after_fork} in this thread's pool.
+        """
+        warmups, pool.pending_warmup = pool.pending_warmup, []
+        for transport, host in warmups:
+            if host in pool.connections:
+                continue
+            conn = transport.connect(host)
+            try:
+                conn.connect()
+            except (socket.error, httplib.HTTPException) as x:
+                self.logger.info('Unable to warm up connection to host %s: %r' % (host, x))
+                pool.connections.pop(host, None)
+            finally:
+                _released(conn, None)
+
+
+class SessionPool(object):
+    """
+    Pooled connections with affinity to sessions, shared by all threads.
+
+    Each connection belongs to the session that last used it, and a session's calls go
+    over its own idle connection when it has one, so that the backend it reaches already
+    has the session at hand.  The connections to each host are kept in least recently
+    used order, and bounded:
+
+        - a session without an idle connection takes over the least recently used idle
+          connection of another session once the host has L{max_connections};
+        - otherwise it gets a new connection, and the least recently used idle connections
+          beyond the bound are closed.
+
+    (So there may be more connections than the bound while they are all in use.)
+
+    :ivar max_connections: The most connections kept to each host.
+    :type max_connections: C{int}
+    """
+
+    def __init__(self, max_connections=100):
+        """
+        :param max_connections: The most connections to keep to each host.
+        :type max_connections: C{int}
+        """
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self.reset()
+        _session_pools.add(self)
+
+    def reset(self):
+        """
+        Forget the connections without shutting them down (see L{Pool.reset}).
+        """
+        # host -> OrderedDict of connection -> session, least recently used first
+        self._lru = {}
+        # (host, session) -> connections
+        self._sessions = {}
+        # host -> [hits, recycled, evicted]
+        self._counts = {}
+
+    def checkout(self, host, session):
+        """
+        Hands out an idle connection for a session: its own, or else (if the host has
+        L{max_connections}) the least recently used one of another session.
+
+        :return: The connection (marked in use), or C{None} if a new one is needed (see L{add}).
+        :rtype: C{httplib.HTTPConnection}
+        """
+        conn = None
+        with self._lock:
+            lru = self._lru.get(host)
+            if lru is None:
+                return None
+            for candidate in self._sessions.get((host, session), ()):
+                if not _in_use(candidate):
+                    conn = candidate
+                    self._count(host, 0)
+                    break
+            else:
+                if len(lru) >= self.max_connections:
+                    for candidate, owner in lru.items():
+                        if not _in_use(candidate):
+                            conn = candidate
+                            self._forget(host, conn, owner)
+                            self._sessions.setdefault((host, session), []).append(conn)
+                            self._count(host, 1)
+                            break
+            if conn is not None:
+                self._claim(lru, conn, session)
+            evicted = self._trim(host, lru)
+        self._close(evicted)
+        return conn
+
+    def add(self, host, session, conn):
+        """
+        Adds a new connection (in use) for a session, closing the least recently used idle
+        connections beyond L{max_connections}.
+        """
+        with self._lock:
+            lru = self._lru.setdefault(host, OrderedDict())
+            self._sessions.setdefault((host, session), []).append(conn)
+            self._claim(lru, conn, session)
+            evicted = self._trim(host, lru)
+        self._close(evicted)
+
+    def remove(self, host, session, conn):
+        """
+        Removes a session's connection (e.g. a broken one) from the pool; it is not closed.
+
+        :return: C{False} if another session has taken the connection over since (so it is
+                 left to that session), else C{True}.
+        :rtype: C{bool}
+        """
+        with self._lock:
+            owner = self._lru.get(host, {}).get(conn, session)
+            if owner != session:
+                return False
+            if conn in self._lru.get(host, ()):
+                self._forget(host, conn, session)
+            return True
+
+    def remove_session(self, host, session):
+        """
+        Removes a session's connections to a host from the pool; they are not closed.
+
+        :return: The connections.
+        :rtype: C{list}
+        """
+        with self._lock:
+            conns = list(self._sessions.get((host, session), ()))
+            for conn in conns:
+                self._forget(host, conn, session)
+        return conns
+
+    def close(self):
+        """
+        Closes every connection in the pool (cutting off any calls in progress on them).
+        """
+        with self._lock:
+            conns = [conn for lru in self._lru.values() for conn in lru]
+            self._lru.clear()
+            self._sessions.clear()
+        self._close(conns)
+
+    def stats(self):
+        """
+        :return: For each host, the connections kept, the sessions they belong to, and the
+                 checkouts that reused a session's own connection ('hits'), that took over
+                 another session's ('recycled') and the idle connections closed to stay
+                 within the bound ('evicted').
+        :rtype: C{dict}
+        """
+        with self._lock:
+            return dict((host, {'connections': len(lru),
+                                'sessions': len(set(lru.values())),
+                                'hits': self._counts.get(host, [0, 0, 0])[0],
+                                'recycled': self._counts.get(host, [0, 0, 0])[1],
+                                'evicted': self._counts.get(host, [0, 0, 0])[2]})
+                        for host, lru in self._lru.items())
+
+    def _claim(self, lru, conn, session):
+        """
+        Marks a connection in use (so that no other thread takes it) and most recently used.
+        (Called with the lock held.)
+        """
+        conn.pool_busy = True
+        conn.pool_response = None
+        lru.pop(conn, None)
+        lru[conn] = session
+
+    def _trim(self, host, lru):
+        """
+        Removes the least recently used idle connections beyond the bound.  (Called with
+        the lock held.)
+
+        :return: The connections removed, to be closed.
+        :rtype: C{list}
+        """
+        evicted = []
+        for conn, owner in list(lru.items()):
+            if len(lru) <= self.max_connections:
+                break
+            if not _in_use(conn):
+                self._forget(host, conn, owner)
+                self._count(host, 2)
+                evicted.append(conn)
+        return evicted
+
+    def _close(self, evicted):
+        if evicted:
+            with _stats_lock:
+                for conn in evicted:
+                    _live.discard(conn)
+            for conn in evicted:
+                conn.close()
+
+    def _forget(self, host, conn, session):
+        del self._lru[host][conn]
+        conns = self._sessions[(host, session)]
+        conns.remove(conn)
+        if not conns:
+            del self._sessions[(host, session)]
+
+    def _count(self, host, which):
+        counts = self._counts.get(host)
+        if counts is None:
+            counts = self._counts[host] = [0, 0, 0]
+        counts[which] += 1
+
+
+class SessionAffinityPoolMixin(TLSConnectionPoolMixin):
+    """
+    A mixin for Transport classes that keeps connections in a L{SessionPool} rather than
+    the thread-local pool, so that each session's calls reuse its connection (in any thread).
+
+    Set L{session_pool} and L{session_key} after construction; each session should have
+    its own transport.  (A transport may still carry calls from several threads at once,
+    e.g. hedged attempts: the connection each call went over is kept per thread.)
+
+    :ivar session_pool: The pool (shared by the transports of all sessions).
+    :type session_pool: L{SessionPool}
+
+    :ivar session_key: Identifies the session in the pool (any hashable value).
+    """
+    session_pool = None
+    session_key = None
+
+    def connect(self, host):
+        """
+        Overrides method to return the session's connection from the session pool (or one
+        recycled from another session, or a new one).
+
+        :raise PoolClosed: If the pools have been drained (see L{drain}).
+        """
+        if _check_pid and pool.pid != os.getpid():
+            _after_fork_in_child()
+        started, pool.request_started = getattr(pool, 'request_started', None), None
+        dropped = False
+        conn = self.session_pool.checkout(host, self.session_key)
+        if conn is None:
+            conn = self._take_spare(host)
+            if conn is None:
+                self.logger.debug("No idle connection for session %r to %s, creating." % (self.session_key, host))
+                conn = super(TLSConnectionPoolMixin, self).connect(host)
+            self.session_pool.add(host, self.session_key, conn)
+        else:
+            dropped = is_connection_dropped(conn)
+            if dropped:
+                self.logger.debug("Pooled connection to %s was closed by the server; reopening." % host)
+                conn.close()
+        pool.session_connections.setdefault(self, {})[host] = conn
+        self.__dict__.setdefault('_hosts', set()).add(host)
+        try:
+            _checked_out(conn, host, dropped, started)
+        except PoolClosed:
+            self.session_pool.remove(host, self.session_key, conn)
+            conn.close()
+            raise
+        return conn
+
+    def close(self):
+        """
+        Closes the session's connections to the hosts this transport has connected to.
+        """
+        for host in list(self.__dict__.get('_hosts', ())):
+            conns = self.session_pool.remove_session(host, self.session_key)
+            with _stats_lock:
+                for conn in conns:
+                    _live.discard(conn)
+            for conn in conns:
+                conn.close()
+
+    def _checked_out_connection(self, host):
+        return pool.session_connections.get(self, {}).get(host)
+
     def handle_connection_error(self, host, x):
         """
-        Remove the offending connection from the pool.
+        Remove the offending connection from the session pool, and close it.
         """
         self.logger.info('Deleting bad connection to host %s' % host)
-        del pool.connections[host]
+        conn = pool.session_connections.get(self, {}).pop(host, None)
+        if conn is not None and not self.session_pool.remove(host, self.session_key, conn):
+            conn = None  # (Another session has it now, and will find it broken.)
+        _evicted(host, conn)
+        if conn is not None:
+            conn.close()
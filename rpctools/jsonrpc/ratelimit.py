@@ -0,0 +1,262 @@
+"""
+Client-side rate limits, per host and per method.
+
+A backend that throttles answers excess requests with 429 (or 503), which costs a round
+trip and surfaces as a L{ProtocolError}.  A L{RateLimiter} keeps requests within the rates
+the backend allows before they are sent: each host (and, optionally, each method on a
+host) has a token bucket, and a request takes a token from each bucket it falls under.
+Callers wait for a token or, with C{block=False}, are rejected at once with
+L{RateLimitExceeded}.
+
+When the server throttles anyway and says for how long (with a Retry-After header), the
+host's buckets are paused for that long, so requests the server would only reject are not
+sent.  For example::
+
+    limiter = RateLimiter(rate=50, methods={'reports.generate': 1})
+    proxy = ServerProxy(uri, rate_limiter=limiter)
+"""
+from __future__ import absolute_import
+
+import time
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+from rpctools.jsonrpc.exc import RateLimitExceeded
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# Statuses whose Retry-After header pauses a host.
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value, now=None):
+    """
+    Parses a Retry-After header value.
+
+    :param value: Delay seconds (e.g. "120") or an HTTP date.
+    :type value: C{str}
+
+    :return: The seconds to wait (not negative), or C{None} if the value is missing or invalid.
+    :rtype: C{float}
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(int(value)))
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - (time.time() if now is None else now))
+
+
+class TokenBucket(object):
+    """
+    Allows L{rate} requests a second on average, and bursts of up to L{burst}.
+
+    :ivar rate: Tokens added per second (C{None} for no limit; the bucket can still be paused).
+    :type rate: C{float}
+
+    :ivar burst: The most tokens the bucket holds.
+    :type burst: C{float}
+
+    :ivar tokens: The tokens available (as of L{updated}).
+    :type tokens: C{float}
+
+    :ivar paused_until: The time before which no tokens are handed out.
+    :type paused_until: C{float}
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :raise ValueError: If the rate is not positive.
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError('rate must be positive (or None for no limit), not %r' % (rate,))
+        self.rate = None if rate is None else float(rate)
+        if burst is None:
+            burst = max(1.0, self.rate or 1.0)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.paused_until = 0.0
+
+    def delay(self, now, n=1):
+        """
+        :param n: The tokens needed.  (More than L{burst} are available once the bucket
+                  is full; taking them runs it into debt.)
+        :type n: C{int}
+
+        :return: The seconds until the tokens are available (C{0} if they are now).
+        :rtype: C{float}
+        """
+        wait = self.paused_until - now
+        if self.rate is None:
+            return max(0.0, wait)
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        needed = min(n, self.burst)
+        if self.tokens < needed:
+            wait = max(wait, self.updated - now + (needed - self.tokens) / self.rate)
+        return max(0.0, wait)
+
+    def take(self, n=1):
+        """
+        Takes tokens.  (Call only once L{delay} is 0.)
+        """
+        if self.rate is not None:
+            self.tokens -= n
+
+    def pause(self, until):
+        """
+        Hands out no tokens before a time, and only one right then (then refills at the rate).
+        """
+        if until > self.paused_until:
+            self.paused_until = until
+            if self.rate is not None:
+                self.tokens = min(self.tokens, 1.0)
+                self.updated = max(self.updated, until)
+
+
+class RateLimiter(object):
+    """
+    Keeps a token bucket for every host, and for every rate-limited method on a host.
+
+    Assign one to a transport's C{rate_limiter} attribute (or pass it to L{ServerProxy}).
+    It may be shared by many transports and threads.
+
+    :ivar rate: Requests a second allowed to each host not listed in L{hosts} (C{None}
+                for no limit).
+    :ivar burst: The burst allowed with L{rate} (defaults to one second's worth).
+    :ivar hosts: Rates for particular hosts: a rate, or a (rate, burst) tuple, by host.
+    :ivar methods: Rates for particular methods (on each host), as for L{hosts}.
+    :ivar block: Whether callers wait for a token (C{True}) or are rejected at once.
+    :ivar timeout: The most seconds a caller waits (C{None} for no limit); callers that
+                   would have to wait longer are rejected at once.
+    :ivar max_retry_after: Caps the pause taken from a Retry-After header.
+
+    :ivar throttled: The number of throttling responses that paused a host.
+    :type throttled: C{int}
+
+    :ivar rejected: The number of requests rejected.
+    :type rejected: C{int}
+    """
+
+    def __init__(self, rate=None, burst=None, hosts=None, methods=None, block=True, timeout=None,
+                 max_retry_after=300.0):
+        self.rate = rate
+        self.burst = burst
+        self.hosts = hosts or {}
+        self.methods = methods or {}
+        self.block = block
+        self.timeout = timeout
+        self.max_retry_after = max_retry_after
+        self.throttled = 0
+        self.rejected = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+        for limit in [(rate, burst)] + list(self.hosts.values()) + list(self.methods.values()):
+            TokenBucket(*(limit if isinstance(limit, tuple) else (limit, None)))  # (Rejects bad rates now.)
+
+    def acquire(self, host, method=None):
+        """
+        Takes a token for a request, waiting for one if need be.
+
+        A batch request takes one token from the host's bucket, and one from a method's
+        bucket for each of its calls to the method.
+
+        :param host: The host the request is for.
+        :type host: C{str}
+
+        :param method: The method called (if known), or the methods of a batch's calls.
+        :type method: C{str} or C{list}
+
+        :return: The seconds spent waiting.
+        :rtype: C{float}
+
+        :raise RateLimitExceeded: If no token is available (in time).
+        """
+        started = time.time()
+        deadline = None if self.timeout is None else started + self.timeout
+        while True:
+            with self._lock:
+                buckets = self._buckets_for(host, method)
+                now = time.time()
+                wait = max(b.delay(now, n) for _, b, n in buckets)
+                if wait <= 0:
+                    for _, b, n in buckets:
+                        b.take(n)
+                    return now - started
+                if not self.block or (deadline is not None and now + wait > deadline):
+                    self.rejected += 1
+                    limited = ', '.join(name for name, _, _ in buckets if name)
+                    raise RateLimitExceeded('Rate limit for %s%s reached; next request allowed in %.3fs' % (
+                        host, ' (%s)' % limited if limited else '', wait), wait)
+            time.sleep(wait)
+
+    def pause(self, host, seconds):
+        """
+        Stops sending requests to a host for a while (e.g. as a throttling response's
+        Retry-After header asks).
+
+        :param seconds: How long to pause (capped at L{max_retry_after}).
+        :type seconds: C{float}
+        """
+        until = time.time() + min(seconds, self.max_retry_after)
+        with self._lock:
+            self.throttled += 1
+            for key, bucket in list(self._buckets.items()):
+                if key[0] == host:
+                    bucket.pause(until)
+            self._bucket(host, None).pause(until)
+
+    def stats(self):
+        """
+        :return: For every bucket, indexed by host (or "host method"), the tokens available
+                 and the seconds it is still paused for.
+        :rtype: C{dict}
+        """
+        now = time.time()
+        with self._lock:
+            return dict(('%s %s' % key if key[1] else key[0],
+                         {'tokens': None if b.rate is None else round(b.tokens, 3),
+                          'paused': max(0.0, b.paused_until - now)})
+                        for key, b in self._buckets.items())
+
+    def _buckets_for(self, host, method):
+        """
+        :return: The buckets a request falls under, as (method, bucket, tokens needed)
+                 tuples (the method is C{None} for the host's bucket).
+        :rtype: C{list}
+        """
+        counts = {}
+        for name in (method if isinstance(method, (list, tuple)) else (method,)):
+            if name is not None and name in self.methods:
+                counts[name] = counts.get(name, 0) + 1
+        return [(None, self._bucket(host, None), 1)] + [(name, self._bucket(host, name), n)
+                                                        for name, n in sorted(counts.items())]
+
+    def _bucket(self, host, method):
+        key = (host, method)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if method is None:
+                rate = self.hosts.get(host, (self.rate, self.burst))
+            else:
+                rate = self.methods[method]
+            rate, burst = rate if isinstance(rate, tuple) else (rate, None)
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
@@ -0,0 +1,163 @@
+"""
+Decoding of results straight into compact record objects.
+
+A large list result normally decodes into one dict per item, which costs far more memory
+than the values themselves.  Registering a record class for a method makes the decoder
+build instances of that class instead, from the (key, value) pairs the parser produces,
+so the intermediate dicts are never created.  For example::
+
+    class User(object):
+        __slots__ = ('id', 'name', 'email')
+
+    proxy = ServerProxy(uri, result_types={'users.list': User})
+    users = proxy.users.list()  # a list of User instances
+
+A record class may be a class with C{__slots__} (instances are created without calling
+C{__init__}, and the attributes set directly), a C{namedtuple}, or a dataclass (ideally
+with C{slots=True}).  An object in the response becomes a record when its keys are exactly
+the record's fields; any other object (including the response envelope) stays a dict.
+Several classes may be registered for a method to decode nested records too.
+"""
+from __future__ import absolute_import
+
+from rpctools import six
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# Bounds the cache of key orders seen (the orders of a well-behaved server are few).
+MAX_KEY_ORDERS = 1024
+
+
+def _slot_names(cls):
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, six.string_types):
+            slots = (slots,)
+        names.extend(s for s in slots if s not in ('__dict__', '__weakref__') and s not in names)
+    return tuple(names)
+
+
+class RecordType(object):
+    """
+    Builds instances of one record class from decoded values.
+
+    :ivar cls: The record class.
+    :type cls: C{type}
+
+    :ivar fields: The field names, in the order of the class's constructor (if it has one).
+    :type fields: C{tuple}
+    """
+
+    def __init__(self, cls):
+        """
+        :param cls: A namedtuple, dataclass, or class with C{__slots__}.
+        :type cls: C{type}
+
+        :raise TypeError: If the class is none of these.
+        """
+        self.cls = cls
+        if issubclass(cls, tuple) and hasattr(cls, '_fields'):
+            self.fields = tuple(cls._fields)
+            self._make = cls._make
+        elif hasattr(cls, '__dataclass_fields__'):
+            import dataclasses
+            self.fields = tuple(f.name for f in dataclasses.fields(cls) if f.init)
+            self._make = lambda values: cls(*values)
+        elif '__slots__' in cls.__dict__:
+            self.fields = _slot_names(cls)
+            self._make = None
+        else:
+            raise TypeError('%s is not a namedtuple, dataclass or class with __slots__' % cls.__name__)
+
+    def builder(self, keys):
+        """
+        :param keys: The keys of the decoded objects, in the order they come in (a
+                     permutation of L{fields}).
+        :type keys: C{tuple}
+
+        :return: A callable that makes a record from the values of such an object.
+        :rtype: C{callable}
+        """
+        if self._make is None:
+            cls = self.cls
+
+            def build(values):
+                record = cls.__new__(cls)
+                for key, value in zip(keys, values):
+                    setattr(record, key, value)
+                return record
+            return build
+        if keys == self.fields:
+            return self._make
+        make = self._make
+        order = [keys.index(name) for name in self.fields]
+        return lambda values: make([values[i] for i in order])
+
+
+class ResultSchema(object):
+    """
+    The record classes for the result of one method.
+
+    Pass L{object_pairs_hook} to the decoder (e.g. C{json.loads}) to build the records
+    while parsing; L{convert} does the same for an already decoded value.
+    """
+
+    def __init__(self, *types):
+        """
+        :param types: The record classes (see L{RecordType}).
+        """
+        self.types = [RecordType(cls) for cls in types]
+        self._by_keys = dict((frozenset(t.fields), t) for t in self.types)
+        self._builders = {}
+
+    def object_pairs_hook(self, pairs):
+        """
+        Turns the (key, value) pairs of a decoded object into a record, or a dict if the
+        keys match no record class.
+
+        :type pairs: C{list}
+        """
+        if not pairs:
+            return {}
+        keys, values = zip(*pairs)
+        try:
+            build = self._builders[keys]
+        except KeyError:
+            build = self._builder(keys)
+        if build is None:
+            return dict(pairs)
+        return build(values)
+
+    def _builder(self, keys):
+        record_type = self._by_keys.get(frozenset(keys))
+        if record_type is None or len(keys) != len(record_type.fields):  # (Duplicate keys.)
+            build = None
+        else:
+            build = record_type.builder(keys)
+        if len(self._builders) >= MAX_KEY_ORDERS:
+            self._builders.clear()
+        self._builders[keys] = build
+        return build
+
+    def convert(self, value):
+        """
+        Turns the matching dicts in an already decoded value into records.
+
+        :return: The converted value.
+        """
+        if isinstance(value, list):
+            return [self.convert(item) for item in value]
+        if isinstance(value, dict):
+            return self.object_pairs_hook([(key, self.convert(item)) for key, item in value.items()])
+        return value
@@ -0,0 +1,253 @@
+"""
+Recording and replaying of calls, for load testing with real call mixes.
+
+A L{RecordingTransport} wraps any transport and appends every request it sends to a
+compact binary file.  A L{Replayer} later sends the recorded requests through any
+transport, at the recorded pace (optionally sped up) or at a fixed rate, and reports
+latency and throughput.
+
+The file starts with a magic line followed by records, each a fixed 22-byte header
+(timestamp, latency, status and the lengths of the host, handler and body) and then
+the host, handler and body bytes.
+"""
+from __future__ import absolute_import
+
+import time
+import struct
+import threading
+from collections import namedtuple
+
+from rpctools import six
+from rpctools.six.moves import queue
+from rpctools.jsonrpc.exc import ProtocolError
+from rpctools.jsonrpc.stats import LoadReport
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+MAGIC = b'RPCREC1\n'
+
+_HEADER = struct.Struct('>dfHHHI')
+
+Record = namedtuple('Record', 'timestamp host handler body status latency')
+
+
+def write_record(fileobj, record):
+    """
+    Appends a L{Record} to an open binary file.
+    """
+    host = record.host.encode('utf-8')
+    handler = record.handler.encode('utf-8')
+    body = record.body if isinstance(record.body, bytes) else record.body.encode('utf-8')
+    fileobj.write(_HEADER.pack(record.timestamp, record.latency, record.status,
+                               len(host), len(handler), len(body)) + host + handler + body)
+
+
+def read_records(path):
+    """
+    Reads the records of a recording file, in the order they were written.
+
+    :param path: The recording file.
+    :type path: C{str}
+
+    :rtype: iterator of L{Record}
+
+    :raise ValueError: If the file is not a recording.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a call recording' % path)
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            timestamp, latency, status, host_len, handler_len, body_len = _HEADER.unpack(header)
+            data = f.read(host_len + handler_len + body_len)
+            if len(data) < host_len + handler_len + body_len:
+                return  # a partially written last record
+            yield Record(timestamp,
+                         data[:host_len].decode('utf-8'),
+                         data[host_len:host_len + handler_len].decode('utf-8'),
+                         data[host_len + handler_len:],
+                         status, latency)
+
+
+class RecordingTransport(object):
+    """
+    Wraps a transport, appending every request it sends to a recording file.
+
+    Other attributes are read from the wrapped transport, so this may stand in for it
+    anywhere (e.g. C{proxy.transport = RecordingTransport(proxy.transport, 'calls.rec')}).
+
+    The recorded latency runs until the response headers arrive.  Requests that fail
+    to connect are recorded with status 0.  Streamed (chunked) bodies are not kept; they
+    are recorded as empty.
+    """
+
+    def __init__(self, transport, path):
+        """
+        :param transport: The transport to wrap.
+        :type transport: L{rpctools.jsonrpc.transport.Transport}
+
+        :param path: The recording file (appended to if it exists).
+        :type path: C{str}
+        """
+        self.transport = transport
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def request(self, host, handler, body, headers=None, verbose=False, span=None, priority=None, method=None):
+        """
+        Sends the request through the wrapped transport and records it.
+        """
+        start = time.time()
+        status = 0
+        try:
+            response = self.transport.request(host, handler, body, headers=headers, verbose=verbose, span=span,
+                                              priority=priority, method=method)
+            status = response.status
+            return response
+        except ProtocolError as x:
+            status = x.errcode
+            raise
+        finally:
+            if not isinstance(body, (six.binary_type, six.text_type)):
+                body = b''
+            record = Record(start, host, handler, body, status, time.time() - start)
+            with self._lock:
+                write_record(self._file, record)
+
+    def flush(self):
+        """
+        Flushes buffered records to the file.
+        """
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """
+        Closes the recording file.
+        """
+        with self._lock:
+            self._file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+class ReplayReport(LoadReport):
+    """
+    The outcome of a replay (see L{LoadReport}).
+    """
+
+
+class Replayer(object):
+    """
+    Sends recorded requests through a transport at a controlled pace.
+
+    Requests are scheduled up front: at the recorded offsets divided by L{speed}, or
+    evenly at L{rate} per second.  L{concurrency} worker threads send them when due.
+
+    :ivar speed: Replay speed relative to the recording (1 is real time, 10 is ten times
+                 faster, C{None} is as fast as the workers can go).
+    :type speed: C{float}
+
+    :ivar rate: A fixed number of requests per second (overrides L{speed}).
+    :type rate: C{float}
+
+    :ivar concurrency: The number of worker threads.
+    :type concurrency: C{int}
+    """
+
+    def __init__(self, transport, records, speed=1.0, rate=None, concurrency=1, host=None, headers=None):
+        """
+        :param transport: The transport to send through.
+        :type transport: L{rpctools.jsonrpc.transport.Transport}
+
+        :param records: The recorded requests (e.g. from L{read_records}).
+        :type records: iterable of L{Record}
+
+        :param host: Send every request to this host instead of the recorded one.
+        :type host: C{str}
+
+        :param headers: Headers to send with every request (e.g. authorization).
+        :type headers: C{dict}
+        """
+        self.transport = transport
+        self.records = list(records)
+        self.speed = speed
+        self.rate = rate
+        self.concurrency = max(1, concurrency)
+        self.host = host
+        self.headers = headers or {}
+
+    def schedule(self):
+        """
+        :return: (offset in seconds, record) pairs in send order.
+        :rtype: C{list}
+        """
+        if not self.records:
+            return []
+        if self.rate:
+            return [(i / float(self.rate), r) for i, r in enumerate(self.records)]
+        if not self.speed:
+            return [(0.0, r) for r in self.records]
+        first = min(r.timestamp for r in self.records)
+        return sorted(((r.timestamp - first) / self.speed, r) for r in self.records)
+
+    def run(self):
+        """
+        Replays every record and waits for all the responses.
+
+        :rtype: L{ReplayReport}
+        """
+        work = queue.Queue()
+        for item in self.schedule():
+            work.put(item)
+        lock = threading.Lock()
+        latencies = []
+        errors = {}
+        start = time.time()
+
+        def worker():
+            while True:
+                try:
+                    offset, record = work.get_nowait()
+                except queue.Empty:
+                    return
+                due = start + offset
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    response = self.transport.request(self.host or record.host, record.handler, record.body,
+                                                      headers=dict(self.headers))
+                    response.read()
+                except Exception as x:  # (Any failure is counted, rather than losing the worker.)
+                    with lock:
+                        name = x.__class__.__name__
+                        errors[name] = errors.get(name, 0) + 1
+                else:
+                    latency = time.time() - due
+                    with lock:
+                        latencies.append(latency)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        return ReplayReport(len(latencies), errors, time.time() - start, latencies)
@@ -0,0 +1,20 @@
+"""
+The server side of JSON-RPC: a method L{Registry}, a front-end independent L{Dispatcher}
+and a L{WSGIApplication}.  (The asyncio front end is in L{rpctools.jsonrpc.server.aio},
+which requires Python 3.)
+"""
+from rpctools.jsonrpc.server.registry import Registry
+from rpctools.jsonrpc.server.dispatch import Dispatcher
+from rpctools.jsonrpc.server.wsgi import WSGIApplication
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
@@ -0,0 +1,174 @@
+"""
+An asyncio front end for a JSON-RPC server.  (Python 3 only.)
+
+Methods may be coroutine functions; the items of a batch are awaited concurrently.
+Plain functions are called inline on the event loop (so they should not block), or in
+an executor if one is given.  For example::
+
+    registry = Registry()
+
+    @registry.register
+    async def lookup(key):
+        return await db.get(key)
+
+    server = loop.run_until_complete(serve(AsyncDispatcher(registry), '0.0.0.0', 8080))
+    loop.run_forever()
+
+The HTTP handling is deliberately small: POST requests with a Content-Length or chunked
+body, over keep-alive HTTP/1.1 connections.
+"""
+import asyncio
+import inspect
+import functools
+
+from rpctools.jsonrpc.server.dispatch import Dispatcher, InvalidRequest, PARSE_ERROR, INVALID_REQUEST
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+REASONS = {
+    200: 'OK',
+    204: 'No Content',
+    400: 'Bad Request',
+    405: 'Method Not Allowed',
+    415: 'Unsupported Media Type',
+}
+
+
+class AsyncDispatcher(Dispatcher):
+    """
+    A L{Dispatcher} whose methods may be coroutine functions.
+
+    :ivar executor: Runs plain (non-coroutine) methods, if given; otherwise they are
+                    called on the event loop.
+    :type executor: C{concurrent.futures.Executor}
+    """
+
+    def __init__(self, registry, codecs=('json',), executor=None):
+        super(AsyncDispatcher, self).__init__(registry, codecs=codecs, workers=0)
+        self.executor = executor
+
+    async def handle_async(self, body, content_type=None):
+        """
+        Handles a request body (see L{Dispatcher.handle}).
+        """
+        codec = self.codec_for(content_type)
+        if codec is None:
+            return 415, None, None
+        try:
+            payload = codec.loads(body)
+        except Exception as x:
+            response = self.error_response({}, PARSE_ERROR, 'Parse error: %s' % x)
+        else:
+            if isinstance(payload, list):
+                if payload:
+                    responses = await asyncio.gather(*[self.dispatch_async(r) for r in payload])
+                    response = [r for r in responses if r is not None] or None
+                else:
+                    response = self.error_response({}, INVALID_REQUEST, 'Empty batch')
+            else:
+                response = await self.dispatch_async(payload)
+        if response is None:
+            return 204, None, None
+        return 200, codec.content_type, self.encode(codec, response)
+
+    async def dispatch_async(self, request):
+        """
+        Calls (or awaits) the method for one decoded request (see L{Dispatcher.dispatch}).
+        """
+        try:
+            method, params = self.resolve(request)
+        except InvalidRequest as x:
+            return self.error_response(request if isinstance(request, dict) else {}, x.code, x.message)
+        try:
+            if isinstance(params, dict):
+                call = functools.partial(method, **params)
+            else:
+                call = functools.partial(method, *params)
+            if self.executor is not None and not asyncio.iscoroutinefunction(method):
+                result = await asyncio.get_event_loop().run_in_executor(self.executor, call)
+            else:
+                result = call()
+                if inspect.isawaitable(result):
+                    result = await result
+        except Exception as x:
+            return self.exception_response(request, x, method, params)
+        return self.result_response(request, result)
+
+
+async def _read_body(reader, headers):
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+            if not size:
+                # Skip any trailers.
+                while (await reader.readline()).strip():
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+    return await reader.readexactly(int(headers.get('content-length') or 0))
+
+
+async def _serve_connection(dispatcher, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                return
+            method, _, version = request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await _read_body(reader, headers)
+
+            if method != 'POST':
+                status, content_type, data = 405, None, None
+            else:
+                status, content_type, data = await dispatcher.handle_async(body, headers.get('content-type'))
+
+            connection = headers.get('connection', '').lower()
+            keep_alive = connection != 'close' and (version != 'HTTP/1.0' or connection == 'keep-alive')
+            head = ['HTTP/1.1 %d %s' % (status, REASONS[status]), 'Content-Length: %d' % len(data or b'')]
+            if content_type:
+                head.append('Content-Type: %s' % content_type)
+            if status == 405:
+                head.append('Allow: POST')
+            if not keep_alive:
+                head.append('Connection: close')
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + (data or b''))
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def serve(dispatcher, host='127.0.0.1', port=0, **kwargs):
+    """
+    Starts serving JSON-RPC over HTTP.
+
+    :param dispatcher: Calls the methods.
+    :type dispatcher: L{AsyncDispatcher}
+
+    :param kwargs: Passed on to C{asyncio.start_server} (e.g. C{ssl}, C{backlog}).
+
+    :return: A coroutine that returns the C{asyncio.Server}.
+    """
+    return asyncio.start_server(functools.partial(_serve_connection, dispatcher), host, port, **kwargs)
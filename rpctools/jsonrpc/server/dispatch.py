@@ -0,0 +1,316 @@
+"""
+Decoding, dispatching and encoding of JSON-RPC messages, independent of the front end.
+"""
+from __future__ import absolute_import
+
+import inspect
+import logging
+import threading
+
+from rpctools import six
+from rpctools.six.moves import queue
+from rpctools.jsonrpc.exc import Fault
+from rpctools.jsonrpc.codec import JSON_CODEC, CODECS
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# Error codes from the JSON-RPC 2.0 specification.
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+SERVER_ERROR = -32000
+
+
+def _params_mismatch(method, params):
+    """
+    :return: Why the params do not fit the method's signature, or C{None} if they do (or the
+             signature cannot be told, e.g. on Python 2).
+    :rtype: C{str}
+    """
+    try:
+        signature = inspect.signature(method)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    try:
+        if isinstance(params, dict):
+            signature.bind(**params)
+        else:
+            signature.bind(*params)
+    except TypeError as x:
+        return str(x)
+    return None
+
+
+class InvalidRequest(Exception):
+    """
+    Raised by L{Dispatcher.resolve} for a request that cannot be dispatched.
+    """
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+
+class _WorkerPool(object):
+    """
+    Daemon threads that run the items of batch requests.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._queue = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def submit(self, task):
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    for _ in range(self.size):
+                        t = threading.Thread(target=self._work)
+                        t.daemon = True
+                        t.start()
+                    self._started = True
+        self._queue.put(task)
+
+    def _work(self):
+        while True:
+            self._queue.get()()
+
+
+class Dispatcher(object):
+    """
+    Calls registered methods for decoded requests and builds the responses.
+
+    A method's result becomes the response's 'result'.  A L{Fault} it raises becomes an
+    error with the fault's code and message (so the client raises the same L{Fault});
+    any other exception becomes a server error (-32000).  Requests without an 'id' are
+    notifications and get no response.
+
+    The items of a batch run concurrently on a pool of worker threads (the calling thread
+    takes part too), so one slow item does not hold up the rest.
+
+    :ivar registry: The methods.
+    :type registry: L{rpctools.jsonrpc.server.registry.Registry}
+
+    :ivar codecs: The wire formats accepted, indexed by content type.
+    :type codecs: C{dict}
+    """
+
+    def __init__(self, registry, codecs=('json',), workers=8):
+        """
+        :param codecs: Codec names or instances (see L{rpctools.jsonrpc.codec}).
+        :type codecs: C{tuple}
+
+        :param workers: The number of threads that run batch items.
+        :type workers: C{int}
+        """
+        self.logger = logging.getLogger('{0.__module__}.{0.__name__}'.format(self.__class__))
+        self.registry = registry
+        self.codecs = {}
+        for codec in codecs:
+            if isinstance(codec, str):
+                codec = CODECS[codec]()
+            self.codecs[codec.content_type] = codec
+        self._pool = _WorkerPool(workers)
+
+    def handle(self, body, content_type=None):
+        """
+        Handles a request body.
+
+        :param body: The encoded request (or batch).
+        :type body: C{bytes}
+
+        :param content_type: The request's Content-Type header (JSON if not given).
+        :type content_type: C{str}
+
+        :return: The HTTP status, response content type and encoded response (C{None} when
+                 there is nothing to send back, e.g. for notifications).
+        :rtype: C{tuple}
+        """
+        codec = self.codec_for(content_type)
+        if codec is None:
+            return 415, None, None
+        try:
+            payload = codec.loads(body)
+        except Exception as x:
+            response = self.error_response({}, PARSE_ERROR, 'Parse error: %s' % x)
+        else:
+            response = self.dispatch_payload(payload)
+        if response is None:
+            return 204, None, None
+        return 200, codec.content_type, self.encode(codec, response)
+
+    def encode(self, codec, response):
+        """
+        Encodes a response (or list of responses).  A result that cannot be encoded is
+        replaced by an INTERNAL_ERROR response, so it does not cost the rest of a batch.
+
+        :rtype: C{bytes}
+        """
+        try:
+            data = codec.dumps(response)
+        except Exception:
+            if isinstance(response, list):
+                data = codec.dumps([self._encodable(codec, r) for r in response])
+            else:
+                data = codec.dumps(self._encodable(codec, response))
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return data
+
+    def _encodable(self, codec, response):
+        try:
+            codec.dumps(response)
+        except Exception as x:
+            self.logger.exception('Error encoding the response to request %r' % (response.get('id'),))
+            request = {'id': response.get('id')}
+            if 'jsonrpc' in response:
+                request['jsonrpc'] = response['jsonrpc']
+            return self.error_response(request, INTERNAL_ERROR, 'Unable to encode result: %s' % x)
+        return response
+
+    def codec_for(self, content_type):
+        """
+        :return: The codec for a request Content-Type, or C{None} if it is not accepted.
+        """
+        if not content_type:
+            return self.codecs.get(JSON_CODEC.content_type)
+        return self.codecs.get(content_type.split(';', 1)[0].strip().lower())
+
+    def dispatch_payload(self, payload):
+        """
+        Dispatches a decoded request or batch.
+
+        :return: The response, list of responses, or C{None} if nothing is to be sent back.
+        """
+        if isinstance(payload, list):
+            if not payload:
+                return self.error_response({}, INVALID_REQUEST, 'Empty batch')
+            return [r for r in self.dispatch_batch(payload) if r is not None] or None
+        return self.dispatch(payload)
+
+    def dispatch_batch(self, requests):
+        """
+        Dispatches the requests of a batch concurrently.
+
+        :return: The response for each request (C{None} for notifications), in order.
+        :rtype: C{list}
+        """
+        if len(requests) == 1:
+            return [self.dispatch(requests[0])]
+        responses = [None] * len(requests)
+        claimed = [0]
+        remaining = [len(requests)]
+        done = threading.Condition()
+
+        def run():
+            while True:
+                with done:
+                    i = claimed[0]
+                    if i >= len(requests):
+                        return
+                    claimed[0] += 1
+                responses[i] = self.dispatch(requests[i])
+                with done:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        done.notify_all()
+
+        for _ in range(min(len(requests) - 1, self._pool.size)):
+            self._pool.submit(run)
+        run()
+        with done:
+            while remaining[0]:
+                done.wait()
+        return responses
+
+    def dispatch(self, request):
+        """
+        Calls the method for one decoded request.
+
+        :param request: The request (with 'method', 'params' and, unless it is a
+                        notification, 'id' keys).
+        :type request: C{dict}
+
+        :return: The response, or C{None} for notifications.
+        :rtype: C{dict}
+        """
+        try:
+            method, params = self.resolve(request)
+        except InvalidRequest as x:
+            return self.error_response(request if isinstance(request, dict) else {}, x.code, x.message)
+        try:
+            result = method(**params) if isinstance(params, dict) else method(*params)
+        except Exception as x:
+            return self.exception_response(request, x, method, params)
+        return self.result_response(request, result)
+
+    def resolve(self, request):
+        """
+        Looks up the method and params of a request.
+
+        :return: The method and the params.
+        :rtype: C{tuple}
+
+        :raise InvalidRequest: If the request is malformed or names an unknown method.
+        """
+        if not isinstance(request, dict) or not isinstance(request.get('method'), six.string_types):
+            raise InvalidRequest(INVALID_REQUEST, 'Invalid request')
+        method = self.registry.lookup(request['method'])
+        if method is None:
+            raise InvalidRequest(METHOD_NOT_FOUND, 'Method not found: %s' % request['method'])
+        params = request.get('params')
+        if params is None:
+            params = ()
+        elif not isinstance(params, (list, dict)):
+            raise InvalidRequest(INVALID_PARAMS, 'Invalid params')
+        return method, params
+
+    def result_response(self, request, result):
+        """
+        :return: The response carrying a method's result (C{None} for notifications).
+        """
+        if 'id' not in request:
+            return None
+        if request.get('jsonrpc') == '2.0':
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+        return {'id': request['id'], 'result': result, 'error': None}
+
+    def exception_response(self, request, x, method=None, params=None):
+        """
+        :return: The error response for an exception raised by a method (or by calling it
+                 with params that do not fit its signature).
+        """
+        if isinstance(x, Fault):
+            return self.error_response(request, x.errcode, x.errmsg)
+        if isinstance(x, TypeError) and method is not None:
+            mismatch = _params_mismatch(method, params)
+            if mismatch is not None:
+                return self.error_response(request, INVALID_PARAMS, 'Invalid params: %s' % mismatch)
+        self.logger.exception('Error calling %s' % request.get('method'))
+        return self.error_response(request, SERVER_ERROR, '%s: %s' % (x.__class__.__name__, x))
+
+    def error_response(self, request, code, message):
+        """
+        :return: An error response (C{None} for notifications).
+        """
+        if 'id' not in request and 'method' in request:
+            return None
+        error = {'code': code, 'message': message}
+        if request.get('jsonrpc') == '2.0':
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': error}
+        return {'id': request.get('id'), 'result': None, 'error': error}
@@ -0,0 +1,108 @@
+"""
+The method registry of a JSON-RPC server.
+"""
+from __future__ import absolute_import
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class Registry(object):
+    """
+    Maps (dotted) method names to callables.
+
+    Names may be namespaced, matching the "nested" methods of the client (e.g. a client's
+    C{proxy.examples.getStateName()} calls the method registered as
+    'examples.getStateName').  For example::
+
+        registry = Registry()
+
+        @registry.register
+        def ping():
+            return 'pong'
+
+        examples = registry.namespace('examples')
+        examples.register(get_state_name, 'getStateName')
+        examples.register_instance(StateService(), prefix='states')  # examples.states.*
+
+    :ivar methods: Callables indexed by full method name (shared by all namespaces of a
+                   registry).
+    :type methods: C{dict}
+
+    :ivar prefix: The namespace of this registry ('' for the root).
+    :type prefix: C{str}
+    """
+
+    def __init__(self, methods=None, prefix=''):
+        """
+        :param methods: Callables indexed by method name to start with (or a dict to share).
+        :type methods: C{dict}
+        """
+        self.methods = methods if methods is not None else {}
+        self.prefix = prefix
+
+    def _qualify(self, name):
+        return '%s.%s' % (self.prefix, name) if self.prefix else name
+
+    def register(self, func=None, name=None):
+        """
+        Register a callable (also usable as a decorator, with or without a name).
+
+        :param func: The callable.
+        :type func: C{callable}
+
+        :param name: The method name within this namespace (defaults to the function name).
+        :type name: C{str}
+
+        :return: The callable (so that it can be used as a decorator).
+        """
+        if func is None:
+            return lambda f: self.register(f, name)
+        self.methods[self._qualify(name or func.__name__)] = func
+        return func
+
+    def register_instance(self, obj, prefix=None):
+        """
+        Register the public methods of an object.
+
+        :param obj: The object; its attributes that are callable and do not start with an
+                    underscore are registered.
+
+        :param prefix: A namespace (within this one) for the methods.
+        :type prefix: C{str}
+        """
+        target = self.namespace(prefix) if prefix else self
+        for attr in dir(obj):
+            if attr.startswith('_'):
+                continue
+            value = getattr(obj, attr)
+            if callable(value):
+                target.register(value, attr)
+
+    def namespace(self, prefix):
+        """
+        :return: A view of this registry that registers names under a (dotted) prefix.
+        :rtype: L{Registry}
+        """
+        return self.__class__(self.methods, self._qualify(prefix))
+
+    def lookup(self, name):
+        """
+        :return: The callable registered under a full method name, or C{None}.
+        """
+        return self.methods.get(name)
+
+    def __contains__(self, name):
+        return name in self.methods
+
+    def __len__(self):
+        return len(self.methods)
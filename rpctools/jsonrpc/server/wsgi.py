@@ -0,0 +1,59 @@
+"""
+A WSGI front end for a JSON-RPC L{Dispatcher}.
+
+For example, with gunicorn::
+
+    # myservice.py
+    registry = Registry()
+    registry.register(ping)
+    application = WSGIApplication(Dispatcher(registry))
+
+    $ gunicorn --workers 4 --threads 8 myservice:application
+"""
+from __future__ import absolute_import
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+STATUSES = {
+    200: '200 OK',
+    204: '204 No Content',
+    405: '405 Method Not Allowed',
+    415: '415 Unsupported Media Type',
+}
+
+
+class WSGIApplication(object):
+    """
+    A WSGI application that answers JSON-RPC POST requests.
+
+    :ivar dispatcher: Decodes the requests and calls the methods.
+    :type dispatcher: L{rpctools.jsonrpc.server.dispatch.Dispatcher}
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'POST':
+            start_response(STATUSES[405], [('Allow', 'POST'), ('Content-Length', '0')])
+            return []
+        length = environ.get('CONTENT_LENGTH')
+        stream = environ['wsgi.input']
+        # Without a length the server must be de-chunking the body for us.
+        body = stream.read(int(length)) if length else stream.read()
+        status, content_type, data = self.dispatcher.handle(body, environ.get('CONTENT_TYPE'))
+        if data is None:
+            start_response(STATUSES[status], [('Content-Length', '0')])
+            return []
+        start_response(STATUSES[status], [('Content-Type', content_type), ('Content-Length', str(len(data)))])
+        return [data]
@@ -0,0 +1,125 @@
+"""
+Small statistics helpers for latency reporting.
+"""
+from __future__ import absolute_import
+
+import math
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(sorted_values, q):
+    """
+    Returns the q-th percentile (nearest-rank) of already sorted values.
+
+    :param sorted_values: The values, in ascending order.
+    :type sorted_values: C{list}
+
+    :param q: The percentile, between 0 and 100.
+    :type q: C{float}
+
+    :return: The value at that rank, or C{None} if there are no values.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(values, percentiles=DEFAULT_PERCENTILES):
+    """
+    Summarizes latencies: count, min, max, mean and the requested percentiles.
+
+    :param values: The latencies (in any order).
+    :type values: C{list} of C{float}
+
+    :param percentiles: The percentiles to report (e.g. 50, 99.9).
+    :type percentiles: C{tuple}
+
+    :return: The summary; percentiles are keyed like 'p50' and 'p99.9'.
+    :rtype: C{dict}
+    """
+    ordered = sorted(values)
+    summary = {
+        'count': len(ordered),
+        'min': ordered[0] if ordered else None,
+        'max': ordered[-1] if ordered else None,
+        'mean': sum(ordered) / len(ordered) if ordered else None,
+    }
+    for q in percentiles:
+        summary['p%s' % ('%g' % q)] = percentile(ordered, q)
+    return summary
+
+
+class LoadReport(object):
+    """
+    The outcome of a load run.
+
+    :ivar completed: The number of calls that succeeded.
+    :type completed: C{int}
+
+    :ivar errors: Failed calls, counted by exception class name.
+    :type errors: C{dict} of C{str} to C{int}
+
+    :ivar elapsed: Seconds from the first scheduled call to the last response.
+    :type elapsed: C{float}
+
+    :ivar latencies: Seconds from each call's *scheduled* start to its response, so
+                     that a backed-up client does not hide slow responses.
+    :type latencies: C{list} of C{float}
+    """
+
+    def __init__(self, completed, errors, elapsed, latencies):
+        self.completed = completed
+        self.errors = errors
+        self.elapsed = elapsed
+        self.latencies = latencies
+
+    @property
+    def throughput(self):
+        """
+        Completed calls per second.
+        """
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def latency(self):
+        """
+        The latency summary (see L{summarize}).
+        """
+        return summarize(self.latencies)
+
+    def as_dict(self):
+        """
+        :return: The report as plain data (e.g. for JSON output).
+        :rtype: C{dict}
+        """
+        return {
+            'completed': self.completed,
+            'errors': dict(self.errors),
+            'elapsed': self.elapsed,
+            'throughput': self.throughput,
+            'latency': self.latency,
+        }
+
+    def __str__(self):
+        lines = ['completed: %d in %.3fs (%.1f/s)' % (self.completed, self.elapsed, self.throughput)]
+        latency = self.latency
+        if latency['count']:
+            lines.append('latency: ' + ' '.join('%s=%.2fms' % (k, latency[k] * 1000)
+                                                for k in ('min', 'p50', 'p90', 'p99', 'p99.9', 'max')))
+        for name, count in sorted(self.errors.items()):
+            lines.append('errors: %s=%d' % (name, count))
+        return '\n'.join(lines)
@@ -0,0 +1,406 @@
+"""
+JSON-RPC over the stdin and stdout of local worker processes.
+
+Helper processes in the style of language servers speak JSON-RPC on their standard
+streams, each message preceded by a Content-Length header.  L{StdioTransport} launches a
+pool of such processes (or attaches to ones already running), spreads calls across them
+and matches responses to callers by id, so there is no HTTP server (or socket) between
+the client and its helpers::
+
+    proxy = StdioServerProxy(['my-helper', '--stdio'], workers=4, timeout=30)
+    proxy.analyse(path)
+    proxy.close()  # Closes the workers' stdin, then terminates any that do not exit.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+import subprocess
+
+from rpctools.six import string_types
+from rpctools.jsonrpc.tcp import TCPServerProxy, FRAMINGS, _Pending, encode_frame, read_frame
+from rpctools.jsonrpc.exc import ConnectionError, ResponseError
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class _Worker(object):
+    """
+    One worker process (or attached pair of streams), its reader thread and the calls
+    waiting on it.
+    """
+
+    def __init__(self, transport, process, wfile, rfile, slot):
+        self.transport = transport
+        self.process = process
+        self.wfile = wfile
+        self.rfile = rfile
+        self.slot = slot
+        self.pending = {}
+        self.closed = False
+        self.write_lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read, name='rpctools-stdio-%s-%d' % (transport.name, slot))
+        self.reader.daemon = True
+
+    def _read(self):
+        error = None
+        try:
+            while True:
+                frame = read_frame(self.rfile, self.transport.framing)
+                if frame is None:
+                    break
+                try:
+                    message = json.loads(frame.decode('utf-8'))
+                    wire_id = message.get('id')
+                except Exception as x:
+                    error = ResponseError("Unable to parse response data as JSON: %s" % x)
+                    break
+                if 'method' in message:
+                    # A request (or notification) from the worker, whose id is its own and
+                    # may equal one of ours.
+                    self.transport.logger.debug('Discarding %s request from worker' % (message['method'],))
+                    continue
+                with self.transport._lock:
+                    pending = self.pending.pop(wire_id, None)
+                if pending is None:
+                    self.transport.logger.debug('Discarding response with unknown id %r' % (wire_id,))
+                    continue
+                pending.response = message
+                pending.done.set()
+        except (IOError, OSError, ValueError) as x:
+            error = x
+        self.transport._disconnect(self, error)
+        try:
+            self.rfile.close()
+        except (IOError, OSError):
+            pass
+        if self.process is not None:
+            self.transport._reap(self, time.time() + self.transport.grace)
+
+
+class StdioTransport(object):
+    """
+    Sends JSON-RPC messages to a pool of worker processes over their stdin and reads
+    the responses from their stdout.
+
+    Each call goes to the worker with the fewest calls in flight (taking turns between
+    workers that are equally busy), and a reader thread per worker hands each response
+    to the caller waiting on its id.  Ids are replaced on the wire by ids unique to the
+    transport, so any number of proxies (and threads) may share it.  A worker that
+    exits fails the calls in flight on it with L{ConnectionError}; launched workers are
+    started again when next needed, attached ones are not.
+
+    :ivar name: A name for the workers, used in logs and errors (and as the proxy's host).
+    :type name: C{str}
+
+    :ivar workers: The size of the pool.
+    :type workers: C{int}
+
+    :ivar framing: 'content-length' (as in the Language Server Protocol), 'newline' or 'length'.
+    :type framing: C{str}
+
+    :ivar timeout: Seconds to wait for each response (default is forever).
+    :type timeout: C{float}
+
+    :ivar grace: Seconds a closed worker is given to exit before it is terminated.
+    :type grace: C{float}
+    """
+
+    def __init__(self, command=None, workers=1, attach=None, framing='content-length', timeout=None, grace=5.0,
+                 popen_opts=None, name=None):
+        """
+        :param command: The program and arguments to launch each worker with (as for
+                        C{subprocess.Popen}).
+        :type command: C{list}
+
+        :param workers: The number of worker processes to launch (as calls need them).
+        :type workers: C{int}
+
+        :param attach: Instead of a command, workers that are already running: C{Popen}
+                       objects (with stdin and stdout pipes), or pairs of binary files to
+                       write requests to and read responses from.
+        :type attach: C{list}
+
+        :param framing: 'content-length', 'newline' or 'length'.
+        :type framing: C{str}
+
+        :param timeout: Seconds to wait for each response.
+        :type timeout: C{float}
+
+        :param grace: Seconds a closed worker is given to exit before it is terminated.
+        :type grace: C{float}
+
+        :param popen_opts: Other arguments for C{subprocess.Popen} (e.g. cwd, env, stderr).
+        :type popen_opts: C{dict}
+
+        :param name: A name for the workers (by default, the program's).
+        :type name: C{str}
+        """
+        if framing not in FRAMINGS:
+            raise ValueError('framing must be one of %s' % (FRAMINGS,))
+        if (command is None) == (attach is None):
+            raise ValueError('Either a command or workers to attach to is required')
+        if attach is None and workers < 1:
+            raise ValueError('workers must be at least 1')
+        self.logger = logging.getLogger('{0.__module__}.{0.__name__}'.format(self.__class__))
+        self.command = command
+        if name is None:
+            name = 'stdio'
+            if command is not None:
+                name = os.path.basename(command if isinstance(command, string_types) else command[0])
+        self.name = name
+        self.framing = framing
+        self.timeout = timeout
+        self.grace = grace
+        self.popen_opts = popen_opts or {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._turn = 0
+        if attach is None:
+            self.workers = workers
+            self._workers = [None] * workers
+        else:
+            self.workers = len(attach)
+            self._workers = [self._attach(target, slot) for slot, target in enumerate(attach)]
+
+    def call(self, data):
+        """
+        Sends a request to a worker and waits for its response.
+
+        :param data: The request (with 'id', 'method' and 'params' keys).
+        :type data: C{dict}
+
+        :return: The decoded JSON-RPC response (with the caller's id restored).
+        :rtype: C{dict}
+
+        :raise ConnectionError: If no worker is running (or can be launched), the worker
+                                exits or the response does not arrive in time.
+        :raise ResponseError: If the response cannot be parsed.
+        """
+        wire_id = next(self._ids)
+        message = dict(data)
+        message['id'] = wire_id
+        pending = _Pending()
+        worker = self._send(message, wire_id, pending)
+        if not pending.done.wait(self.timeout):
+            with self._lock:
+                worker.pending.pop(wire_id, None)
+            raise ConnectionError("Timed out waiting for response from %s" % self.name)
+        if pending.error is not None:
+            raise pending.error
+        pending.response['id'] = data.get('id')
+        return pending.response
+
+    def notify(self, data):
+        """
+        Sends a notification (a request without an id) to a worker; nothing is waited for.
+
+        :param data: The notification (with 'method' and 'params' keys).
+        :type data: C{dict}
+
+        :raise ConnectionError: If no worker is running (or can be launched), or writing fails.
+        """
+        self._send(data, None, None)
+
+    def start(self):
+        """
+        Launches any workers of the pool that are not running (e.g. to pay for their
+        start-up before the first calls).
+
+        :raise ConnectionError: If a worker cannot be launched.
+        """
+        with self._lock:
+            for slot in range(self.workers):
+                if self._workers[slot] is None and self.command is not None:
+                    self._launch(slot)
+
+    @property
+    def processes(self):
+        """
+        The processes of the running workers (attached stream pairs have none).
+
+        :rtype: C{list}
+        """
+        with self._lock:
+            return [w.process for w in self._workers if w is not None and not w.closed and w.process is not None]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the workers' stdin, failing any calls still in flight, and waits for them to
+        exit (terminating those still running after L{grace} seconds).  Launched workers
+        are started again if the transport is used afterwards.
+        """
+        with self._lock:
+            workers = [w for w in self._workers if w is not None]
+        for worker in workers:
+            self._disconnect(worker, None)
+        deadline = time.time() + self.grace
+        for worker in workers:
+            if worker.process is not None:
+                self._reap(worker, deadline)
+
+    def _send(self, message, wire_id, pending):
+        frame = encode_frame(json.dumps(message).encode('utf-8'), self.framing)
+        with self._lock:
+            worker = self._pick()
+            if pending is not None:
+                worker.pending[wire_id] = pending
+        try:
+            with worker.write_lock:
+                worker.wfile.write(frame)
+                worker.wfile.flush()
+        except (IOError, OSError, ValueError) as x:  # (ValueError if the worker was closed meanwhile.)
+            self._disconnect(worker, x)
+            raise ConnectionError("Error writing to %s: %r" % (self.name, x))
+        return worker
+
+    def _pick(self):
+        """
+        Returns the worker with the fewest calls in flight, launching it if its slot is
+        empty.  (Called with the lock held.)
+        """
+        best = None
+        for i in range(self.workers):
+            slot = (self._turn + i) % self.workers
+            worker = self._workers[slot]
+            if worker is None or worker.closed:
+                if self.command is None:
+                    continue
+                load = 0
+            else:
+                load = len(worker.pending)
+            if best is None or load < best[0]:
+                best = (load, slot)
+        if best is None:
+            raise ConnectionError("No %s worker is running" % self.name)
+        slot = best[1]
+        self._turn = (slot + 1) % self.workers
+        worker = self._workers[slot]
+        if worker is None or worker.closed:
+            worker = self._launch(slot)
+        return worker
+
+    def _launch(self, slot):
+        """
+        Starts a worker process in a slot.  (Called with the lock held.)
+        """
+        opts = dict(self.popen_opts, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            process = subprocess.Popen(self.command, **opts)
+        except (IOError, OSError) as x:
+            raise ConnectionError("Error launching %s: %r" % (self.name, x))
+        self.logger.debug('Launched %s worker %d (pid %d)' % (self.name, slot, process.pid))
+        worker = self._workers[slot] = _Worker(self, process, process.stdin, process.stdout, slot)
+        worker.reader.start()
+        return worker
+
+    def _attach(self, target, slot):
+        if isinstance(target, tuple):
+            process, (wfile, rfile) = None, target
+        else:
+            process, wfile, rfile = target, target.stdin, target.stdout
+        worker = _Worker(self, process, wfile, rfile, slot)
+        worker.reader.start()
+        return worker
+
+    def _disconnect(self, worker, error):
+        """
+        Closes a worker's stdin and fails its pending calls.
+        """
+        with self._lock:
+            if worker.closed:
+                return
+            worker.closed = True
+            pending, worker.pending = worker.pending, {}
+        try:
+            worker.wfile.close()
+        except (IOError, OSError, ValueError):
+            pass
+        if pending:
+            if not isinstance(error, ResponseError):
+                error = ConnectionError("Worker %s lost: %r" % (self.name, error))
+            for p in pending.values():
+                p.error = error
+                p.done.set()
+
+    def _reap(self, worker, deadline):
+        """
+        Waits for a closed worker's process to exit, terminating (and then killing) it if
+        it is still running at the deadline.
+        """
+        process = worker.process
+        for stop in (process.terminate, process.kill, None):
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.01)
+            if process.returncode is not None or stop is None:
+                break
+            self.logger.warning('%s worker %d (pid %d) did not exit; stopping it' % (self.name, worker.slot,
+                                                                                     process.pid))
+            try:
+                stop()
+            except OSError:
+                pass  # (It exited meanwhile.)
+            deadline = time.time() + 1.0
+
+
+class StdioServerProxy(TCPServerProxy):
+    """
+    A L{ServerProxy} for worker processes, sending over a L{StdioTransport}::
+
+        with StdioServerProxy([sys.executable, 'helper.py'], workers=4) as proxy:
+            proxy.someMethod()
+
+    As with L{TCPServerProxy}, there is no HTTP, and an instance (or its transport) may be
+    shared by many threads.  The proxy's host is the workers' name.
+    """
+
+    default_ports = {'stdio': 0}
+
+    def __init__(self, command=None, workers=1, attach=None, framing='content-length', grace=5.0, popen_opts=None,
+                 name=None, **kwargs):
+        """
+        :param command: The program and arguments to launch each worker with.
+        :param workers: The number of worker processes.
+        :param attach: Instead of a command, running workers: C{Popen} objects or (stdin, stdout) file pairs.
+        :param framing: 'content-length' (default), 'newline' or 'length'.
+        :param grace: Seconds closed workers are given to exit before they are terminated.
+        :param popen_opts: Other arguments for C{subprocess.Popen} (e.g. cwd, env, stderr).
+        :param name: A name for the workers (by default, the program's).
+
+        Other keyword arguments are as for L{ServerProxy}.
+        """
+        self.command = command
+        self.workers = workers
+        self.attach = attach
+        self.grace = grace
+        self.popen_opts = popen_opts
+        self.name = name
+        super(StdioServerProxy, self).__init__('stdio://localhost', framing=framing, **kwargs)
+        self.host = self.transport.name
+
+    def _create_transport(self, pool_connections):
+        """
+        Builds a L{StdioTransport}.  (Workers are always persistent, so pooling is moot.)
+        """
+        return StdioTransport(self.command, workers=self.workers, attach=self.attach, framing=self.framing,
+                              timeout=self.timeout, grace=self.grace, popen_opts=self.popen_opts, name=self.name)
@@ -0,0 +1,128 @@
+"""
+Incremental encoding of requests whose params are produced by iterators.
+
+Building a large params structure, then its JSON string, then sending it needs several
+copies of the data in memory at once.  When the params (or a single param) are an
+iterator or generator, the request is instead encoded piece by piece and sent with
+C{Transfer-Encoding: chunked}, so only about one chunk is held in memory at a time.
+"""
+from __future__ import absolute_import
+
+import json
+
+try:
+    from collections.abc import Iterator
+except ImportError:  # Python 2
+    from collections import Iterator
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def is_streaming(params):
+    """
+    Whether the params are, or directly contain, an iterator.
+
+    :param params: The positional (C{list}/C{tuple}) or keyword (C{dict}) params, or an iterator.
+
+    :rtype: C{bool}
+    """
+    if isinstance(params, Iterator):
+        return True
+    if isinstance(params, dict):
+        return any(isinstance(v, Iterator) for v in params.values())
+    if isinstance(params, (list, tuple)):
+        return any(isinstance(v, Iterator) for v in params)
+    return False
+
+
+def _encode_value(value):
+    """
+    Yields the JSON text of a param, expanding an iterator into an array item by item.
+    """
+    if isinstance(value, Iterator):
+        yield '['
+        first = True
+        for item in value:
+            if not first:
+                yield ','
+            first = False
+            yield json.dumps(item)
+        yield ']'
+    else:
+        yield json.dumps(value)
+
+
+def _encode_pieces(data):
+    yield '{'
+    first = True
+    for key, value in data.items():
+        if not first:
+            yield ','
+        first = False
+        yield json.dumps(key)
+        yield ':'
+        if key != 'params':
+            yield json.dumps(value)
+        elif isinstance(value, dict):
+            yield '{'
+            for i, (name, param) in enumerate(value.items()):
+                if i:
+                    yield ','
+                yield json.dumps(name)
+                yield ':'
+                for piece in _encode_value(param):
+                    yield piece
+            yield '}'
+        elif isinstance(value, (list, tuple)):
+            yield '['
+            for i, param in enumerate(value):
+                if i:
+                    yield ','
+                for piece in _encode_value(param):
+                    yield piece
+            yield ']'
+        else:
+            for piece in _encode_value(value):
+                yield piece
+    yield '}'
+
+
+def iterencode(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Encodes a request incrementally.
+
+    The items of iterator params are encoded one at a time (each with C{json.dumps}) and
+    gathered into chunks of about C{chunk_size} bytes.
+
+    :param data: The request (with 'id', 'method' and 'params' keys).
+    :type data: C{dict}
+
+    :param chunk_size: The size at which a chunk is handed out.
+    :type chunk_size: C{int}
+
+    :return: The encoded request, in chunks.
+    :rtype: iterator of C{bytes}
+    """
+    buffered = []
+    size = 0
+    for piece in _encode_pieces(data):
+        buffered.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffered).encode('utf-8')
+            buffered = []
+            size = 0
+    if buffered:
+        yield ''.join(buffered).encode('utf-8')
@@ -0,0 +1,390 @@
+"""
+JSON-RPC over a persistent TCP (or TLS) socket.
+
+HTTP/1.1 keep-alive only allows one outstanding call per connection.  This transport
+instead frames JSON-RPC messages directly on a socket (newline-delimited or with a
+4-byte length prefix, or with Content-Length headers as in the Language Server Protocol)
+and matches responses to callers by id, so many threads can have
+calls in flight on one socket and the server may answer them in any order.
+"""
+from __future__ import absolute_import
+
+import json
+import socket
+import struct
+import logging
+import itertools
+import threading
+
+from rpctools.six.moves import http_client as httplib
+from rpctools.jsonrpc import ssl_wrapper
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import JsonRpcError, ConnectionError, ResponseError
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+FRAMINGS = ('newline', 'length', 'content-length')
+
+_LENGTH = struct.Struct('>I')
+
+
+def encode_frame(payload, framing):
+    """
+    Frames an encoded message for the wire.
+
+    :param payload: The encoded message.
+    :type payload: C{bytes}
+
+    :param framing: 'newline', 'length' or 'content-length'.
+    :type framing: C{str}
+
+    :rtype: C{bytes}
+    """
+    if framing == 'newline':
+        return payload + b'\n'
+    if framing == 'content-length':
+        return ('Content-Length: %d\r\n\r\n' % len(payload)).encode('ascii') + payload
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def read_frame(rfile, framing):
+    """
+    Reads one framed message.
+
+    :param rfile: A buffered binary file object for the socket (or pipe).
+    :param framing: 'newline', 'length' or 'content-length'.
+    :type framing: C{str}
+
+    :return: The message payload, or C{None} at end of stream.
+    :rtype: C{bytes}
+
+    :raise ValueError: If a 'content-length' frame has no (valid) Content-Length header.
+    """
+    if framing == 'newline':
+        line = rfile.readline()
+        if not line.endswith(b'\n'):
+            return None
+        return line
+    if framing == 'content-length':
+        length = None
+        while True:
+            line = rfile.readline()
+            if not line.endswith(b'\n'):
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value)  # (Other headers, e.g. Content-Type, are ignored.)
+        if length is None:
+            raise ValueError('Frame has no Content-Length header')
+    else:
+        header = rfile.read(_LENGTH.size)
+        if len(header) < _LENGTH.size:
+            return None
+        (length,) = _LENGTH.unpack(header)
+    payload = rfile.read(length)
+    if len(payload) < length:
+        return None
+    return payload
+
+
+class _Pending(object):
+    """
+    A call waiting for its response.
+    """
+    __slots__ = ('done', 'response', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class _Connection(object):
+    """
+    One socket, its reader thread and the calls waiting on it.
+    """
+
+    def __init__(self, transport, sock):
+        self.transport = transport
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.pending = {}
+        self.closed = False
+        self.reader = threading.Thread(target=self._read, name='rpctools-tcp-%s' % transport.host)
+        self.reader.daemon = True
+
+    def _read(self):
+        error = None
+        try:
+            while True:
+                frame = read_frame(self.rfile, self.transport.framing)
+                if frame is None:
+                    break
+                try:
+                    message = json.loads(frame.decode('utf-8'))
+                    wire_id = message.get('id')
+                except Exception as x:
+                    error = ResponseError("Unable to parse response data as JSON: %s" % x)
+                    break
+                with self.transport._lock:
+                    pending = self.pending.pop(wire_id, None)
+                if pending is None:
+                    self.transport.logger.debug('Discarding response with unknown id %r' % (wire_id,))
+                    continue
+                pending.response = message
+                pending.done.set()
+        except (socket.error, ValueError) as x:
+            error = x
+        self.transport._disconnect(self, error)
+
+
+class TCPTransport(object):
+    """
+    Sends JSON-RPC messages over one persistent socket shared by all threads.
+
+    Calls are written whole under a lock; a reader thread hands each response to the
+    caller waiting on its id.  Ids are replaced on the wire by ids unique to the
+    transport, so any number of proxies (and threads) may share it.  A broken socket
+    fails the calls in flight on it with L{ConnectionError}; the next call reconnects.
+
+    :ivar framing: 'newline' (newline-delimited JSON), 'length' (4-byte big-endian length prefix)
+                   or 'content-length' (Content-Length headers).
+    :type framing: C{str}
+
+    :ivar timeout: Seconds to wait for connecting and for each response (default is forever).
+    :type timeout: C{float}
+    """
+
+    def __init__(self, host, framing='newline', timeout=None, use_ssl=False, ssl_opts=None, validate_cert_hostname=True,
+                 socket_opts=None):
+        """
+        :param host: The host in "host:port" syntax.
+        :type host: C{str}
+
+        :param framing: 'newline', 'length' or 'content-length'.
+        :type framing: C{str}
+
+        :param timeout: Seconds to wait for connecting and for each response.
+        :type timeout: C{float}
+
+        :param use_ssl: Whether to wrap the socket in TLS.
+        :type use_ssl: C{bool}
+
+        :param ssl_opts: Options as for L{ssl_wrapper.CertValidatingHTTPSConnection}.
+        :type ssl_opts: C{dict}
+
+        :param socket_opts: Options applied to the socket, on top of the defaults (see
+                            L{ssl_wrapper.configure_socket}).
+        :type socket_opts: C{dict}
+        """
+        if framing not in FRAMINGS:
+            raise ValueError('framing must be one of %s' % (FRAMINGS,))
+        self.logger = logging.getLogger('{0.__module__}.{0.__name__}'.format(self.__class__))
+        self.host = host
+        self.framing = framing
+        self.timeout = timeout
+        self.use_ssl = use_ssl
+        self.ssl_opts = ssl_opts or {}
+        self.validate_cert_hostname = validate_cert_hostname
+        self.socket_opts = ssl_wrapper.with_default_socket_opts(socket_opts or {})
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._connection = None
+
+    def call(self, data):
+        """
+        Sends a request and waits for its response.
+
+        :param data: The request (with 'id', 'method' and 'params' keys).
+        :type data: C{dict}
+
+        :return: The decoded JSON-RPC response (with the caller's id restored).
+        :rtype: C{dict}
+
+        :raise ConnectionError: If the socket fails or the response does not arrive in time.
+        :raise ResponseError: If the response cannot be parsed.
+        """
+        wire_id = next(self._ids)
+        message = dict(data)
+        message['id'] = wire_id
+        pending = _Pending()
+        connection = self._send(message, wire_id, pending)
+        if not pending.done.wait(self.timeout):
+            with self._lock:
+                connection.pending.pop(wire_id, None)
+            raise ConnectionError("Timed out waiting for response from host %s" % self.host)
+        if pending.error is not None:
+            raise pending.error
+        pending.response['id'] = data.get('id')
+        return pending.response
+
+    def notify(self, data):
+        """
+        Sends a notification (a request without an id); nothing is waited for.
+
+        :param data: The notification (with 'method' and 'params' keys).
+        :type data: C{dict}
+
+        :raise ConnectionError: If the socket fails.
+        """
+        self._send(data, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the socket, failing any calls still in flight.
+        """
+        with self._write_lock:
+            connection = self._connection
+        if connection is not None:
+            self._disconnect(connection, None)
+
+    def _send(self, message, wire_id, pending):
+        frame = encode_frame(json.dumps(message).encode('utf-8'), self.framing)
+        with self._write_lock:
+            connection = self._connect()
+            if pending is not None:
+                with self._lock:
+                    if connection.closed:
+                        raise ConnectionError("Connection to host %s lost." % self.host)
+                    connection.pending[wire_id] = pending
+            try:
+                connection.sock.sendall(frame)
+            except socket.error as x:
+                self._disconnect(connection, x)
+                raise ConnectionError("Error connecting to host %s: %r" % (self.host, x))
+        return connection
+
+    def _connect(self):
+        """
+        Returns the open connection, opening one if necessary.  (Called with the write lock held.)
+        """
+        if self._connection is not None:
+            return self._connection
+        hostname, _, port = self.host.rpartition(':')
+        try:
+            sock = socket.create_connection((hostname, int(port)), self.timeout)
+            ssl_wrapper.configure_socket(sock, self.socket_opts)
+            if self.use_ssl:
+                sock = ssl_wrapper.wrap_socket(sock, hostname, self.ssl_opts, self.validate_cert_hostname)
+        except (socket.error, httplib.HTTPException) as x:
+            raise ConnectionError("Error connecting to host %s: %r" % (self.host, x))
+        sock.settimeout(None)
+        connection = self._connection = _Connection(self, sock)
+        connection.reader.start()
+        return connection
+
+    def _disconnect(self, connection, error):
+        """
+        Closes a connection and fails its pending calls.
+        """
+        with self._lock:
+            if self._connection is connection:
+                self._connection = None
+            if connection.closed:
+                return
+            connection.closed = True
+            pending, connection.pending = connection.pending, {}
+        try:
+            connection.sock.close()
+        except socket.error:
+            pass
+        if pending:
+            if not isinstance(error, ResponseError):
+                error = ConnectionError("Connection to host %s lost: %r" % (self.host, error))
+            for p in pending.values():
+                p.error = error
+                p.done.set()
+
+
+class TCPServerProxy(ServerProxy):
+    """
+    A L{ServerProxy} for "tcp://host:port" and "tcps://host:port" URIs, sending over a
+    L{TCPTransport}.
+
+    There is no HTTP here, so extra headers and the L{_handle_response} hook do not apply.
+    Unlike the HTTP proxies, an instance may be shared by many threads; so may its
+    transport be shared with other proxies (C{proxy.transport = other.transport}).
+    """
+
+    default_ports = {'tcp': None, 'tcps': None}
+
+    def __init__(self, uri, framing='newline', **kwargs):
+        """
+        :param uri: The endpoint URI (tcp:// or tcps://, port required).
+        :param framing: 'newline' (newline-delimited JSON), 'length' (4-byte length prefix) or
+                        'content-length' (Content-Length headers).
+
+        Other keyword arguments are as for L{ServerProxy}.
+        """
+        if kwargs.get('batch_opts') is not None:
+            raise JsonRpcError('Batching does not apply to multiplexed TCP connections.')
+        self.framing = framing
+        super(TCPServerProxy, self).__init__(uri, **kwargs)
+
+    def _create_transport(self, pool_connections):
+        """
+        Builds a L{TCPTransport}.  (Connections are always persistent, so pooling is moot.)
+        """
+        return TCPTransport(self.host, framing=self.framing, timeout=self.timeout, use_ssl=self.type == 'tcps',
+                            ssl_opts=self.ssl_opts, validate_cert_hostname=self.validate_cert_hostname,
+                            socket_opts=self.socket_opts)
+
+    def _send(self, data, headers, priority=None, host=None):
+        """
+        Overrides method to send over the multiplexed socket.  (Calls are not limited, so
+        the priority is moot; hedges go out on the same socket.)
+        """
+        return self._finish(data, self._fetch(data, headers))
+
+    def _fetch(self, data, headers, priority=None, host=None):
+        """
+        Overrides method to send over the multiplexed socket.
+
+        :return: The decoded response and the headers.
+        :rtype: C{tuple}
+        """
+        return self.transport.call(data), headers
+
+    def _finish(self, data, fetched):
+        """
+        Overrides method to cache the decoded response and build its records.
+        """
+        decoded, headers = fetched
+        self._cache_decoded(data, headers, decoded)
+        if data['method'] in self.result_schemas:
+            decoded = self.result_schemas[data['method']].convert(decoded)
+        return decoded
+
+    def _discard(self, fetched):
+        """
+        Overrides method; there is nothing to let go of.
+        """
+
+    def _notify(self, methodname, params):
+        """
+        Overrides method to write the notification straight to the socket.
+        """
+        data = dict(method=methodname, params=params)
+        self._prepare_request(data, {})
+        self.transport.notify(data)
+        return True
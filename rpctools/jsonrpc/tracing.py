@@ -0,0 +1,175 @@
+"""
+Phase-level tracing of calls, in the style of OpenTelemetry spans.
+
+A L{Tracer} starts a L{Span} for every call; the transport and proxy then mark the
+boundaries of each phase on it::
+
+    throttle_start, throttle_end  waiting for a rate-limiter token
+    queue_start, queue_end        waiting for a concurrency-limiter slot
+    dns_start, dns_end            name resolution
+    connect_start, connect_end    TCP connect
+    tls_start, tls_end            TLS handshake
+    send_start, send_end          writing the request
+    first_byte                    response status line and headers received
+    read_end                      response body read
+    decode_end                    response decoded
+
+(The connection phases are only marked when a new connection is opened; the
+"connection.reused" attribute says whether a pooled connection was used.)
+
+The default tracer hands out a shared no-op span, so an untraced call costs a few empty
+method calls.
+"""
+from __future__ import absolute_import
+
+import time
+from collections import deque
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# (phase name, start mark, end mark) used to compute L{RecordingSpan.durations}.
+PHASES = (
+    ('throttle', 'throttle_start', 'throttle_end'),
+    ('queue', 'queue_start', 'queue_end'),
+    ('dns', 'dns_start', 'dns_end'),
+    ('connect', 'connect_start', 'connect_end'),
+    ('tls', 'tls_start', 'tls_end'),
+    ('send', 'send_start', 'send_end'),
+    ('wait', 'send_end', 'first_byte'),
+    ('read', 'first_byte', 'read_end'),
+    ('decode', 'read_end', 'decode_end'),
+)
+
+
+class Span(object):
+    """
+    A call being traced.  This base class does nothing; see L{RecordingSpan}.
+    """
+    __slots__ = ()
+
+    def mark(self, phase):
+        """
+        Record that a phase boundary has been reached (now).
+
+        :param phase: The boundary name (e.g. 'connect_start').
+        :type phase: C{str}
+        """
+
+    def set_attribute(self, key, value):
+        """
+        Attach a piece of information to the span (e.g. 'connection.reused').
+        """
+
+    def end(self, error=None):
+        """
+        Finish the span.
+
+        :param error: The exception the call failed with, if any.
+        :type error: C{Exception}
+        """
+
+
+NOOP_SPAN = Span()
+
+
+class Tracer(object):
+    """
+    Starts spans for calls.  This base class only hands out the no-op span.
+    """
+
+    def start_span(self, host, handler, method):
+        """
+        :param host: The host (optionally in "host:port" syntax).
+        :type host: C{str}
+
+        :param handler: Target RPC handler (e.g. '/jsonrpc').
+        :type handler: C{str}
+
+        :param method: The JSON-RPC method name (C{None} if unknown, e.g. for batches).
+        :type method: C{str}
+
+        :rtype: L{Span}
+        """
+        return NOOP_SPAN
+
+
+class RecordingSpan(Span):
+    """
+    A span that keeps timestamps (from C{time.time()}) for every mark.
+
+    :ivar marks: (phase, timestamp) pairs, starting with ('start', ...).
+    :type marks: C{list}
+
+    :ivar attributes: Attributes set on the span.
+    :type attributes: C{dict}
+
+    :ivar error: The exception the call failed with, if any.
+    :type error: C{Exception}
+    """
+    __slots__ = ('tracer', 'host', 'handler', 'method', 'marks', 'attributes', 'error')
+
+    def __init__(self, tracer, host, handler, method):
+        self.tracer = tracer
+        self.host = host
+        self.handler = handler
+        self.method = method
+        self.marks = [('start', time.time())]
+        self.attributes = {}
+        self.error = None
+
+    def mark(self, phase):
+        self.marks.append((phase, time.time()))
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        self.error = error
+        self.marks.append(('end', time.time()))
+        self.tracer.finish(self)
+
+    def durations(self):
+        """
+        :return: Seconds spent in each phase that was marked, plus 'total'.
+        :rtype: C{dict} of C{str} to C{float}
+        """
+        times = dict(self.marks)
+        result = {}
+        for phase, start, end in PHASES:
+            if start in times and end in times:
+                result[phase] = times[end] - times[start]
+        result['total'] = self.marks[-1][1] - self.marks[0][1]
+        return result
+
+
+class RecordingTracer(Tracer):
+    """
+    A tracer that keeps the most recent finished L{RecordingSpan}s.
+
+    Subclasses may override L{finish} to export spans elsewhere.
+
+    :ivar spans: The finished spans, oldest first.
+    :type spans: C{collections.deque}
+    """
+
+    def __init__(self, maxlen=1000):
+        self.spans = deque(maxlen=maxlen)
+
+    def start_span(self, host, handler, method):
+        return RecordingSpan(self, host, handler, method)
+
+    def finish(self, span):
+        """
+        Called when a span ends.
+        """
+        self.spans.append(span)
@@ -1,14 +1,19 @@
 from __future__ import absolute_import
 
 import sys
+import time
 import socket
 import logging
 
+from rpctools import six
 from rpctools.six import reraise
 from rpctools.six.moves import http_client as httplib
 from rpctools.jsonrpc import ssl_wrapper
-from rpctools.jsonrpc.exc import ConnectionError, ProtocolError
-from rpctools.jsonrpc.pool import TLSConnectionPoolMixin
+from rpctools.jsonrpc.exc import ConnectionError, ProtocolError, ConcurrencyLimitExceeded, RateLimitExceeded
+from rpctools.jsonrpc.limiter import hold_until_read
+from rpctools.jsonrpc.ratelimit import THROTTLE_STATUSES, parse_retry_after
+from rpctools.jsonrpc.pool import TLSConnectionPoolMixin, SessionAffinityPoolMixin
+from rpctools.jsonrpc.tracing import Tracer
 
 __license__ = """Licensed under the Apache License, Version 2.0 (the "License");
 you may not use this file except in compliance with the License.
@@ -33,17 +38,44 @@ class Transport(object):
     :ivar timeout: The socket timeout (in seconds) to use on httplib connections.
                         (defaults to socket._GLOBAL_DEFAULT_TIMEOUT)
     :type timeout: C{int}
+
+    :ivar tracer: Starts tracing spans for requests made without one (see L{rpctools.jsonrpc.tracing}).
+    :type tracer: L{Tracer}
+
+    :ivar limiter: Limits the requests in flight to each host (optional; see
+                   L{rpctools.jsonrpc.limiter}).
+    :type limiter: L{rpctools.jsonrpc.limiter.AdaptiveLimiter}
+
+    :ivar socket_opts: Options applied to every socket opened (see
+                       L{ssl_wrapper.configure_socket}; by default only TCP_NODELAY is set).
+    :type socket_opts: C{dict}
+
+    :ivar rate_limiter: Limits the rate of requests to each host and method (optional; see
+                        L{rpctools.jsonrpc.ratelimit}).
+    :type rate_limiter: L{rpctools.jsonrpc.ratelimit.RateLimiter}
     """
 
     user_agent = "JSON-RPC Client"
     timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+    tracer = Tracer()
+    limiter = None
+    rate_limiter = None
+    socket_opts = None
 
-    def __init__(self, timeout=None):
+    def __init__(self, timeout=None, socket_opts=None):
         self.logger = logging.getLogger('{0.__name__}.{0.__module__}'.format(self.__class__))
         if timeout is not None:
             self.timeout = timeout
+        if socket_opts is not None:
+            self.socket_opts = socket_opts
+
+    def __enter__(self):
+        return self
 
-    def request(self, host, handler, body, headers=None, verbose=False):
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, host, handler, body, headers=None, verbose=False, span=None, priority=None, method=None):
         """
         Send a complete request, and parse the response.
 
@@ -53,7 +85,9 @@ class Transport(object):
         :param handler: Target PRC handler (e.g. '/jsonrpc').
         :type handler: C{str}
 
-        :param body: Request body. (Assumes it is already correctly formatted/encoded.)
+        :param body: Request body. (Assumes it is already correctly formatted/encoded.)  An
+                     iterable of C{bytes} chunks (see L{rpctools.jsonrpc.streaming}) is sent
+                     with C{Transfer-Encoding: chunked}.
         :type body: C{str}
 
         :param headers: HTTP headers to send with request.
@@ -62,14 +96,89 @@ class Transport(object):
         :param verbose: Debugging flag.
         :type verbose: C{bool}
 
+        :param span: The tracing span to mark the connect, send and first-byte phases on.
+                     (If not given, one is started from L{tracer} and ended once the
+                     response headers have been received.)
+        :type span: L{rpctools.jsonrpc.tracing.Span}
+
+        :param priority: The request's priority when waiting for a L{limiter} slot (see
+                         L{rpctools.jsonrpc.limiter}).  The wait is marked on the span as
+                         the 'queue' phase.  The slot is held until the response body
+                         has been read (or the response closed).
+        :type priority: C{int}
+
+        :param method: The method called, for its L{rate_limiter} limit (if any), or the
+                       methods of a batch's calls.  The wait for a token is marked on the
+                       span as the 'throttle' phase.
+        :type method: C{str} or C{list}
+
         :return: The response to the request.
         :rtype: C{httplib.HTTPResponse}
 
-        :raise ProtocolError: If the response status is not 200.
+        :raise ProtocolError: If the response status is not 200 (or 204, which servers may
+                              send in reply to notifications).
+
+        :raise ConcurrencyLimitExceeded: If a L{limiter} is set and no request slot for the
+                                         host became free in time.
+
+        :raise RateLimitExceeded: If a L{rate_limiter} is set and the request would exceed
+                                  its rate (in time).
         """
         if headers is None:
             headers = {}
 
+        own_span = span is None
+        if own_span:
+            span = self.tracer.start_span(host, handler, None)
+
+        if self.rate_limiter is not None:
+            span.mark('throttle_start')
+            try:
+                self.rate_limiter.acquire(host, method)
+            except RateLimitExceeded as x:
+                if own_span:
+                    span.end(x)
+                raise
+            span.mark('throttle_end')
+
+        limit = None
+        if self.limiter is not None:
+            limit = self.limiter.for_host(host)
+            span.mark('queue_start')
+            try:
+                limit.acquire(priority)
+            except ConcurrencyLimitExceeded as x:
+                if own_span:
+                    span.end(x)
+                raise
+            span.mark('queue_end')
+        started = time.time()
+        failed = False
+        response = None
+        try:
+            response = self._request(host, handler, body, headers, verbose, span, own_span)
+            return response
+        except ConnectionError:
+            failed = True
+            raise
+        except ProtocolError as x:
+            # Throttling and server errors are taken as signs of overload.
+            failed = x.errcode == 429 or x.errcode >= 500
+            if self.rate_limiter is not None and x.errcode in THROTTLE_STATUSES and x.retry_after is not None:
+                self.rate_limiter.pause(host, x.retry_after)
+            raise
+        finally:
+            if limit is not None:
+                if response is not None:
+                    hold_until_read(response, limit, started)  # (Given back once the body is read.)
+                else:
+                    limit.release(time.time() - started, failed)
+
+    def _request(self, host, handler, body, headers, verbose, span, own_span):
+        """
+        Performs the request (see L{request}) once a slot has been acquired.
+        """
+
         conn = self.connect(host)
 
         if verbose:
@@ -81,21 +190,100 @@ class Transport(object):
         headers['User-Agent'] = self.user_agent
         if 'content-type' not in header_keys_lower:
             headers['Content-Type'] = 'application/json'
-        headers['Content-Length'] = len(body) if body is not None else 0
+        chunked = body is not None and not isinstance(body, (six.binary_type, six.text_type))
+        if chunked:
+            headers.pop('Content-Length', None)
+            headers['Transfer-Encoding'] = 'chunked'
+        else:
+            headers.pop('Transfer-Encoding', None)
+            headers['Content-Length'] = len(body) if body is not None else 0
 
         try:
-            conn.request("POST", handler, body, headers)
+            reused = conn.sock is not None
+            span.set_attribute('connection.reused', reused)
+            conn.span = span
+            if not reused:
+                conn.connect()
+            span.mark('send_start')
+            if chunked:
+                try:
+                    self._send_chunked(conn, handler, body, headers)
+                except (socket.error, httplib.HTTPException):
+                    raise
+                except Exception as x:
+                    # The body broke off (e.g. the params iterator failed), so the connection
+                    # is left mid-request and cannot be reused.
+                    self.handle_connection_error(host, x)
+                    conn.close()
+                    if own_span:
+                        span.end(x)
+                    raise
+            else:
+                conn.request("POST", handler, body, headers)
+            span.mark('send_end')
             response = conn.getresponse()
+            span.mark('first_byte')
+            self._hand_off(conn)
 
-            if response.status != 200:
-                raise ProtocolError(host + handler, response.status, response.reason, headers)
+            if response.status not in (200, 204):
+                response.read()  # Leave the connection ready for the next request.
+                raise ProtocolError(host + handler, response.status, response.reason, headers,
+                                    retry_after=parse_retry_after(response.getheader('Retry-After')))
 
+            if own_span:
+                span.end()
             return response
         except (socket.error, httplib.HTTPException) as x:
             self.handle_connection_error(host, x)
+            conn.close()
             exc_class, exc, tb = sys.exc_info()
             cerror = ConnectionError("Error connecting to host %s: %r" % (host, x))
+            if own_span:
+                span.end(cerror)
             reraise(ConnectionError, cerror, tb)
+        except ProtocolError as x:
+            if own_span:
+                span.end(x)
+            raise
+
+    def _send_chunked(self, conn, handler, chunks, headers):
+        """
+        Sends a request whose body is an iterable of chunks, using chunked transfer encoding.
+
+        :param conn: The connection.
+        :type conn: C{httplib.HTTPConnection}
+
+        :param chunks: The body, in pieces.
+        :type chunks: iterable of C{bytes}
+        """
+        conn.putrequest("POST", handler)
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders()
+        for chunk in chunks:
+            if chunk:
+                conn.send(('%x\r\n' % len(chunk)).encode('ascii') + chunk + b'\r\n')
+        conn.send(b'0\r\n\r\n')
+
+    def _hand_off(self, conn):
+        """
+        Hands the connection's socket over to its response, which closes it once it has been
+        read (or closed).  The connection is not used again.
+
+        :param conn: The connection.
+        :type conn: C{httplib.HTTPConnection}
+        """
+        sock, conn.sock = conn.sock, None
+        if sock is not None:
+            sock.close()  # (The socket stays open until the response's file is closed.)
+
+    def close(self):
+        """
+        Releases the transport's connections.
+
+        Each connection is closed once its response has been read, so there is nothing
+        left to close here; pooling transports override this.
+        """
 
     def handle_connection_error(self, host, x):
         """
@@ -120,7 +308,7 @@ class Transport(object):
         :return: A connection handle.
         :rtype: C{httplib.HTTPConnection}
         """
-        return httplib.HTTPConnection(host, timeout=self.timeout)
+        return ssl_wrapper.HTTPConnection(host, timeout=self.timeout, socket_opts=self.socket_opts)
 
 
 class SafeTransport(Transport):
@@ -128,8 +316,8 @@ class SafeTransport(Transport):
     Extends/overrides Transport to use HTTPS connections.
     """
 
-    def __init__(self, validate_cert_hostname=True, timeout=None, ssl_opts=None):
-        super(SafeTransport, self).__init__(timeout=timeout)
+    def __init__(self, validate_cert_hostname=True, timeout=None, ssl_opts=None, socket_opts=None):
+        super(SafeTransport, self).__init__(timeout=timeout, socket_opts=socket_opts)
         self.validate_cert_hostname = validate_cert_hostname
         self.ssl_opts = ssl_opts or {}
 
@@ -137,7 +325,8 @@ class SafeTransport(Transport):
         """
         Connect securely (HTTPS) to host.
         """
-        return ssl_wrapper.CertValidatingHTTPSConnection(host, ssl_opts=self.ssl_opts, validate_cert_hostname=self.validate_cert_hostname)
+        return ssl_wrapper.CertValidatingHTTPSConnection(host, ssl_opts=self.ssl_opts, validate_cert_hostname=self.validate_cert_hostname,
+                                                         socket_opts=self.socket_opts)
 
 
 class TLSConnectionPoolTransport(TLSConnectionPoolMixin, Transport):
@@ -146,3 +335,11 @@ class TLSConnectionPoolTransport(TLSConnectionPoolMixin, Transport):
 
 class TLSConnectionPoolSafeTransport(TLSConnectionPoolMixin, SafeTransport):
     pass
+
+
+class SessionAffinityPoolTransport(SessionAffinityPoolMixin, Transport):
+    pass
+
+
+class SessionAffinityPoolSafeTransport(SessionAffinityPoolMixin, SafeTransport):
+    pass
@@ -0,0 +1,238 @@
+"""
+An XML-RPC client on the same transports as the JSON-RPC client, so XML-RPC calls get
+keep-alive connection pooling and validated TLS (client certificates, CA and hostname
+checks) too.
+"""
+from __future__ import absolute_import
+
+import base64
+import logging
+
+from rpctools.six.moves import xmlrpc_client
+from rpctools.six.moves.urllib.parse import urlparse, unquote
+from rpctools.jsonrpc.client import _Method
+from rpctools.jsonrpc.exc import JsonRpcError, Fault, ResponseError
+from rpctools.jsonrpc.transport import Transport, SafeTransport, TLSConnectionPoolSafeTransport, TLSConnectionPoolTransport
+from rpctools.xmlrpc.unmarshal import loads
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class _XmlRpcMethod(_Method):
+    """
+    A proxy callable for an XML-RPC method (which takes positional parameters only).
+    """
+
+    def __getattr__(self, name):
+        return self.__class__(self._send, "%s.%s" % (self._name, name))
+
+    def __call__(self, *args, **kwargs):
+        if kwargs:
+            raise JsonRpcError('XML-RPC does not support keyword arguments.')
+        return self._send(self._name, args)
+
+
+class ServerProxy(object):
+    """
+    A proxy to the remote XML-RPC service methods.
+
+    Like the JSON-RPC L{rpctools.jsonrpc.client.ServerProxy} (whose transports it uses),
+    this class is NOT THREAD-SAFE.
+
+    :ivar host: The host we're connecting to (may include port, e.g. "foobar.com:8080")
+    :type host: C{str}
+
+    :ivar handler: The path of the endpoint (e.g. '/RPC2').
+    :type handler: C{str}
+
+    :ivar transport: A L{Transport} instance to use.
+    :type transport: L{Transport}
+
+    :ivar encoding: The character encoding of requests.
+    :type encoding: C{str}
+
+    :ivar allow_none: Whether C{None} may be sent (as the common <nil/> extension).
+    :type allow_none: C{bool}
+
+    :ivar use_datetime: Whether dateTime.iso8601 values are returned as C{datetime.datetime}.
+    :type use_datetime: C{bool}
+    """
+
+    method_class = _XmlRpcMethod
+
+    default_ports = {'http': 80, 'https': 443}
+
+    content_type = 'text/xml'
+
+    def __init__(self, uri, validate_cert_hostname=True, extra_headers=None, timeout=None, pool_connections=False,
+                 ssl_opts=None, encoding='utf-8', allow_none=False, use_datetime=False, socket_opts=None):
+        """
+        :param uri: The endpoint XML-RPC server URL.
+        :param extra_headers: Any additional headers to include with all requests.
+        :param pool_connections: Whether to use a thread-local connection pool for connections.
+        :param ssl_opts: Dictionary of options passed to ssl.wrap_socket
+        :param encoding: The character encoding of requests.
+        :param allow_none: Whether C{None} may be sent.
+        :param use_datetime: Whether to return dateTime.iso8601 values as C{datetime.datetime}.
+        :param socket_opts: Socket options (see L{rpctools.jsonrpc.ssl_wrapper.configure_socket}).
+        """
+        self.logger = logging.getLogger('{0.__module__}.{0.__name__}'.format(self.__class__))
+        if extra_headers is None:
+            extra_headers = {}
+
+        parsed_uri = urlparse(uri)
+
+        self.type = parsed_uri.scheme
+        if self.type not in self.default_ports:
+            raise JsonRpcError("unsupported XML-RPC uri: %s" % uri)
+
+        self.handler = parsed_uri.path or '/RPC2'
+        port = parsed_uri.port or self.default_ports[self.type]
+        self.host = '{}:{}'.format(parsed_uri.hostname, port)
+
+        if parsed_uri.username and parsed_uri.password:
+            auth = '{}:{}'.format(parsed_uri.username, parsed_uri.password)
+            auth = base64.b64encode(unquote(auth).encode('ascii'))
+            extra_headers.update({"Authorization": b"Basic " + auth})
+
+        if self.type == "https":
+            cls = TLSConnectionPoolSafeTransport if pool_connections else SafeTransport
+            self.transport = cls(timeout=timeout, ssl_opts=ssl_opts or {}, validate_cert_hostname=validate_cert_hostname,
+                                 socket_opts=socket_opts)
+        else:
+            cls = TLSConnectionPoolTransport if pool_connections else Transport
+            self.transport = cls(timeout=timeout, socket_opts=socket_opts)
+
+        self.extra_headers = extra_headers
+        self.encoding = encoding
+        self.allow_none = allow_none
+        self.use_datetime = use_datetime
+
+    def _request(self, methodname, params):
+        """
+        Performs an XML-RPC call.
+
+        :param methodname: Name of method to be called.
+        :type methodname: C{str}
+
+        :param params: The positional parameters.
+        :type params: C{tuple}
+
+        :return: The decoded result.
+
+        :raise ResponseError: If the response cannot be parsed.
+        :raise ProtocolError: Re-raises exception if non-200 response received.
+        :raise Fault: If the response is a fault.
+        """
+        body = xmlrpc_client.dumps(tuple(params), methodname, encoding=self.encoding, allow_none=self.allow_none)
+        headers = dict(self.extra_headers)
+        headers['Content-Type'] = self.content_type
+
+        response = self.transport.request(self.host, self.handler, body.encode(self.encoding), headers=headers)
+
+        self._handle_response(response)
+
+        params, _ = loads(response.read(), use_datetime=self.use_datetime)
+        if len(params) != 1:
+            raise ResponseError("Expected exactly one param in response, got %d" % len(params))
+        return params[0]
+
+    def close(self):
+        """
+        Closes the proxy's connections.  (A proxy can also be used as a context manager.)
+        """
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _handle_response(self, response):
+        """
+        An extension point hook for processing the raw response objects from the server.
+
+        :param response: The HTTP response object.
+        :type response: C{httplib.HTTPResponse}
+        """
+        pass
+
+    def __getattr__(self, name):
+        """
+        Does the proxy magic: returns a proxy callable that will perform request (when called).
+
+        :rtype: L{_XmlRpcMethod}
+        """
+        return self.method_class(self._request, name)
+
+    def __repr__(self):
+        return ("<%s for %s%s>" % (self.__class__.__name__, self.host, self.handler))
+
+
+class MultiCall(object):
+    """
+    Gathers calls and sends them in one request (with the C{system.multicall} extension).
+
+    For example::
+
+        multicall = MultiCall(proxy)
+        multicall.add(2, 3)
+        multicall.users.get(42)
+        total, user = multicall()
+
+    Calling the multicall sends the batch; the returned iterator raises L{Fault} in place
+    of any call that failed.
+    """
+
+    def __init__(self, proxy):
+        """
+        :param proxy: The proxy to send the batch through.
+        :type proxy: L{ServerProxy}
+        """
+        self._proxy = proxy
+        self._calls = []
+
+    def _add(self, methodname, params):
+        self._calls.append({'methodName': methodname, 'params': list(params)})
+
+    def __getattr__(self, name):
+        return _XmlRpcMethod(self._add, name)
+
+    def __call__(self):
+        calls, self._calls = self._calls, []
+        return MultiCallIterator(self._proxy._request('system.multicall', (calls,)))
+
+
+class MultiCallIterator(object):
+    """
+    The results of a L{MultiCall}.
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def __getitem__(self, i):
+        item = self.results[i]
+        if isinstance(item, dict):
+            raise Fault(item.get('faultCode'), item.get('faultString'))
+        if isinstance(item, list) and len(item) == 1:
+            return item[0]
+        raise JsonRpcError("Unexpected type in multicall result: %r" % (item,))
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        for i in range(len(self.results)):
+            yield self[i]
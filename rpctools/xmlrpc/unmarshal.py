@@ -0,0 +1,205 @@
+"""
+An expat-based XML-RPC unmarshaller.
+
+Values are built directly from the expat callbacks with one flat stack, so parsing a
+response costs little more than expat itself.  (The standard library's unmarshaller is
+also driven by expat, but does more bookkeeping per element.)
+"""
+from __future__ import absolute_import
+
+import base64
+import datetime
+from xml.parsers import expat
+
+from rpctools.six.moves import xmlrpc_client
+from rpctools.jsonrpc.exc import Fault, ResponseError
+
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class _Name(object):
+    """
+    A struct member name on the value stack (kept apart from string values).
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Unmarshaller(object):
+    """
+    Builds the params (or fault) of an XML-RPC message from expat callbacks.
+
+    :ivar use_datetime: Whether dateTime.iso8601 values become C{datetime.datetime} objects
+                        (instead of C{DateTime}).
+    :type use_datetime: C{bool}
+    """
+
+    def __init__(self, use_datetime=False):
+        self.use_datetime = use_datetime
+        self.methodname = None
+        self._values = []
+        self._marks = []
+        self._data = []
+        self._typed = False
+        self._fault = False
+        self._ends = {
+            'int': self._end_int,
+            'i4': self._end_int,
+            'i8': self._end_int,
+            'i1': self._end_int,
+            'i2': self._end_int,
+            'biginteger': self._end_int,
+            'boolean': self._end_boolean,
+            'string': self._end_string,
+            'double': self._end_double,
+            'float': self._end_double,
+            'bigdecimal': self._end_double,
+            'dateTime.iso8601': self._end_datetime,
+            'base64': self._end_base64,
+            'nil': self._end_nil,
+            'array': self._end_array,
+            'struct': self._end_struct,
+            'name': self._end_name,
+            'value': self._end_value,
+            'fault': self._end_fault,
+            'methodName': self._end_methodname,
+        }
+
+    def start(self, tag, attrs):
+        if tag == 'array' or tag == 'struct':
+            self._marks.append(len(self._values))
+        elif tag == 'value':
+            self._typed = False
+        del self._data[:]
+
+    def data(self, text):
+        """
+        Collects character data.  (L{loads} hands expat C{_data.append} directly, which
+        saves a Python call per text node.)
+        """
+        self._data.append(text)
+
+    def end(self, tag):
+        handler = self._ends.get(tag)
+        if handler is None and ':' in tag:
+            # Namespaced extension types (e.g. ex:nil, ex:i8).
+            handler = self._ends.get(tag.split(':')[-1])
+        if handler is not None:
+            data = self._data
+            handler(data[0] if len(data) == 1 else ''.join(data))
+
+    def close(self):
+        """
+        :return: The params of the message.
+        :rtype: C{tuple}
+
+        :raise Fault: If the message is a fault response.
+        :raise ResponseError: If the message is a fault without a struct value.
+        """
+        if self._fault:
+            if len(self._values) != 1 or not isinstance(self._values[0], dict):
+                raise ResponseError('Malformed XML-RPC fault: %r' % (self._values,))
+            fault = self._values[0]
+            raise Fault(fault.get('faultCode'), fault.get('faultString'))
+        return tuple(self._values)
+
+    def _push(self, value):
+        self._values.append(value)
+        self._typed = True
+
+    def _end_int(self, data):
+        self._push(int(data))
+
+    def _end_boolean(self, data):
+        if data not in ('0', '1'):
+            raise ResponseError("Bad boolean value: %r" % data)
+        self._push(data == '1')
+
+    def _end_string(self, data):
+        self._push(data)
+
+    def _end_double(self, data):
+        self._push(float(data))
+
+    def _end_datetime(self, data):
+        if self.use_datetime:
+            self._push(datetime.datetime.strptime(data.strip(), '%Y%m%dT%H:%M:%S'))
+        else:
+            self._push(xmlrpc_client.DateTime(data.strip()))
+
+    def _end_base64(self, data):
+        self._push(xmlrpc_client.Binary(base64.b64decode(data.encode('ascii'))))
+
+    def _end_nil(self, data):
+        self._push(None)
+
+    def _end_array(self, data):
+        mark = self._marks.pop()
+        items = self._values[mark:]
+        del self._values[mark:]
+        self._push(items)
+
+    def _end_struct(self, data):
+        mark = self._marks.pop()
+        items = self._values[mark:]
+        del self._values[mark:]
+        struct = {}
+        for i in range(0, len(items), 2):
+            struct[items[i].name] = items[i + 1]
+        self._push(struct)
+
+    def _end_name(self, data):
+        self._values.append(_Name(data))
+
+    def _end_value(self, data):
+        # A value without a type element is a string.
+        if not self._typed:
+            self._values.append(data)
+        self._typed = True
+
+    def _end_fault(self, data):
+        self._fault = True
+
+    def _end_methodname(self, data):
+        self.methodname = data
+
+
+def loads(data, use_datetime=False):
+    """
+    Parses an XML-RPC message.
+
+    :param data: The message.
+    :type data: C{bytes}
+
+    :param use_datetime: Whether to return dateTime.iso8601 values as C{datetime.datetime}.
+    :type use_datetime: C{bool}
+
+    :return: The params and the method name (C{None} for responses).
+    :rtype: C{tuple}
+
+    :raise Fault: If the message is a fault response.
+    :raise ResponseError: If the message is not well-formed (or is a malformed fault).
+    """
+    unmarshaller = Unmarshaller(use_datetime)
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = unmarshaller.start
+    parser.EndElementHandler = unmarshaller.end
+    parser.CharacterDataHandler = unmarshaller._data.append
+    try:
+        parser.Parse(data, True)
+    except (expat.ExpatError, ValueError, IndexError, AttributeError) as x:
+        raise ResponseError("Unable to parse XML-RPC message: %s" % x)
+    return unmarshaller.close(), unmarshaller.methodname
@@ -35,7 +35,7 @@ setup(
     long_description=long_description,
     keywords='jsonrpc json-rpc rpc client ssl',
     license='Apache',
-    packages=find_packages(exclude=['tests', 'ez_setup']),
+    packages=find_packages(exclude=['tests', 'benchmarks', 'ez_setup']),
     include_package_data=True,
     zip_safe=True,
     author='Hans Lellelid',
@@ -0,0 +1,370 @@
+"""
+Small threaded JSON-RPC stand-in servers for exercising the client stack in tests.
+
+They dispatch with L{rpctools.jsonrpc.server}, and add request recording, raw TCP
+framing and fault injection on top.
+"""
+import os
+import ssl
+import json
+import time
+import random
+import socket
+import struct
+import threading
+
+from rpctools.six.moves import BaseHTTPServer, socketserver
+from rpctools.jsonrpc.server import Registry, Dispatcher
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.idle_timeout
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if not size:
+                self.rfile.readline()
+                return b''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            return self._read_chunked()
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_POST(self):
+        body = self._read_body()
+        self.server.record(self.headers, body)
+        status, content_type, data = self.server.dispatcher.handle(body, self.headers.get('Content-Type'))
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data or b'')))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+
+class _StandIn(object):
+    """
+    Method dispatch and bookkeeping shared by the stand-in servers.
+
+    :ivar registry: The methods, indexed by (dotted) method name.
+    :type registry: L{Registry}
+
+    :ivar requests: The (headers, body) of every request received.
+    :type requests: C{list}
+
+    :ivar idle_timeout: Seconds a connection may sit idle before the server closes it
+                        (default is never).
+    :type idle_timeout: C{float}
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    idle_timeout = None
+
+    def __init__(self, handler, methods=None, codecs=('json',)):
+        self.server_class.__init__(self, ('127.0.0.1', 0), handler)
+        self.registry = Registry(dict(methods or {}))
+        self.dispatcher = Dispatcher(self.registry, codecs=codecs)
+        self.requests = []
+        self.lock = threading.Lock()
+        self.received = threading.Condition(self.lock)
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+
+    def record(self, headers, body):
+        with self.lock:
+            self.requests.append((headers, body))
+            self.received.notify_all()
+
+    def wait_for_requests(self, count, timeout=5):
+        """
+        Wait until at least C{count} requests have been received.
+        """
+        deadline = time.time() + timeout
+        with self.received:
+            while len(self.requests) < count and time.time() < deadline:
+                self.received.wait(deadline - time.time())
+            return len(self.requests) >= count
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInServer(_StandIn, socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A JSON-RPC over HTTP server on an ephemeral localhost port.
+
+    Requests in a format other than the given codecs get a 415 response.
+    """
+    server_class = BaseHTTPServer.HTTPServer
+
+    def __init__(self, methods=None, codecs=('json',)):
+        _StandIn.__init__(self, _Handler, methods, codecs)
+
+    @property
+    def uri(self):
+        return 'http://%s:%d/jsonrpc' % self.server_address
+
+
+# A TLS record that is not one (an alert claiming a bad MAC, in the clear).
+_BAD_TLS_RECORD = b'\x15\x03\x03\x00\x02\x02\x14'
+
+
+class _FaultHandler(_Handler):
+    """
+    Answers like L{_Handler}, except for the responses picked for a fault.
+    """
+
+    def setup(self):
+        if self.server.ssl_context is not None:
+            self.request.do_handshake()
+        _Handler.setup(self)
+
+    def do_POST(self):
+        body = self._read_body()
+        self.server.record(self.headers, body)
+        fault = self.server.pick_fault()
+        self.server.delay()
+        status, content_type, data = self.server.dispatcher.handle(body, self.headers.get('Content-Type'))
+        data = data or b''
+        head = ['HTTP/1.1 %d %s' % (status, self.responses[status][0]), 'Content-Length: %d' % len(data)]
+        if content_type:
+            head.append('Content-Type: %s' % content_type)
+        if fault == 'close':
+            head.append('Connection: close')
+        response = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data
+
+        if fault == 'tls_failure' and self.server.ssl_context is not None:
+            # Garbage at the TLS record layer, as from a failed renegotiation.
+            os.write(self.connection.fileno(), _BAD_TLS_RECORD)
+            self.close_connection = True
+        elif fault == 'reset':
+            self.wfile.write(response[:len(response) - len(data) // 2 - 1])
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+            self.close_connection = True
+        elif fault == 'truncate':
+            self.wfile.write(response[:len(response) - len(data) // 2 - 1])
+            self.close_connection = True
+        else:
+            self.wfile.write(response)
+            if fault == 'half_close':
+                # As a server does when a keep-alive connection has been idle too long.
+                self.connection.shutdown(socket.SHUT_WR)
+                self.close_connection = True
+            elif fault == 'close':
+                self.close_connection = True
+
+
+class FaultInjectingServer(StandInServer):
+    """
+    A L{StandInServer} that injects faults into its responses, over HTTP or HTTPS.
+
+    The faults are:
+
+        latency       the response is delayed (see C{latency})
+        reset         part of the response is sent, then the connection is reset (RST)
+        truncate      part of the response is sent, then the connection is closed
+        close         the response says "Connection: close", and the connection is closed
+        half_close    the response is sent, then the server stops writing (FIN) while idle
+        tls_failure   a bad TLS record is sent instead of the response (HTTPS only)
+
+    Faults queued with L{inject} go to the next responses; beyond those, each response
+    gets a fault at random with the configured probabilities.
+
+    :ivar opened: The number of connections opened.
+    :type opened: C{int}
+
+    :ivar max_connections: The most connections that were open at once.
+    :type max_connections: C{int}
+
+    :ivar faults_injected: How many times each fault was injected.
+    :type faults_injected: C{dict}
+    """
+    # Many clients reconnect at once after faults; overflowing the default backlog of 5
+    # would stall them for a SYN retransmission (a second).
+    request_queue_size = 128
+
+    def __init__(self, methods=None, faults=None, latency=0, seed=0, tls=False):
+        """
+        :param faults: The probability of each fault (e.g. C{{'reset': 0.05}}).
+        :type faults: C{dict}
+
+        :param latency: Seconds to delay each response by, or a (min, max) range.
+        :type latency: C{float} or C{tuple}
+
+        :param seed: Seeds the random choice of faults and latencies.
+        :type seed: C{int}
+
+        :param tls: Whether to serve HTTPS (with the certificate in L{CERTFILE}).
+        :type tls: C{bool}
+        """
+        self.ssl_context = None
+        if tls:
+            self.ssl_context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+            self.ssl_context.load_cert_chain(CERTFILE)
+        _StandIn.__init__(self, _FaultHandler, methods)
+        self.faults = dict(faults or {})
+        self.latency = latency if isinstance(latency, tuple) else (latency, latency)
+        self.random = random.Random(seed)
+        self.queued = []
+        self.faults_injected = {}
+        self.opened = 0
+        self.connections = 0
+        self.max_connections = 0
+
+    @property
+    def uri(self):
+        if self.ssl_context is None:
+            return StandInServer.uri.fget(self)
+        return 'https://localhost:%d/jsonrpc' % self.server_address[1]
+
+    def inject(self, *faults):
+        """
+        Queue faults for the next responses.
+        """
+        with self.lock:
+            self.queued.extend(faults)
+
+    def pick_fault(self):
+        with self.lock:
+            if self.queued:
+                fault = self.queued.pop(0)
+            else:
+                fault = None
+                roll = self.random.random()
+                for name, probability in sorted(self.faults.items()):
+                    if roll < probability:
+                        fault = name
+                        break
+                    roll -= probability
+            if fault is not None:
+                self.faults_injected[fault] = self.faults_injected.get(fault, 0) + 1
+            return fault
+
+    def delay(self):
+        with self.lock:
+            seconds = self.random.uniform(*self.latency)
+        if seconds:
+            time.sleep(seconds)
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.opened += 1
+            self.connections += 1
+            self.max_connections = max(self.max_connections, self.connections)
+        StandInServer.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        try:
+            StandInServer.shutdown_request(self, request)
+        finally:
+            with self.lock:
+                self.connections -= 1
+
+    def wait_for_idle(self, timeout=5):
+        """
+        Wait until no connections are open.
+        """
+        deadline = time.time() + timeout
+        while self.connections and time.time() < deadline:
+            time.sleep(0.01)
+        return not self.connections
+
+    def get_request(self):
+        sock, address = StandInServer.get_request(self)
+        if self.ssl_context is not None:
+            # The handshake happens in the handler's thread (see _FaultHandler.setup).
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        pass  # The injected faults make for plenty of broken connections.
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+    """
+    Reads framed requests and answers each from its own thread, so that responses
+    go back in whatever order the methods finish.
+    """
+
+    def handle(self):
+        framing = self.server.framing
+        write_lock = threading.Lock()
+        while True:
+            if framing == 'newline':
+                frame = self.rfile.readline()
+                if not frame:
+                    return
+            else:
+                header = self.rfile.read(4)
+                if len(header) < 4:
+                    return
+                frame = self.rfile.read(struct.unpack('>I', header)[0])
+            self.server.record(None, frame)
+            worker = threading.Thread(target=self._respond, args=(frame, write_lock))
+            worker.daemon = True
+            worker.start()
+
+    def _respond(self, frame, write_lock):
+        response = self.server.dispatcher.dispatch(json.loads(frame.decode('utf-8')))
+        if response is None:
+            return
+        payload = json.dumps(response).encode('utf-8')
+        if self.server.framing == 'newline':
+            payload += b'\n'
+        else:
+            payload = struct.pack('>I', len(payload)) + payload
+        with write_lock:
+            try:
+                self.wfile.write(payload)
+            except (IOError, OSError):
+                pass
+
+
+class TCPStandInServer(_StandIn, socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    A JSON-RPC over raw TCP server on an ephemeral localhost port.
+
+    :ivar framing: 'newline' or 'length'.
+    :type framing: C{str}
+    """
+    server_class = socketserver.TCPServer
+
+    def __init__(self, methods=None, framing='newline'):
+        _StandIn.__init__(self, _StreamHandler, methods)
+        self.framing = framing
+
+    @property
+    def uri(self):
+        return 'tcp://%s:%d' % self.server_address
+
+
+# A self-signed certificate (and key) for "localhost" and 127.0.0.1.
+CERTFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'localhost.pem')
+
+
+def sleep_then(seconds, value):
+    """
+    A stand-in method that answers after a delay.
+    """
+    time.sleep(seconds)
+    return value
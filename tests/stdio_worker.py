@@ -0,0 +1,74 @@
+"""
+A JSON-RPC worker process for the stdio transport tests: reads Content-Length-framed
+requests from stdin and answers each from its own thread (so possibly out of order).
+
+Run as a script: python tests/stdio_worker.py
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rpctools.jsonrpc.server import Registry, Dispatcher  # noqa: E402
+from rpctools.jsonrpc.tcp import encode_frame, read_frame  # noqa: E402
+
+remembered = []
+
+
+def sleep_then(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def pid(seconds=0):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def crash():
+    sys.stdout.flush()
+    os._exit(3)
+
+
+def main():
+    registry = Registry()
+    registry.register(lambda value: value, 'echo')
+    registry.register(sleep_then)
+    registry.register(pid)
+    registry.register(crash)
+    registry.register(lambda: 'answered', 'ask')
+    registry.register(remembered.append, 'remember')
+    registry.register(lambda: remembered, 'recall')
+    dispatcher = Dispatcher(registry)
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    lock = threading.Lock()
+
+    def handle(frame):
+        request = json.loads(frame.decode('utf-8'))
+        if request.get('method') == 'ask':
+            # Ask the client something first, with the same id as its own request.
+            question = {'jsonrpc': '2.0', 'id': request['id'], 'method': 'workspace/configuration', 'params': []}
+            with lock:
+                stdout.write(encode_frame(json.dumps(question).encode('utf-8'), 'content-length'))
+                stdout.flush()
+        status, _, data = dispatcher.handle(frame)
+        if data is not None:
+            with lock:
+                stdout.write(encode_frame(data, 'content-length'))
+                stdout.flush()
+
+    while True:
+        frame = read_frame(stdin, 'content-length')
+        if frame is None:
+            break  # Our stdin was closed: exit.
+        t = threading.Thread(target=handle, args=(frame,))
+        t.daemon = True
+        t.start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import Fault
+from tests.server import StandInServer
+
+
+def _fail():
+    raise ValueError('nope')
+
+
+class TestBatchDispatcher(object):
+
+    def test_results_reach_the_right_threads(self):
+        with StandInServer({'double': lambda n: n * 2, 'fail': _fail}) as server:
+            proxy = ServerProxy(server.uri, batch_opts={'window': 0.05, 'max_calls': 8})
+            results = {}
+
+            def worker(n):
+                results[n] = proxy.double(n)
+
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+
+            assert results == dict((n, n * 2) for n in range(16))
+            assert proxy.dispatcher.calls == 16
+            assert proxy.dispatcher.batches < 16
+            assert len(server.requests) == proxy.dispatcher.batches
+
+    def test_fault_in_batch(self):
+        with StandInServer({'fail': _fail}) as server:
+            proxy = ServerProxy(server.uri, batch_opts={'window': 0})
+            with pytest.raises(Fault):
+                proxy.fail()
+
+    def test_shared_dispatcher(self):
+        with StandInServer({'echo': lambda x: x}) as server:
+            first = ServerProxy(server.uri, batch_opts={'window': 0.05, 'max_calls': 2})
+            second = ServerProxy(server.uri)
+            second.dispatcher = first.dispatcher
+            results = []
+            threads = [threading.Thread(target=lambda p=p, x=x: results.append(p.echo(x)))
+                       for p, x in ((first, 'a'), (second, 'b'))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+            assert sorted(results) == ['a', 'b']
+            assert first.dispatcher.batches == 1
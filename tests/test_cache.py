@@ -0,0 +1,187 @@
+import os
+import time
+import threading
+import multiprocessing
+from collections import namedtuple
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import Fault
+from rpctools.jsonrpc.cache import SharedCache
+from rpctools.jsonrpc.tcp import TCPServerProxy
+from tests.server import StandInServer, TCPStandInServer
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='requires POSIX file locking')
+
+
+def _writer(path, n):
+    cache = SharedCache(path)
+    for i in range(200):
+        cache.set('%d-%d' % (n, i), b'value %d-%d' % (n, i), 60)
+    cache.close()
+
+
+def _inherited_writer(cache, n):
+    for i in range(200):
+        cache.set('%d-%d' % (n, i), b'value %d-%d' % (n, i), 60)
+
+
+class TestSharedCache(object):
+
+    def test_get_set_delete(self, tmpdir):
+        cache = SharedCache(str(tmpdir.join('cache')))
+        assert cache.get('a') is None
+        assert cache.set('a', b'one', 60)
+        cache.set('b', b'two', 60)
+        cache.set('a', b'uno', 60)
+        assert (cache.get('a'), cache.get('b')) == (b'uno', b'two')
+        cache.delete('a')
+        assert cache.get('a') is None
+        cache.clear()
+        assert cache.get('b') is None
+        assert cache.stats()['stores'] == 3
+
+    def test_ttl(self, tmpdir):
+        cache = SharedCache(str(tmpdir.join('cache')))
+        cache.set('a', b'one', 0.1)
+        assert cache.get('a') == b'one'
+        time.sleep(0.15)
+        assert cache.get('a') is None
+
+    def test_bounded(self, tmpdir):
+        cache = SharedCache(str(tmpdir.join('cache')), size=4096, entries=64)
+        assert not cache.set('big', b'x' * 2048, 60)
+        for i in range(100):
+            cache.set(str(i), b'x' * 100, 60)
+        assert cache.get('0') is None  # Overwritten in the ring.
+        assert cache.get('99') == b'x' * 100
+        assert 0 < cache.stats()['entries'] < 40
+
+        small = SharedCache(str(tmpdir.join('small')), entries=4, ways=4)
+        for i in range(5):
+            small.set(str(i), b'v', 60)
+        assert small.get('0') is None  # The oldest entry in the bucket was replaced.
+        assert [small.get(str(i)) for i in range(1, 5)] == [b'v'] * 4
+
+    def test_shared_between_processes(self, tmpdir):
+        path = str(tmpdir.join('cache'))
+        cache = SharedCache(path)
+        processes = [multiprocessing.Process(target=_writer, args=(path, n)) for n in range(4)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(30)
+        assert all(p.exitcode == 0 for p in processes)
+        assert cache.stats()['stores'] == 800
+        assert all(cache.get('%d-%d' % (n, i)) == b'value %d-%d' % (n, i) for n in range(4) for i in range(200))
+
+    def test_instances_on_one_file_exclude_each_other(self, tmpdir):
+        path = str(tmpdir.join('cache'))
+        first, second, third = SharedCache(path), SharedCache(path), SharedCache(path)
+        stored = threading.Event()
+        thread = threading.Thread(target=lambda: (second.set('a', b'one', 60), stored.set()))
+        thread.daemon = True
+        with first._locked():
+            thread.start()
+            third.close()  # (Closing another instance keeps the lock.)
+            assert not stored.wait(0.2)
+        assert stored.wait(5)
+        thread.join(5)
+        assert first.get('a') == b'one'
+
+    def test_inherited_instance_in_forked_processes(self, tmpdir):
+        cache = SharedCache(str(tmpdir.join('cache')))
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_inherited_writer, args=(cache, n)) for n in range(4)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(30)
+        assert all(p.exitcode == 0 for p in processes)
+        assert cache.stats()['stores'] == 800
+
+    def test_not_a_cache_file(self, tmpdir):
+        path = tmpdir.join('other')
+        path.write('x' * 100)
+        with pytest.raises(ValueError):
+            SharedCache(str(path))
+
+
+Point = namedtuple('Point', 'x y')
+
+
+class TestServerProxy(object):
+
+    def test_workers_share_responses(self, tmpdir):
+        calls = []
+
+        def origin():
+            calls.append(1)
+            return {'x': 0, 'y': len(calls)}
+
+        def fail():
+            calls.append(1)
+            raise Fault(500, 'nope')
+
+        path = str(tmpdir.join('cache'))
+        with StandInServer({'origin': origin, 'fail': fail, 'other': lambda: 1}) as server:
+            first, second = [ServerProxy(server.uri, cache=SharedCache(path), cache_ttls={'origin': 0.3, 'fail': 60},
+                                         result_types={'origin': Point}) for _ in range(2)]
+            assert first.origin() == Point(0, 1)
+            assert second.origin() == Point(0, 1)
+            assert len(calls) == 1
+
+            time.sleep(0.35)
+            assert second.origin() == Point(0, 2)
+
+            for _ in range(2):
+                with pytest.raises(Fault):
+                    first.fail()
+            assert len(calls) == 4  # Errors are not cached.
+
+    def test_credentials_are_part_of_the_key(self, tmpdir):
+        calls = []
+
+        def origin():
+            calls.append(1)
+            return len(calls)
+
+        path = str(tmpdir.join('cache'))
+        with StandInServer({'origin': origin}) as server:
+            alice, bob, alice_again = [
+                ServerProxy(server.uri, cache=SharedCache(path), cache_ttls={'origin': 60},
+                            extra_headers={'Authorization': 'Bearer %s' % user})
+                for user in ('alice', 'bob', 'alice')]
+            assert alice.origin() == 1
+            assert bob.origin() == 2
+            assert alice_again.origin() == 1
+            other = ServerProxy(server.uri, cache=SharedCache(path), cache_ttls={'origin': 60},
+                                extra_headers={'Authorization': 'Bearer alice'}, cache_namespace='tenant-2')
+            assert other.origin() == 3
+
+    def test_batched_and_tcp_responses_are_cached(self, tmpdir):
+        calls = []
+
+        def origin():
+            calls.append(1)
+            return {'x': 0, 'y': len(calls)}
+
+        path = str(tmpdir.join('cache'))
+        with StandInServer({'origin': origin}) as server:
+            batched = ServerProxy(server.uri, cache=SharedCache(path), cache_ttls={'origin': 60},
+                                  batch_opts={'window': 0.001}, result_types={'origin': Point})
+            assert batched.origin() == Point(0, 1)
+            assert batched.origin() == Point(0, 1)
+        with TCPStandInServer({'origin': origin}) as server:
+            proxy = TCPServerProxy(server.uri, timeout=5, cache=SharedCache(str(tmpdir.join('tcp'))),
+                                   cache_ttls={'origin': 60}, result_types={'origin': Point})
+            assert proxy.origin() == Point(0, 2)
+            assert proxy.origin() == Point(0, 2)
+            proxy.transport.close()
+        assert len(calls) == 2
+
+    def test_unserialisable_params_are_not_cached(self):
+        proxy = ServerProxy('http://foo.com/', cache_ttls={'m': 60})
+        assert proxy._cache_key('m', [b'\x00'], {}) is None
+        assert proxy._cache_key('m', ['x'], {}) is not None
@@ -1,15 +1,99 @@
 import pytest
 
+from rpctools.six.moves.http_cookies import SimpleCookie
 from rpctools.jsonrpc.client import (
-    CookieKeeperMixin, RawServerProxy, ServerProxy)
+    CookieAwareServerProxy, CookieJar, CookieKeeperMixin, RawServerProxy, ServerProxy)
 from rpctools.jsonrpc.exc import JsonRpcError
 
 
+class _FakeMessage(object):
+
+    def __init__(self, set_cookies):
+        self.set_cookies = set_cookies
+
+    def get_all(self, name):
+        return self.set_cookies if name == 'Set-Cookie' else None
+
+
+class _FakeResponse(object):
+
+    def __init__(self, *set_cookies):
+        self.msg = _FakeMessage(list(set_cookies))
+
+
 class TestCookieKeeperMixin(object):
 
     def test_constructor(self):
         CookieKeeperMixin()
 
+    def test_multiple_request_cookies(self):
+        proxy = CookieAwareServerProxy('http://foo.com/')
+        proxy.add_cookie(SimpleCookie('a=1'))
+        proxy.add_cookie(SimpleCookie('b=2'))
+        headers = {}
+        proxy._prepare_request({}, headers)
+        assert sorted(headers['Cookie'].split('; ')) == ['a=1', 'b=2']
+
+    def test_header_compiled_only_on_change(self):
+        proxy = CookieAwareServerProxy('http://foo.com/', request_cookies={'a': SimpleCookie('a=1')})
+        first, second = {}, {}
+        proxy._prepare_request({}, first)
+        proxy._prepare_request({}, second)
+        assert first['Cookie'] is second['Cookie']
+        proxy.add_cookie(SimpleCookie('a=2'))
+        proxy._prepare_request({}, second)
+        assert second['Cookie'] == 'a=2'
+
+    def test_response_cookies_merged_by_name(self):
+        proxy = CookieAwareServerProxy('http://foo.com/')
+        proxy.auto_add_cookies = True
+        proxy._handle_response(_FakeResponse('session=abc; Path=/', 'theme=dark'))
+        proxy._handle_response(_FakeResponse('session=def; Path=/'))
+        assert sorted(proxy.response_cookies) == ['session', 'theme']
+        headers = {}
+        proxy._prepare_request({}, headers)
+        assert sorted(headers['Cookie'].split('; ')) == ['session=def', 'theme=dark']
+
+        version = proxy.response_cookies.version
+        proxy._handle_response(_FakeResponse('session=def; Path=/'))
+        assert proxy.response_cookies.version == version
+
+        proxy._handle_response(_FakeResponse('session=; Max-Age=0'))
+        proxy._prepare_request({}, headers)
+        assert headers['Cookie'] == 'theme=dark'
+
+    def test_own_cookie_header_kept(self):
+        proxy = CookieAwareServerProxy('http://foo.com/', extra_headers={'Cookie': 'sso=xyz'})
+        proxy._prepare_request({}, proxy.extra_headers)
+        assert proxy.extra_headers['Cookie'] == 'sso=xyz'
+
+        proxy.add_cookie(SimpleCookie('a=1'))
+        headers = {}
+        proxy._prepare_request({}, headers)
+        proxy.request_cookies.clear()
+        proxy._prepare_request({}, headers)
+        assert 'Cookie' not in headers  # (The one the proxy wrote is removed.)
+
+    def test_plain_dict_assigned(self):
+        proxy = CookieAwareServerProxy('http://foo.com/')
+        headers = {}
+        proxy._prepare_request({}, headers)
+        proxy.request_cookies = {'a': SimpleCookie('a=1')}
+        assert isinstance(proxy.request_cookies, CookieJar)
+        proxy._prepare_request({}, headers)
+        assert headers['Cookie'] == 'a=1'
+
+
+class TestCookieJar(object):
+
+    def test_mutations_bump_version(self):
+        jar = CookieJar()
+        jar['a'] = SimpleCookie('a=1')
+        jar.update(b=SimpleCookie('b=2'))
+        del jar['a']
+        jar.pop('b')
+        assert jar.version == 4
+
 
 class TestRawServerProxy(object):
 
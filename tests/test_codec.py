@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.codec import JSON_CODEC, JSONCodec, codec_for_content_type, get_codec
+from rpctools.jsonrpc.exc import Fault, ResponseError
+from tests.server import StandInServer
+
+
+class ReversedJSONCodec(JSONCodec):
+    """
+    A stand-in binary format: JSON, backwards.
+    """
+    name = 'reversed'
+    content_type = 'application/x-reversed-json'
+
+    def dumps(self, data):
+        return json.dumps(data)[::-1].encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data[::-1].decode('utf-8'))
+
+
+def test_get_codec():
+    assert get_codec(None) is JSON_CODEC
+    assert get_codec('json') is JSON_CODEC
+    codec = ReversedJSONCodec()
+    assert get_codec(codec) is codec
+    with pytest.raises(ValueError):
+        get_codec('xml')
+
+
+def test_codec_for_content_type():
+    codec = ReversedJSONCodec()
+    assert codec_for_content_type('application/json; charset=utf-8', codec) is JSON_CODEC
+    assert codec_for_content_type(None, codec) is codec
+    assert codec_for_content_type('application/x-reversed-json', codec) is codec
+
+
+class TestNegotiation(object):
+
+    def test_alternative_codec(self):
+        codec = ReversedJSONCodec()
+        with StandInServer({'echo': lambda x: x}, codecs=('json', codec)) as server:
+            proxy = ServerProxy(server.uri, codec=codec, pool_connections=True)
+            assert proxy.echo([1.5, 2]) == [1.5, 2]
+            with pytest.raises(Fault):
+                proxy.missing()
+            assert proxy.codec is codec
+            assert server.requests[0][0]['Content-Type'] == codec.content_type
+
+    def test_falls_back_to_json(self):
+        with StandInServer({'echo': lambda x: x}) as server:
+            proxy = ServerProxy(server.uri, codec=ReversedJSONCodec(), pool_connections=True)
+            assert proxy.echo('a') == 'a'
+            assert proxy.codec is JSON_CODEC
+            assert proxy.echo('b') == 'b'
+            assert len(server.requests) == 3
+
+    def test_codec_headers_are_per_call(self):
+        codec = ReversedJSONCodec()
+        with StandInServer({'echo': lambda x: x}, codecs=('json', codec)) as server:
+            proxy = ServerProxy(server.uri, codec=codec, pool_connections=True)
+            assert proxy.echo('a') == 'a'
+            assert 'Content-Type' not in proxy.extra_headers
+            assert proxy.notify.echo('b')
+            proxy.notification_queue.flush(5)
+            headers, body = server.requests[1]
+            assert headers['Content-Type'] == JSON_CODEC.content_type
+            assert json.loads(body.decode('utf-8'))['method'] == 'echo'
+            proxy.close()
+
+    def test_own_json_content_type_kept(self):
+        with StandInServer({'echo': lambda x: x}) as server:
+            proxy = ServerProxy(server.uri, extra_headers={'content-type': 'application/json; charset=utf-8'})
+            assert proxy.echo('a') == 'a'
+            assert server.requests[0][0]['Content-Type'] == 'application/json; charset=utf-8'
+
+    def test_unparseable_response(self):
+        proxy = ServerProxy('http://foo.com/', codec=ReversedJSONCodec())
+        with pytest.raises(ResponseError):
+            proxy._parse_response(b'{not json', 'application/x-reversed-json')
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip('msgpack')
+    with StandInServer({'sum': lambda values: sum(values)}, codecs=('json', 'msgpack')) as server:
+        proxy = ServerProxy(server.uri, codec='msgpack')
+        assert proxy.sum([0.5] * 100) == 50.0
+        assert proxy.codec.name == 'msgpack'
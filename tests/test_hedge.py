@@ -0,0 +1,132 @@
+import time
+import threading
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import Fault
+from rpctools.jsonrpc.hedge import Hedger
+from rpctools.jsonrpc.tracing import RecordingTracer
+from tests.server import StandInServer
+
+
+class _SlowFirst(object):
+    """
+    A method that is slow on its first call only.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls == 1:
+            time.sleep(self.delay)
+            return 'slow'
+        return 'fast'
+
+
+def _fail():
+    raise ValueError('nope')
+
+
+class TestHedger(object):
+
+    def test_slow_call_is_hedged(self):
+        method = _SlowFirst(1.0)
+        hedger = Hedger(idempotent=['get'], budget=1.0, initial_delay=0.05, workers=2)
+        with StandInServer({'get': method}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True, hedger=hedger)
+            started = time.time()
+            assert proxy.get() == 'fast'
+            assert time.time() - started < 0.5
+            assert (hedger.calls, hedger.hedges, hedger.hedge_wins) == (1, 1, 1)
+            assert server.wait_for_requests(2)
+
+    def test_only_the_winner_is_handled_on_the_callers_thread(self):
+        handled = []
+
+        class Proxy(ServerProxy):
+            def _handle_response(self, response):
+                handled.append(threading.current_thread())
+
+        method = _SlowFirst(0.3)
+        hedger = Hedger(idempotent=['get'], budget=1.0, initial_delay=0.05, workers=2)
+        tracer = RecordingTracer()
+        with StandInServer({'get': method}) as server:
+            proxy = Proxy(server.uri, pool_connections=True, hedger=hedger, tracer=tracer)
+            assert proxy.get() == 'fast'
+            deadline = time.time() + 5
+            while len(tracer.spans) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        assert handled == [threading.current_thread()]
+        assert len(tracer.spans) == 2  # (The loser's span was ended too.)
+
+    def test_non_idempotent_methods_are_not_hedged(self):
+        hedger = Hedger(idempotent=['get'], budget=1.0, initial_delay=0.01, workers=2)
+        with StandInServer({'put': lambda: time.sleep(0.1)}) as server:
+            proxy = ServerProxy(server.uri, hedger=hedger)
+            proxy.put()
+            assert hedger.calls == hedger.hedges == 0
+            assert len(server.requests) == 1
+
+    def test_budget(self):
+        hedger = Hedger(idempotent=['get'], budget=0.5, initial_delay=0.01, workers=4)
+        with StandInServer({'get': lambda: time.sleep(0.05)}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True, hedger=hedger)
+            for _ in range(6):
+                proxy.get()
+            assert hedger.calls == 6
+            assert hedger.hedges == 3
+
+    def test_delay_follows_latency(self):
+        hedger = Hedger(idempotent=['get'], min_samples=5, initial_delay=0.5, workers=1)
+        with StandInServer({'get': lambda: 'ok'}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True, hedger=hedger)
+            for _ in range(10):
+                proxy.get()
+        assert hedger.delay('get') < 0.1
+        assert hedger.delay('other') == 0.5
+
+    def test_hedge_to_other_endpoint(self):
+        with StandInServer({'get': lambda: time.sleep(1.0) or 'primary'}) as primary:
+            with StandInServer({'get': lambda: 'replica'}) as replica:
+                hedger = Hedger(idempotent=['get'], endpoints=['%s:%d' % replica.server_address],
+                                budget=1.0, initial_delay=0.05, workers=2)
+                proxy = ServerProxy(primary.uri, hedger=hedger)
+                assert proxy.get() == 'replica'
+
+    def test_failure_is_not_hedged(self):
+        hedger = Hedger(idempotent=['fail'], budget=1.0, initial_delay=0.01, workers=2)
+        with StandInServer({'fail': _fail}) as server:
+            proxy = ServerProxy(server.uri, hedger=hedger)
+            with pytest.raises(Fault):
+                proxy.fail()
+            assert hedger.hedges == 0
+
+    def test_calls_are_not_capped_by_workers(self):
+        hedger = Hedger(idempotent=['get'], budget=0.0, initial_delay=5.0, workers=1)
+        barrier = threading.Barrier(8, timeout=5)  # Only passed once all eight attempts are in flight.
+        results = []
+        before = threading.active_count()
+
+        def send(host):
+            barrier.wait()
+            return host
+
+        threads = [threading.Thread(target=lambda: results.append(hedger.call('get', send, 'a:80')))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        assert results == ['a:80'] * 8
+        deadline = time.time() + 5
+        while threading.active_count() > before + 1 and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(hedger._idle) == 1  # The other threads exited.
+
+        hedger.close()
+        assert hedger._idle == []
+        assert hedger.call('get', lambda host: 'direct', 'a:80') == 'direct'
@@ -0,0 +1,209 @@
+import io
+import time
+import threading
+
+import pytest
+
+from rpctools.six.moves import http_client as httplib
+from rpctools.jsonrpc.client import RawServerProxy, ServerProxy
+from rpctools.jsonrpc.exc import ConcurrencyLimitExceeded, ConnectionError
+from rpctools.jsonrpc.limiter import AdaptiveLimiter, PRIORITY_INTERACTIVE, PRIORITY_BATCH, hold_until_read
+from rpctools.jsonrpc.tracing import RecordingTracer
+from tests.server import StandInServer, FaultInjectingServer, sleep_then
+
+
+class _FakeSocket(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, *args, **kwargs):
+        return io.BytesIO(self.data)
+
+
+def _record_releases(limit):
+    failures = []
+    release = limit.release
+
+    def recording(latency, failed=False):
+        failures.append(failed)
+        release(latency, failed)
+    limit.release = recording
+    return failures
+
+
+def _queue_behind(limit, priorities, order):
+    """
+    Starts a waiter per priority (one after the other) behind a held slot.
+    """
+    threads = []
+    for priority in priorities:
+        t = threading.Thread(target=lambda p=priority: (limit.acquire(p), order.append(p), limit.release(0.01)))
+        t.start()
+        threads.append(t)
+        while limit.queued < len(threads):
+            time.sleep(0.005)
+    return threads
+
+
+class TestAdaptiveLimiter(object):
+
+    def test_grows_while_latency_is_steady(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=4)
+        limit = limiter.for_host('example.com:80')
+        for _ in range(50):
+            slots = limiter.limit('example.com:80')
+            for _ in range(slots):
+                limit.acquire()
+            for _ in range(slots):
+                limit.release(0.01)
+        assert limiter.limit('example.com:80') == 4
+
+    def test_does_not_grow_when_unused(self):
+        limiter = AdaptiveLimiter(initial_limit=5)
+        limit = limiter.for_host('example.com:80')
+        for _ in range(50):
+            limit.acquire()
+            limit.release(0.01)
+        assert limiter.limit('example.com:80') == 5
+
+    def test_backs_off_on_failure_and_latency(self):
+        limiter = AdaptiveLimiter(initial_limit=10, min_limit=2, backoff=0.5)
+        limit = limiter.for_host('example.com:80')
+        limit.acquire()
+        limit.release(None, failed=True)
+        assert limiter.limit('example.com:80') == 5
+
+        for _ in range(10):
+            limit.acquire()
+            limit.release(0.01)
+        for _ in range(20):
+            limit.acquire()
+            limit.release(1.0)
+        assert limiter.limit('example.com:80') == 2
+
+    def test_fail_fast(self):
+        limiter = AdaptiveLimiter(initial_limit=1, block=False)
+        limit = limiter.for_host('example.com:80')
+        limit.acquire()
+        with pytest.raises(ConcurrencyLimitExceeded):
+            limit.acquire()
+        assert limiter.stats()['example.com:80']['rejected'] == 1
+        limit.release(0.01)
+        limit.acquire()
+
+    def test_queue_timeout(self):
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=0.05)
+        limit = limiter.for_host('example.com:80')
+        limit.acquire()
+        with pytest.raises(ConcurrencyLimitExceeded):
+            limit.acquire()
+
+    def test_proxy_calls_are_limited(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=2)
+        with StandInServer({'slow': lambda: sleep_then(0.1, 'ok')}) as server:
+            in_flight = []
+            original = limiter.for_host('127.0.0.1:%d' % server.server_address[1])
+            acquire = original.acquire
+
+            def watching_acquire(priority=None):
+                waited = acquire(priority)
+                in_flight.append(original.in_flight)
+                return waited
+            original.acquire = watching_acquire
+
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(ServerProxy(server.uri, limiter=limiter).slow()))
+                       for _ in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+
+            assert results == ['ok'] * 6
+            assert max(in_flight) <= 2
+            assert original.stats()['in_flight'] == 0
+
+    def test_slot_held_until_body_read(self):
+        limiter = AdaptiveLimiter(initial_limit=2)
+        with StandInServer({'ping': lambda: 'pong'}) as server:
+            proxy = RawServerProxy(server.uri, limiter=limiter)
+            limit = limiter.for_host(proxy.host)
+            response = proxy.ping()
+            assert limit.stats()['in_flight'] == 1  # The body is still to be read.
+            response.read()
+            assert limit.stats()['in_flight'] == 0
+            assert ServerProxy(server.uri, pool_connections=True, limiter=limiter).ping() == 'pong'
+            assert limit.stats()['in_flight'] == 0
+
+    def test_truncated_body_counts_as_failure(self):
+        limiter = AdaptiveLimiter()
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            proxy = ServerProxy(server.uri, limiter=limiter)
+            failures = _record_releases(limiter.for_host(proxy.host))
+            assert proxy.ping() == 'pong'
+            server.inject('truncate')
+            with pytest.raises(ConnectionError):
+                proxy.ping()
+            assert failures == [False, True]
+            assert limiter.for_host(proxy.host).stats()['in_flight'] == 0
+
+    @pytest.mark.parametrize('body, failed', [
+        (b'4\r\npong\r\n0\r\n\r\n', False),
+        (b'4\r\npong\r\n', True),
+    ])
+    def test_chunked_body_read_to_the_end(self, body, failed):
+        limiter = AdaptiveLimiter()
+        limit = limiter.for_host('example.com:80')
+        failures = _record_releases(limit)
+        response = httplib.HTTPResponse(_FakeSocket(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + body))
+        response.begin()
+        limit.acquire()
+        hold_until_read(response, limit, time.time())
+        try:
+            response.read()
+        except httplib.IncompleteRead:
+            pass
+        response.close()
+        assert failures == [failed]
+
+
+class TestPriorities(object):
+
+    def test_higher_priority_served_first(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_limit=1, aging=0)
+        limit = limiter.for_host('example.com:80')
+        limit.acquire()
+        order = []
+        threads = _queue_behind(limit, [PRIORITY_BATCH, PRIORITY_BATCH, PRIORITY_INTERACTIVE], order)
+        limit.release(0.01)
+        for t in threads:
+            t.join(5)
+        assert order == [PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_BATCH]
+
+    def test_aging_prevents_starvation(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_limit=1, aging=0.01)
+        limit = limiter.for_host('example.com:80')
+        limit.acquire()
+        order = []
+        threads = _queue_behind(limit, [PRIORITY_BATCH], order)
+        time.sleep(0.2)  # Ages well past the interactive priority.
+        threads += _queue_behind(limit, [PRIORITY_INTERACTIVE], order)
+        limit.release(0.01)
+        for t in threads:
+            t.join(5)
+        assert order == [PRIORITY_BATCH, PRIORITY_INTERACTIVE]
+
+    def test_queue_wait_is_traced_separately(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_limit=1)
+        tracer = RecordingTracer()
+        with StandInServer({'echo': lambda x: x}) as server:
+            proxy = ServerProxy(server.uri, limiter=limiter, tracer=tracer, priority=PRIORITY_BATCH)
+            limit = limiter.for_host(proxy.host)
+            limit.acquire()
+            threading.Timer(0.1, limit.release, (0.01,)).start()
+            assert proxy.with_priority(PRIORITY_INTERACTIVE).echo('hi') == 'hi'
+
+        durations = tracer.spans[-1].durations()
+        assert durations['queue'] >= 0.05
+        assert durations['wait'] < durations['queue']
@@ -0,0 +1,35 @@
+import json
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.loadgen import LoadGenerator, main
+from tests.server import StandInServer, sleep_then
+
+
+def test_open_loop_counts_and_latency():
+    with StandInServer({'echo': lambda x: x}) as server:
+        report = LoadGenerator(lambda: ServerProxy(server.uri, pool_connections=True), 'echo', [1],
+                               concurrency=4, duration=0.5, rate=100).run()
+    assert 40 <= report.completed <= 50
+    assert report.errors == {}
+    assert report.latency['p99.9'] >= report.latency['p50']
+
+
+def test_open_loop_latency_includes_queueing():
+    # One worker cannot keep up with 50 calls/s to a method that takes 50ms, so calls
+    # start late; latency is measured from the schedule and must show that.
+    with StandInServer({'sleep_then': sleep_then}) as server:
+        report = LoadGenerator(lambda: ServerProxy(server.uri, pool_connections=True), 'sleep_then', [0.05, 1],
+                               concurrency=1, duration=None, rate=50, total=10).run()
+    assert report.completed == 10
+    assert report.latency['max'] > 0.2
+
+
+def test_main_reports_errors_by_class(tmpdir, capsys):
+    params = tmpdir.join('params.json')
+    params.write('{"x": 1}')
+    with StandInServer({'echo': lambda x: x}) as server:
+        status = main([server.uri, 'missing', '--params', str(params), '-n', '5', '--json'])
+    report = json.loads(capsys.readouterr()[0])
+    assert status == 1
+    assert report['errors'] == {'Fault': 5}
+    assert report['completed'] == 0
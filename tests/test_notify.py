@@ -0,0 +1,123 @@
+import json
+import threading
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import JsonRpcError
+from rpctools.jsonrpc.notify import NotificationQueue
+from rpctools.jsonrpc.transport import Transport
+from tests.server import StandInServer
+
+
+class TestNotificationQueue(object):
+
+    def test_overflow_is_counted(self):
+        gate = threading.Event()
+
+        class StalledTransport(Transport):
+            def request(self, *args, **kwargs):
+                gate.wait()
+                raise JsonRpcError('stalled')
+
+        q = NotificationQueue(StalledTransport(), 'localhost:1', '/', maxsize=1)
+        results = [q.put('{}', {}) for _ in range(5)]
+        gate.set()
+        assert results.count(False) == q.overflows
+        assert q.overflows >= 3
+        assert q.close(timeout=5)
+
+    def test_close_does_not_hang_on_a_full_queue(self):
+        gate = threading.Event()
+
+        class StalledTransport(Transport):
+            def request(self, *args, **kwargs):
+                gate.wait()
+                raise JsonRpcError('stalled')
+
+        q = NotificationQueue(StalledTransport(), 'localhost:1', '/', maxsize=2)
+        for _ in range(3):
+            q.put('{}', {})
+        assert not q.close(timeout=0.1)
+        assert not q.close(timeout=0.1)  # (Idempotent: no second stop marker.)
+        gate.set()
+        assert q.close(timeout=5)
+        assert q.flush(1)
+        assert q.errors + q.overflows == 3  # (None is left unaccounted for.)
+        assert q.errors >= 2  # The one being sent, and those given up on.
+
+    def test_worker_survives_unexpected_errors(self):
+        class BrokenTransport(Transport):
+            def request(self, *args, **kwargs):
+                raise TypeError('unexpected')
+
+        q = NotificationQueue(BrokenTransport(), 'localhost:1', '/')
+        q.put('{}', {})
+        q.put('{}', {})
+        assert q.flush(5)
+        assert q.errors == 2
+        assert q.close(timeout=5)
+
+    def test_put_after_close(self):
+        q = NotificationQueue(Transport(), 'localhost:1', '/')
+        q.close()
+        with pytest.raises(JsonRpcError):
+            q.put('{}', {})
+
+    def test_put_racing_close(self):
+        class StalePut(NotificationQueue):
+            # Sees the queue open, as a put that checked just before close() would.
+            def _start(self):
+                return True
+
+        q = StalePut(Transport(), 'localhost:1', '/')
+        NotificationQueue._start(q)
+        assert q.close(timeout=5)
+        q.closed = False
+        with pytest.raises(JsonRpcError):
+            q.put('{}', {})
+        assert q.flush(timeout=1)
+        assert q.errors == 1
+
+    def test_no_worker_is_started_after_close(self):
+        q = NotificationQueue(Transport(), 'localhost:1', '/')
+        q.close()
+        q.closed, closed = False, True
+
+        def put():
+            # close() lands between put's check and the worker starting.
+            q.closed = closed
+            return NotificationQueue._start(q)
+
+        q._start = put
+        with pytest.raises(JsonRpcError):
+            q.put('{}', {})
+        assert q._worker is None
+        assert q.flush(timeout=1)
+
+
+class TestServerProxyNotify(object):
+
+    def test_notification_has_no_id(self):
+        with StandInServer({'audit.log': lambda *a: None}) as server:
+            proxy = ServerProxy(server.uri)
+            assert proxy.notify.audit.log('login', 42) is True
+            assert proxy.notification_queue.flush(timeout=5)
+            assert proxy.notification_queue.sent == 1
+            (headers, body), = server.requests
+            assert json.loads(body.decode('utf-8')) == {'method': 'audit.log', 'params': ['login', 42]}
+            proxy.notification_queue.close()
+
+    def test_coalesced_into_batches(self):
+        with StandInServer({'tick': lambda n: None}) as server:
+            proxy = ServerProxy(server.uri, notify_opts={'batch_size': 50})
+            for n in range(200):
+                proxy.notify.tick(n)
+            assert proxy.notification_queue.close(timeout=5)
+            assert proxy.notification_queue.sent == 200
+            received = []
+            for headers, body in server.requests:
+                payload = json.loads(body.decode('utf-8'))
+                received.extend(payload if isinstance(payload, list) else [payload])
+            assert [r['params'] for r in received] == [[n] for n in range(200)]
+            assert len(server.requests) < 200
@@ -1,4 +1,18 @@
-from rpctools.jsonrpc.pool import Pool, TLSConnectionPoolMixin
+import gc
+import os
+import time
+import warnings
+import socket
+import threading
+
+import pytest
+
+from rpctools.jsonrpc import pool as pool_module
+from rpctools.jsonrpc.client import ServerProxy, CookieAwareServerProxy
+from rpctools.jsonrpc.exc import JsonRpcError, ConnectionError, PoolClosed
+from rpctools.jsonrpc.pool import Pool, TLSConnectionPoolMixin, warm_after_fork, pool_stats, drain, reopen, SessionPool
+from rpctools.jsonrpc.transport import TLSConnectionPoolTransport, TLSConnectionPoolSafeTransport
+from tests.server import StandInServer, FaultInjectingServer, CERTFILE
 
 
 def test_pool():
@@ -10,3 +24,461 @@ class TestTLSConnectionPoolMixin(object):
 
     def test_constructor(self):
         TLSConnectionPoolMixin()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+class TestForkSafety(object):
+
+    def _in_child(self, check):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                status = 0 if check() else 1
+            except BaseException:
+                status = 2
+            os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        return os.WEXITSTATUS(status)
+
+    def test_child_drops_inherited_connections(self):
+        with StandInServer({'ping': lambda: 'pong'}) as server:
+            transport = TLSConnectionPoolTransport()
+            host = '%s:%d' % server.server_address
+            transport.request(host, '/jsonrpc', '{"id": 1, "method": "ping", "params": []}').read()
+            inherited = pool_module.pool.connections[host]
+
+            def check():
+                return host not in pool_module.pool.connections and transport.connect(host) is not inherited
+
+            assert self._in_child(check) == 0
+            assert pool_module.pool.connections[host] is inherited
+
+    def test_warm_after_fork(self):
+        with StandInServer() as server:
+            transport = TLSConnectionPoolTransport()
+            host = '%s:%d' % server.server_address
+            other = 'localhost:%d' % server.server_address[1]
+            warm_after_fork(transport, host)
+            try:
+                def check():
+                    transport.connect(other)
+                    conn = pool_module.pool.connections.get(host)
+                    return conn is not None and conn.sock is not None
+
+                assert self._in_child(check) == 0
+            finally:
+                pool_module._warmups.remove((transport, host))
+
+
+class TestWarm(object):
+
+    def test_warm_opens_spare_connections(self):
+        with StandInServer({'ping': lambda: 'pong'}) as server:
+            transport = TLSConnectionPoolTransport()
+            host = '%s:%d' % server.server_address
+            try:
+                assert transport.warm(host, 3, timeout=5) == 3
+                spares = list(pool_module._spares[transport._spare_key(host)])
+                assert all(conn.sock is not None for conn in spares)
+
+                results = []
+
+                def worker():
+                    conn = transport.connect(host)
+                    results.append(conn in spares)
+                    transport.request(host, '/jsonrpc', '{"id": 1, "method": "ping", "params": []}').read()
+
+                threads = [threading.Thread(target=worker) for _ in range(3)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join(5)
+                assert results == [True] * 3
+                assert pool_module._spares[transport._spare_key(host)] == []
+            finally:
+                pool_module._spares.pop(transport._spare_key(host), None)
+
+    def test_warm_reports_failures(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        host = '%s:%d' % listener.getsockname()
+        listener.close()  # Nothing listens on the port any more.
+        transport = TLSConnectionPoolTransport()
+        assert transport.warm(host, 2, timeout=5) == 0
+        assert not pool_module._spares.get(transport._spare_key(host))
+
+    def test_proxy_prewarm(self):
+        with StandInServer({'ping': lambda: 'pong'}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True, prewarm=2)
+            try:
+                assert proxy.prewarmed == 2
+                assert proxy.ping() == 'pong'
+                assert len(pool_module._spares[proxy.transport._spare_key(proxy.host)]) == 1
+            finally:
+                pool_module._spares.pop(proxy.transport._spare_key(proxy.host), None)
+
+    def test_spares_kept_per_tls_settings(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}, tls=True) as server:
+            host = 'localhost:%d' % server.server_address[1]
+            trusting = TLSConnectionPoolSafeTransport(ssl_opts={'ca_certs': CERTFILE})
+            other = TLSConnectionPoolSafeTransport(ssl_opts={'ca_certs': CERTFILE, 'ciphers': 'HIGH'})
+            try:
+                assert trusting.warm(host, 1, timeout=5) == 1
+                assert other._take_spare(host) is None
+                conn = trusting._take_spare(host)
+                assert conn is not None
+                conn.close()
+            finally:
+                pool_module._spares.pop(trusting._spare_key(host), None)
+
+    def test_spares_closed_by_the_server_are_dropped(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            server.idle_timeout = 0.2
+            transport = TLSConnectionPoolTransport()
+            host = '%s:%d' % server.server_address
+            try:
+                assert transport.warm(host, 2, timeout=5) == 2
+                deadline = time.time() + 5
+                while server.opened < 2 and time.time() < deadline:
+                    time.sleep(0.01)
+                assert server.wait_for_idle()  # The server gave up on both.
+                dropped = pool_stats()[host]['dropped']
+                response = transport.request(host, '/jsonrpc', '{"id": 1, "method": "ping", "params": []}')
+                assert b'pong' in response.read()
+                assert pool_stats()[host]['dropped'] == dropped + 2
+                assert pool_module._spares[transport._spare_key(host)] == []
+            finally:
+                transport.close()
+                pool_module._spares.pop(transport._spare_key(host), None)
+
+    def test_prewarm_requires_pooling(self):
+        with pytest.raises(JsonRpcError):
+            ServerProxy('http://localhost:8080/jsonrpc', prewarm=2)
+
+
+def _clear_pool():
+    for conn in pool_module.pool.connections.values():
+        conn.close()
+    pool_module.pool.connections.clear()
+
+
+class TestFaults(object):
+
+    def _proxy(self, server, **kwargs):
+        return ServerProxy(server.uri, pool_connections=True, ssl_opts={'ca_certs': CERTFILE}, **kwargs)
+
+    def teardown_method(self, method):
+        _clear_pool()
+
+    @pytest.mark.parametrize('fault', ['reset', 'truncate'])
+    def test_broken_response(self, fault):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            proxy = self._proxy(server)
+            assert proxy.ping() == 'pong'
+            server.inject(fault)
+            with pytest.raises(ConnectionError):
+                proxy.ping()
+            assert proxy.host not in pool_module.pool.connections
+            assert proxy.ping() == 'pong'
+            assert server.opened == 2
+
+    def test_connection_close(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            proxy = self._proxy(server)
+            server.inject('close')
+            assert proxy.ping() == 'pong'
+            assert proxy.ping() == 'pong'
+            assert server.opened == 2
+
+    def test_half_closed_connection_is_not_reused(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            proxy = self._proxy(server)
+            server.inject('half_close')
+            assert proxy.ping() == 'pong'
+            time.sleep(0.05)  # Let the FIN arrive.
+            assert proxy.ping() == 'pong'
+            assert server.opened == 2
+
+    def test_latency(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}, latency=0.3) as server:
+            proxy = self._proxy(server, timeout=0.1)
+            with pytest.raises(ConnectionError):
+                proxy.ping()
+            server.latency = (0, 0)
+            assert proxy.ping() == 'pong'
+
+    def test_tls_failure(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}, tls=True) as server:
+            proxy = self._proxy(server)
+            assert proxy.ping() == 'pong'
+            server.inject('tls_failure')
+            with pytest.raises(ConnectionError):
+                proxy.ping()
+            assert proxy.ping() == 'pong'
+            assert server.opened == 2
+
+
+class TestPoolStats(object):
+
+    def teardown_method(self, method):
+        _clear_pool()
+
+    def test_counts(self):
+        with StandInServer({'ping': lambda: 'pong'}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True)
+            assert proxy.host not in pool_stats()
+            proxy.ping()
+            proxy.ping()
+            stats = pool_stats()[proxy.host]
+            assert (stats['open'], stats['idle'], stats['in_use']) == (1, 1, 0)
+            assert (stats['checkouts'], stats['creations'], stats['evictions']) == (2, 1, 0)
+            assert stats['wait']['count'] == 2 and stats['wait']['max'] < 0.1
+            conn, = stats['connections']
+            assert conn['thread'] == threading.current_thread().name
+            assert conn['checkouts'] == 2 and not conn['in_use']
+            assert conn['age'] >= conn['idle'] >= 0
+            assert 'connections' not in pool_stats(connections=False)[proxy.host]
+
+    def test_in_use_in_other_threads(self):
+        entered, release, returned, finish = [threading.Event() for _ in range(4)]
+
+        def block():
+            entered.set()
+            release.wait(5)
+            return 'done'
+
+        with StandInServer({'block': block}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True)
+
+            def worker():
+                proxy.block()
+                returned.set()
+                finish.wait(5)  # (The thread's pool goes when it does.)
+                proxy.close()
+
+            thread = threading.Thread(target=worker, name='blocked')
+            thread.start()
+            try:
+                assert entered.wait(5)
+                stats = pool_stats()[proxy.host]
+                assert stats['in_use'] == 1
+                assert [c['thread'] for c in stats['connections'] if c['in_use']] == ['blocked']
+                release.set()
+                assert returned.wait(5)
+                stats = pool_stats()[proxy.host]
+                assert stats['in_use'] == 0 and stats['idle'] == 1
+            finally:
+                release.set()
+                finish.set()
+                thread.join(5)
+
+    def test_evictions(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True)
+            server.inject('reset')
+            with pytest.raises(ConnectionError):
+                proxy.ping()
+            assert pool_stats()[proxy.host]['open'] == 0
+            proxy.ping()
+            stats = pool_stats()[proxy.host]
+            assert (stats['open'], stats['checkouts'], stats['creations'], stats['evictions']) == (1, 2, 2, 1)
+
+
+class TestClose(object):
+
+    def teardown_method(self, method):
+        reopen()
+        _clear_pool()
+
+    def test_proxy_context_manager(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            with ServerProxy(server.uri, pool_connections=True) as proxy:
+                assert proxy.ping() == 'pong'
+                conn = pool_module.pool.connections[proxy.host]
+            assert proxy.host not in pool_module.pool.connections
+            assert conn.sock is None
+            assert server.wait_for_idle()
+
+    def test_one_off_connections_are_closed(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            proxy = ServerProxy(server.uri)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always', ResourceWarning)
+                assert [proxy.ping() for _ in range(3)] == ['pong'] * 3
+                gc.collect()
+            assert not [w for w in caught if issubclass(w.category, ResourceWarning)]  # (None left to the GC.)
+            assert server.wait_for_idle()  # Each was closed once its response was read.
+            assert server.opened == 3
+
+    def test_drain(self):
+        entered, release, finish = threading.Event(), threading.Event(), threading.Event()
+        results = []
+
+        def block():
+            entered.set()
+            release.wait(5)
+            return 'done'
+
+        with FaultInjectingServer({'block': block, 'ping': lambda: 'pong'}) as server:
+            def idle():
+                ServerProxy(server.uri, pool_connections=True).ping()
+                finish.wait(5)
+
+            def busy():
+                results.append(ServerProxy(server.uri, pool_connections=True).block())
+                finish.wait(5)
+
+            threads = [threading.Thread(target=idle), threading.Thread(target=busy)]
+            drainer = threading.Thread(target=lambda: results.append(drain(timeout=5)))
+            try:
+                threads[0].start()
+                threads[1].start()
+                assert entered.wait(5)
+                drainer.start()
+                time.sleep(0.05)
+                with pytest.raises(PoolClosed):
+                    ServerProxy(server.uri, pool_connections=True).ping()
+                assert drainer.is_alive()  # Waiting for the call in progress.
+
+                release.set()
+                drainer.join(5)
+                assert results == ['done', True]
+                assert server.wait_for_idle()  # The other threads' connections were closed too.
+                assert pool_stats()[ServerProxy(server.uri).host]['open'] == 0
+            finally:
+                release.set()
+                finish.set()
+                for t in threads:
+                    t.join(5)
+
+            reopen()
+            assert ServerProxy(server.uri, pool_connections=True).ping() == 'pong'
+
+    def test_drain_timeout(self):
+        release = threading.Event()
+        with FaultInjectingServer({'block': lambda: release.wait(5)}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True)
+            thread = threading.Thread(target=proxy.block)
+            thread.start()
+            try:
+                time.sleep(0.05)
+                started = time.time()
+                assert not drain(timeout=0.1)
+                assert time.time() - started < 1
+            finally:
+                release.set()
+                thread.join(5)
+
+    def test_drain_waits_for_calls_still_connecting(self):
+        transport = TLSConnectionPoolTransport()
+        conn = transport.connect('127.0.0.1:9')  # Checked out, but not connected yet.
+        assert conn.sock is None
+        try:
+            assert not drain(timeout=0.1)
+        finally:
+            pool_module._released(conn, None)
+        assert drain(timeout=0.1)
+
+
+class TestSessionPool(object):
+
+    def _proxies(self, server, sessions, **kwargs):
+        return dict((key, CookieAwareServerProxy(server.uri, session_key=key, **kwargs)) for key in sessions)
+
+    def test_sessions_keep_their_connections(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            sessions = SessionPool(max_connections=10)
+            proxies = self._proxies(server, 'ab', session_pool=sessions)
+            for key in 'abab':
+                assert proxies[key].ping() == 'pong'
+            assert server.opened == 2
+            stats = sessions.stats()[proxies['a'].host]
+            assert (stats['connections'], stats['sessions'], stats['hits'], stats['recycled']) == (2, 2, 2, 0)
+            assert pool_module.pool.connections == {}  # (Not the thread-local pool.)
+
+            # A later proxy for the same session picks up its connection.
+            again = CookieAwareServerProxy(server.uri, session_pool=sessions, session_key='a')
+            again.ping()
+            assert server.opened == 2
+
+            with again:
+                pass
+            assert sessions.stats()[again.host]['sessions'] == 1
+            assert pool_stats()[again.host]['open'] == 1
+
+    def test_bounded_by_recycling_idle_connections(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            sessions = SessionPool(max_connections=2)
+            proxies = self._proxies(server, 'abc', session_pool=sessions)
+            for key in 'abcab':
+                proxies[key].ping()
+            # c took over a's connection (the least recently used), then a took b's and b took c's.
+            assert server.opened == 2
+            stats = sessions.stats()[proxies['a'].host]
+            assert (stats['connections'], stats['recycled'], stats['hits']) == (2, 3, 0)
+
+    def test_busy_connections_are_not_shared(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def block():
+            entered.set()
+            release.wait(5)
+            return 'done'
+
+        with FaultInjectingServer({'block': block, 'ping': lambda: 'pong'}) as server:
+            sessions = SessionPool(max_connections=1)
+            proxies = self._proxies(server, 'ab', session_pool=sessions)
+            thread = threading.Thread(target=proxies['a'].block)
+            thread.start()
+            try:
+                assert entered.wait(5)
+                assert proxies['b'].ping() == 'pong'  # a's connection is in use, so b gets its own.
+                assert server.opened == 2
+            finally:
+                release.set()
+                thread.join(5)
+            proxies['b'].ping()
+            # Once idle, the connection beyond the bound was closed.
+            stats = sessions.stats()[proxies['a'].host]
+            assert (stats['connections'], stats['evicted']) == (1, 1)
+
+    def test_concurrent_calls_through_one_transport(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def meet():
+            barrier.wait()
+            return 'met'
+
+        with FaultInjectingServer({'meet': meet, 'ping': lambda: 'pong'}) as server:
+            sessions = SessionPool(max_connections=1)
+            proxy = CookieAwareServerProxy(server.uri, session_pool=sessions, session_key='a')
+            transport = proxy.transport
+            results = []
+
+            def call():
+                response = transport.request(proxy.host, proxy.handler, '{"id": 1, "method": "meet", "params": []}')
+                results.append(response.read())
+
+            threads = [threading.Thread(target=call) for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+            assert len(results) == 2 and all(b'met' in body for body in results)
+            # Each thread released the connection it used, so neither stays checked out...
+            assert pool_stats()[proxy.host]['in_use'] == 0
+            # ...and the one beyond the bound is closed once the next call finds it idle.
+            assert proxy.ping() == 'pong'
+            stats = sessions.stats()[proxy.host]
+            assert (stats['connections'], stats['evicted']) == (1, 1)
+
+    def test_broken_connection_is_dropped(self):
+        with FaultInjectingServer({'ping': lambda: 'pong'}) as server:
+            sessions = SessionPool()
+            proxy = CookieAwareServerProxy(server.uri, session_pool=sessions)
+            server.inject('reset')
+            with pytest.raises(ConnectionError):
+                proxy.ping()
+            assert sessions.stats()[proxy.host]['connections'] == 0
+            assert proxy.ping() == 'pong'
+            assert pool_stats()[proxy.host]['evictions'] == 1
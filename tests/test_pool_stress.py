@@ -0,0 +1,134 @@
+"""
+Hammers the thread-local connection pool from many threads while the server injects faults.
+"""
+import gc
+import os
+import time
+import threading
+
+import pytest
+
+from rpctools.jsonrpc import pool as pool_module
+from rpctools.jsonrpc.client import ServerProxy, CookieAwareServerProxy
+from rpctools.jsonrpc.pool import SessionPool
+from rpctools.jsonrpc.exc import ConnectionError
+from tests.server import FaultInjectingServer, CERTFILE
+
+THREADS = 16
+CALLS = 40
+ATTEMPTS = 5
+
+
+def _open_fds():
+    for path in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return None
+
+
+def _hammer(server, calls, proxies=None):
+    """
+    Makes calls from many threads, each with its own pooled proxy, retrying calls that
+    fail on a broken connection.
+
+    :param proxies: Makes the proxy for each call, given the thread and call numbers
+                    (by default each thread has one proxy with a thread-local pool).
+
+    :return: The latencies of the calls and any unexpected errors.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        proxy = ServerProxy(server.uri, pool_connections=True, timeout=5, ssl_opts={'ca_certs': CERTFILE})
+        for i in range(calls):
+            if proxies is not None:
+                proxy = proxies(n, i)
+            token = '%d-%d' % (n, i)
+            start = time.time()
+            for attempt in range(ATTEMPTS):
+                try:
+                    result = proxy.echo(token)
+                    break
+                except ConnectionError:
+                    if attempt == ATTEMPTS - 1:
+                        raise
+            with lock:
+                latencies.append(time.time() - start)
+                if result != token:
+                    errors.append('%s got the response for %s' % (token, result))
+        conn = pool_module.pool.connections.pop(proxy.host, None)
+        if conn is not None:
+            conn.close()
+
+    def run(n):
+        try:
+            worker(n)
+        except Exception as x:
+            with lock:
+                errors.append(repr(x))
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+    return latencies, errors
+
+
+@pytest.mark.parametrize('tls', [False, True], ids=['http', 'https'])
+def test_pool_under_faults(tls):
+    faults = {'reset': 0.03, 'truncate': 0.03, 'close': 0.05, 'half_close': 0.05}
+    if tls:
+        faults['tls_failure'] = 0.03
+    with FaultInjectingServer({'echo': lambda token: token}, faults=faults, latency=(0, 0.005), seed=7,
+                              tls=tls) as server:
+        gc.collect()  # (Of sockets left by other tests.)
+        baseline = _open_fds()
+        latencies, errors = _hammer(server, CALLS if not tls else CALLS // 2)
+
+        # No cross-talk, and every call got through (within a few attempts).
+        assert errors == []
+        assert len(latencies) == THREADS * (CALLS if not tls else CALLS // 2)
+        assert set(server.faults_injected) == set(faults)
+
+        # Bounded latency: the injected faults cost reconnects, not timeouts.
+        latencies.sort()
+        assert latencies[int(len(latencies) * 0.99)] < 0.5
+        assert latencies[-1] < 2.0
+
+        # No leaked sockets: each thread held one connection at a time, and once the
+        # threads have closed theirs every socket is closed on both ends.
+        assert server.max_connections <= THREADS + 4  # (Closing connections may still be counted.)
+        assert server.wait_for_idle()
+        gc.collect()
+        if baseline is not None:
+            assert _open_fds() <= baseline
+
+
+def test_session_pool_under_faults():
+    sessions = SessionPool(max_connections=8)
+    faults = {'reset': 0.03, 'truncate': 0.03, 'close': 0.05, 'half_close': 0.05}
+    with FaultInjectingServer({'echo': lambda token: token}, faults=faults, latency=(0, 0.005), seed=11) as server:
+        gc.collect()
+        baseline = _open_fds()
+
+        def proxies(n, i):
+            # Threads share the 32 sessions, so sessions are often busy in another thread.
+            return CookieAwareServerProxy(server.uri, timeout=5, session_pool=sessions, session_key=(n * 7 + i) % 32)
+
+        latencies, errors = _hammer(server, CALLS, proxies)
+        assert errors == []
+        assert len(latencies) == THREADS * CALLS
+
+        stats = sessions.stats()['127.0.0.1:%d' % server.server_address[1]]
+        assert stats['connections'] <= 8
+        assert stats['recycled']
+        assert server.max_connections <= THREADS + 4
+
+        sessions.close()
+        assert server.wait_for_idle()
+        gc.collect()
+        if baseline is not None:
+            assert _open_fds() <= baseline
@@ -0,0 +1,129 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import ProtocolError, RateLimitExceeded
+from rpctools.jsonrpc.ratelimit import RateLimiter, parse_retry_after
+from tests.server import StandInServer, _StandIn, _Handler
+
+
+class _ThrottlingHandler(_Handler):
+    """
+    Answers the first request with 429 and a Retry-After header.
+    """
+
+    def do_POST(self):
+        with self.server.lock:
+            first = not self.server.throttled
+            self.server.throttled = True
+        if not first:
+            return _Handler.do_POST(self)
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(429)
+        self.send_header('Retry-After', '1')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class ThrottlingServer(StandInServer):
+
+    def __init__(self, methods=None):
+        _StandIn.__init__(self, _ThrottlingHandler, methods)
+        self.throttled = False
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    now = time.time()
+    assert 9 <= parse_retry_after(formatdate(now + 10, usegmt=True), now) <= 10
+
+
+class TestRateLimiter(object):
+
+    def test_burst_then_fail_fast(self):
+        limiter = RateLimiter(rate=10, burst=2, block=False)
+        limiter.acquire('a:80')
+        limiter.acquire('a:80')
+        with pytest.raises(RateLimitExceeded) as excinfo:
+            limiter.acquire('a:80')
+        assert 0 < excinfo.value.retry_after <= 0.1
+        limiter.acquire('b:80')  # Hosts have their own buckets.
+        assert limiter.rejected == 1
+
+    def test_blocking_paces_requests(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        started = time.time()
+        for _ in range(5):
+            limiter.acquire('a:80')
+        assert 0.18 <= time.time() - started < 0.5
+
+    def test_per_method(self):
+        limiter = RateLimiter(methods={'report': (1, 1)}, block=False)
+        limiter.acquire('a:80', 'report')
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire('a:80', 'report')
+        for _ in range(10):
+            limiter.acquire('a:80', 'lookup')
+        limiter.acquire('b:80', 'report')
+
+    def test_batch_takes_a_token_per_call(self):
+        limiter = RateLimiter(rate=10, burst=1, methods={'report': (10, 2)}, block=False)
+        limiter.acquire('a:80', ['report', 'lookup', 'report'])
+        assert limiter.stats()['a:80']['tokens'] == 0
+        assert limiter.stats()['a:80 report']['tokens'] == 0
+        limiter.acquire('b:80', ['report'] * 3)  # More than the burst: allowed from a full bucket, into debt.
+        assert limiter.stats()['b:80 report']['tokens'] == -1
+        time.sleep(0.1)
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire('b:80', ['report'])  # (The debt is paid off first.)
+
+    @pytest.mark.parametrize('kwargs', [{'rate': 0}, {'hosts': {'a:80': -1}}, {'methods': {'report': (0, 1)}}])
+    def test_rate_must_be_positive(self, kwargs):
+        with pytest.raises(ValueError):
+            RateLimiter(**kwargs)
+
+    def test_timeout(self):
+        limiter = RateLimiter(rate=1, timeout=0.1)
+        limiter.acquire('a:80')
+        started = time.time()
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire('a:80')
+        assert time.time() - started < 0.05  # Rejected without waiting in vain.
+
+    def test_pause(self):
+        limiter = RateLimiter(block=False)
+        limiter.pause('a:80', 5)
+        with pytest.raises(RateLimitExceeded) as excinfo:
+            limiter.acquire('a:80')
+        assert 4 < excinfo.value.retry_after <= 5
+        assert limiter.stats()['a:80']['paused'] > 4
+
+
+def test_batched_calls_are_rate_limited_per_method():
+    with StandInServer({'report': lambda: 'done'}) as server:
+        limiter = RateLimiter(methods={'report': (1, 1)}, block=False)
+        proxy = ServerProxy(server.uri, rate_limiter=limiter, batch_opts={'window': 0.001})
+        assert proxy.report() == 'done'
+        with pytest.raises(RateLimitExceeded):
+            proxy.report()
+
+
+def test_proxy_honours_retry_after():
+    with ThrottlingServer({'ping': lambda: 'pong'}) as server:
+        limiter = RateLimiter(rate=100, block=False)
+        proxy = ServerProxy(server.uri, rate_limiter=limiter)
+        with pytest.raises(ProtocolError) as excinfo:
+            proxy.ping()
+        assert excinfo.value.errcode == 429 and excinfo.value.retry_after == 1
+        with pytest.raises(RateLimitExceeded):
+            proxy.ping()
+        assert limiter.throttled == 1 and server.requests == []  # Nothing was sent.
+
+        limiter.block = True
+        started = time.time()
+        assert proxy.ping() == 'pong'
+        assert 0.8 < time.time() - started < 1.5
@@ -0,0 +1,67 @@
+import sys
+import json
+from collections import namedtuple
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.records import ResultSchema
+from tests.server import StandInServer
+
+Point = namedtuple('Point', 'x y')
+
+
+class User(object):
+    __slots__ = ('id', 'name', 'home')
+
+
+def _users():
+    return [{'id': 1, 'name': 'ann', 'home': {'x': 1, 'y': 2}},
+            {'id': 2, 'name': 'bob', 'home': {'y': 4, 'x': 3}}]
+
+
+class TestResultSchema(object):
+
+    def test_builds_records_while_parsing(self):
+        schema = ResultSchema(User, Point)
+        decoded = json.loads(json.dumps({'id': 1, 'result': _users(), 'error': None}),
+                             object_pairs_hook=schema.object_pairs_hook)
+        assert isinstance(decoded, dict)
+        ann, bob = decoded['result']
+        assert isinstance(ann, User) and (ann.id, ann.name, ann.home) == (1, 'ann', Point(1, 2))
+        assert bob.home == Point(3, 4)  # keys out of order
+
+    def test_other_objects_stay_dicts(self):
+        schema = ResultSchema(Point)
+        assert schema.convert([{'x': 1}, {'x': 1, 'y': 2, 'z': 3}, {'x': 1, 'y': 2}]) == \
+            [{'x': 1}, {'x': 1, 'y': 2, 'z': 3}, Point(1, 2)]
+
+    @pytest.mark.skipif(sys.version_info < (3, 7), reason='requires dataclasses')
+    def test_dataclass(self):
+        import dataclasses
+        Item = dataclasses.make_dataclass('Item', ['sku', 'qty'], frozen=True)
+        schema = ResultSchema(Item)
+        assert schema.convert({'qty': 2, 'sku': 'a'}) == Item('a', 2)
+
+    def test_rejects_plain_classes(self):
+        with pytest.raises(TypeError):
+            ResultSchema(dict)
+
+
+class TestServerProxy(object):
+
+    def test_result_types(self):
+        with StandInServer({'users.list': _users, 'origin': lambda: {'x': 0, 'y': 0}}) as server:
+            proxy = ServerProxy(server.uri, result_types={'users.list': (User, Point)})
+            users = proxy.users.list()
+            assert [u.name for u in users] == ['ann', 'bob']
+            assert users[1].home == Point(3, 4)
+            assert proxy.origin() == {'x': 0, 'y': 0}
+
+            proxy.register_result_type('origin', Point)
+            assert proxy.origin() == Point(0, 0)
+
+    def test_batched_calls(self):
+        with StandInServer({'origin': lambda: {'x': 0, 'y': 0}}) as server:
+            proxy = ServerProxy(server.uri, batch_opts={'window': 0}, result_types={'origin': Point})
+            assert proxy.origin() == Point(0, 0)
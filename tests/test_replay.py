@@ -0,0 +1,69 @@
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.replay import Record, RecordingTransport, Replayer, read_records
+from rpctools.jsonrpc.transport import Transport
+from tests.server import StandInServer
+
+
+def test_record_and_read(tmpdir):
+    path = str(tmpdir.join('calls.rec'))
+    with StandInServer({'echo': lambda x: x}) as server:
+        proxy = ServerProxy(server.uri)
+        proxy.transport = RecordingTransport(proxy.transport, path)
+        proxy.echo('a')
+        proxy.echo(u'é')
+        proxy.transport.close()
+
+    first, second = read_records(path)
+    assert first.host == '127.0.0.1:%d' % server.server_address[1]
+    assert first.handler == '/jsonrpc'
+    assert b'"echo"' in first.body
+    assert first.status == 200
+    assert 0 <= first.latency < 5
+    assert first.timestamp <= second.timestamp
+
+
+def test_not_a_recording(tmpdir):
+    path = tmpdir.join('junk')
+    path.write('junk')
+    with pytest.raises(ValueError):
+        list(read_records(str(path)))
+
+
+class TestReplayer(object):
+
+    def _records(self, n, spacing):
+        return [Record(1000.0 + i * spacing, 'recorded:1', '/jsonrpc',
+                       b'{"id": 1, "method": "echo", "params": [1]}', 200, 0.01) for i in range(n)]
+
+    def test_schedule_speed_and_rate(self):
+        records = self._records(3, 1.0)
+        assert [o for o, r in Replayer(Transport(), records, speed=2).schedule()] == [0, 0.5, 1.0]
+        assert [o for o, r in Replayer(Transport(), records, rate=10).schedule()] == [0, 0.1, 0.2]
+        assert [o for o, r in Replayer(Transport(), records, speed=None).schedule()] == [0, 0, 0]
+
+    def test_replay_against_other_host(self):
+        with StandInServer({'echo': lambda x: x}) as server:
+            host = '127.0.0.1:%d' % server.server_address[1]
+            report = Replayer(Transport(), self._records(20, 0.001), speed=1, concurrency=4, host=host).run()
+        assert report.completed == 20
+        assert report.errors == {}
+        assert report.latency['count'] == 20
+        assert report.throughput > 0
+        assert 'completed: 20' in str(report)
+
+    def test_errors_counted(self):
+        with StandInServer() as server:
+            host = '127.0.0.1:%d' % server.server_address[1]
+        report = Replayer(Transport(), self._records(3, 0), host=host).run()
+        assert report.errors == {'ConnectionError': 3}
+
+    def test_unexpected_errors_counted(self):
+        class BrokenTransport(Transport):
+            def request(self, *args, **kwargs):
+                raise ValueError('unexpected')
+
+        report = Replayer(BrokenTransport(), self._records(3, 0), concurrency=2).run()
+        assert report.completed == 0
+        assert report.errors == {'ValueError': 3}
@@ -0,0 +1,179 @@
+import sys
+import json
+import time
+import threading
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+import pytest
+
+from rpctools.jsonrpc import pool as pool_module
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import Fault
+from rpctools.jsonrpc.server import Registry, Dispatcher, WSGIApplication
+from rpctools.jsonrpc.server.dispatch import METHOD_NOT_FOUND, INVALID_REQUEST, INVALID_PARAMS, INTERNAL_ERROR, \
+    PARSE_ERROR, SERVER_ERROR
+
+
+class _Service(object):
+
+    def add(self, a, b):
+        return a + b
+
+    def refuse(self):
+        raise Fault(403, 'Forbidden')
+
+    def _private(self):
+        pass
+
+
+def _registry():
+    registry = Registry()
+    registry.register(lambda: 'pong', 'ping')
+    registry.register_instance(_Service(), prefix='math')
+    registry.namespace('a').namespace('b').register(lambda x: x, 'echo')
+    registry.register(lambda seconds: time.sleep(seconds) or seconds, 'sleep')
+    return registry
+
+
+class TestRegistry(object):
+
+    def test_dotted_namespaces(self):
+        registry = _registry()
+        assert sorted(registry.methods) == ['a.b.echo', 'math.add', 'math.refuse', 'ping', 'sleep']
+
+    def test_decorator(self):
+        registry = Registry()
+
+        @registry.register
+        def first():
+            pass
+
+        @registry.namespace('ns').register(name='second')
+        def whatever():
+            pass
+
+        assert registry.lookup('first') is first
+        assert registry.lookup('ns.second') is whatever
+
+
+class TestDispatcher(object):
+
+    def test_results_and_errors(self):
+        dispatcher = Dispatcher(_registry())
+        assert dispatcher.dispatch({'id': 1, 'method': 'math.add', 'params': [2, 3]}) == \
+            {'id': 1, 'result': 5, 'error': None}
+        assert dispatcher.dispatch({'jsonrpc': '2.0', 'id': 2, 'method': 'a.b.echo', 'params': {'x': 'hi'}}) == \
+            {'jsonrpc': '2.0', 'id': 2, 'result': 'hi'}
+        assert dispatcher.dispatch({'id': 3, 'method': 'math.refuse'})['error'] == {'code': 403, 'message': 'Forbidden'}
+        assert dispatcher.dispatch({'id': 4, 'method': 'nope'})['error']['code'] == METHOD_NOT_FOUND
+        assert dispatcher.dispatch({'id': 5})['error']['code'] == INVALID_REQUEST
+
+    def test_notifications_get_no_response(self):
+        dispatcher = Dispatcher(_registry())
+        assert dispatcher.dispatch({'method': 'ping'}) is None
+        assert dispatcher.dispatch({'method': 'nope'}) is None
+        assert dispatcher.handle(b'{"method": "ping"}') == (204, None, None)
+
+    def test_handle(self):
+        dispatcher = Dispatcher(_registry())
+        status, content_type, data = dispatcher.handle(b'not json', 'application/json; charset=utf-8')
+        assert (status, content_type) == (200, 'application/json')
+        assert json.loads(data.decode('utf-8'))['error']['code'] == PARSE_ERROR
+        assert dispatcher.handle(b'{}', 'text/xml') == (415, None, None)
+
+    def test_invalid_params(self):
+        dispatcher = Dispatcher(_registry())
+        assert dispatcher.dispatch({'id': 1, 'method': 'math.add', 'params': [2]})['error']['code'] == INVALID_PARAMS
+        assert dispatcher.dispatch({'id': 2, 'method': 'a.b.echo', 'params': {'y': 1}})['error']['code'] == \
+            INVALID_PARAMS
+        assert dispatcher.dispatch({'id': 3, 'method': 'math.add', 'params': [2, 'x']})['error']['code'] == \
+            SERVER_ERROR  # (A TypeError within the method.)
+
+    def test_unencodable_result(self):
+        registry = _registry()
+        registry.register(lambda: object(), 'opaque')
+        dispatcher = Dispatcher(registry)
+        batch = [{'id': 1, 'method': 'math.add', 'params': [2, 3]}, {'jsonrpc': '2.0', 'id': 2, 'method': 'opaque'}]
+        status, _, data = dispatcher.handle(json.dumps(batch).encode('utf-8'))
+        first, second = json.loads(data.decode('utf-8'))
+        assert status == 200 and first['result'] == 5
+        assert second['id'] == 2 and second['error']['code'] == INTERNAL_ERROR
+
+    def test_batch_runs_concurrently(self):
+        dispatcher = Dispatcher(_registry(), workers=4)
+        started = time.time()
+        responses = dispatcher.dispatch_payload([{'id': i, 'method': 'sleep', 'params': [0.2]} for i in range(4)]
+                                                + [{'method': 'ping'}])
+        assert time.time() - started < 0.6
+        assert [r['id'] for r in responses] == [0, 1, 2, 3]
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWSGIApplication(object):
+
+    def test_with_client(self):
+        httpd = make_server('127.0.0.1', 0, WSGIApplication(Dispatcher(_registry())), handler_class=_QuietHandler)
+        thread = threading.Thread(target=httpd.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        try:
+            proxy = ServerProxy('http://127.0.0.1:%d/jsonrpc' % httpd.server_address[1])
+            assert proxy.math.add(2, 3) == 5
+            assert proxy.a.b.echo(x='hi') == 'hi'
+            with pytest.raises(Fault) as excinfo:
+                proxy.math.refuse()
+            assert excinfo.value.errcode == 403
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_only_post(self):
+        statuses = []
+        body = WSGIApplication(Dispatcher(_registry()))({'REQUEST_METHOD': 'GET'}, lambda s, h: statuses.append(s))
+        assert body == [] and statuses == ['405 Method Not Allowed']
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason='requires asyncio with async/await')
+class TestAsyncio(object):
+
+    def test_with_client(self):
+        import asyncio
+        from rpctools.jsonrpc.server.aio import AsyncDispatcher, serve
+
+        registry = _registry()
+
+        def slow_double(n):
+            return asyncio.sleep(0.2, result=n * 2)  # An awaitable, like a coroutine's.
+        registry.register(slow_double)
+
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(serve(AsyncDispatcher(registry)))
+        thread = threading.Thread(target=loop.run_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            uri = 'http://127.0.0.1:%d/jsonrpc' % server.sockets[0].getsockname()[1]
+            proxy = ServerProxy(uri, pool_connections=True)
+            assert proxy.math.add(2, 3) == 5
+            assert proxy.slow_double(4) == 8
+            with pytest.raises(Fault):
+                proxy.math.refuse()
+
+            started = time.time()
+            batch = json.dumps([{'id': i, 'method': 'slow_double', 'params': [i]} for i in range(5)])
+            response = proxy.transport.request(proxy.host, '/jsonrpc', batch)
+            assert [r['result'] for r in json.loads(response.read().decode('utf-8'))] == [0, 2, 4, 6, 8]
+            assert time.time() - started < 0.6
+        finally:
+            pool_module.pool.connections.pop(proxy.host).close()
+            time.sleep(0.05)  # Let the server see the connection close.
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
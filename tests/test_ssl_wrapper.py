@@ -1,5 +1,8 @@
+import socket
+
 from rpctools.jsonrpc.ssl_wrapper import (
-    CertValidatingHTTPSConnection, CertValidatingHTTPSHandler)
+    CertValidatingHTTPSConnection, CertValidatingHTTPSHandler, HTTPConnection, configure_socket)
+from rpctools.jsonrpc.tcp import TCPTransport
 
 
 def test_connection_constructor():
@@ -8,3 +11,46 @@ def test_connection_constructor():
 
 def test_handler_constructor():
     CertValidatingHTTPSHandler()
+
+
+def test_configure_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        configure_socket(sock, {'nodelay': True, 'keepalive': True, 'keepidle': 30, 'rcvbuf': 65536})
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 30
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 65536
+    finally:
+        sock.close()
+
+
+def test_socket_opts_added_to_defaults():
+    assert HTTPConnection('example.com', socket_opts={'keepalive': True}).socket_opts == {'nodelay': True,
+                                                                                         'keepalive': True}
+    assert not CertValidatingHTTPSConnection('example.com', socket_opts={'nodelay': False}).socket_opts['nodelay']
+    assert TCPTransport('example.com:1', socket_opts={'keepidle': 60}).socket_opts == {'nodelay': True,
+                                                                                       'keepidle': 60}
+
+
+class _RecordingSocket(object):
+
+    def __init__(self):
+        self.writes = []
+
+    def sendall(self, data):
+        self.writes.append(data)
+
+
+def test_small_requests_go_out_in_one_write():
+    conn = HTTPConnection('example.com')
+    conn.sock = _RecordingSocket()
+    conn.request('POST', '/jsonrpc', b'{"id": 1}', {'Content-Type': 'application/json'})
+    assert len(conn.sock.writes) == 1 and conn.sock.writes[0].endswith(b'\r\n\r\n{"id": 1}')
+
+    conn = HTTPConnection('example.com')
+    conn.coalesce_limit = 4
+    conn.sock = _RecordingSocket()
+    conn.request('POST', '/jsonrpc', b'{"id": 1}', {'Content-Type': 'application/json'})
+    assert conn.sock.writes[-1] == b'{"id": 1}'
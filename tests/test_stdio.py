@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+from rpctools.jsonrpc.exc import ConnectionError, Fault, JsonRpcError
+from rpctools.jsonrpc.stdio import StdioServerProxy, StdioTransport
+from rpctools.jsonrpc.tcp import read_frame
+
+WORKER = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stdio_worker.py')]
+
+
+def _in_threads(func, n):
+    results = {}
+
+    def run(i):
+        results[i] = func(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return results
+
+
+def test_content_length_headers():
+    stream = io.BytesIO(b'Content-Type: application/vscode-jsonrpc; charset=utf-8\r\n'
+                        b'content-length: 9\r\n\r\n{"id": 1}')
+    assert read_frame(stream, 'content-length') == b'{"id": 1}'
+    with pytest.raises(ValueError):
+        read_frame(io.BytesIO(b'Content-Type: text/plain\r\n\r\n{}'), 'content-length')
+
+
+def test_requires_command_or_attach():
+    with pytest.raises(ValueError):
+        StdioTransport()
+    with pytest.raises(JsonRpcError):
+        StdioServerProxy(WORKER, batch_opts={})
+
+
+class TestStdioServerProxy(object):
+
+    def test_out_of_order_responses(self):
+        with StdioServerProxy(WORKER, timeout=10) as proxy:
+            # Later calls answer sooner, so responses come back out of order.
+            results = _in_threads(lambda n: proxy.sleep_then(0.05 * (5 - n), n), 5)
+            assert results == dict((n, n) for n in range(5))
+            assert len(proxy.transport.processes) == 1
+            assert proxy.host == os.path.basename(sys.executable)
+            with pytest.raises(Fault):
+                proxy.missing()
+
+    def test_load_spread_across_workers(self):
+        with StdioServerProxy(WORKER, workers=3, timeout=10) as proxy:
+            pids = _in_threads(lambda n: proxy.pid(0.2), 6)
+            assert len(set(pids.values())) == 3
+            processes = proxy.transport.processes
+            assert sorted(p.pid for p in processes) == sorted(set(pids.values()))
+        # Closing the proxy closed the workers' stdin, and they exited.
+        assert all(p.returncode == 0 for p in processes)
+
+    def test_worker_crash_is_restarted(self):
+        with StdioServerProxy(WORKER, timeout=10) as proxy:
+            first = proxy.pid()
+            with pytest.raises(ConnectionError):
+                proxy.crash()
+            assert proxy.pid() != first
+
+    def test_notify(self):
+        with StdioServerProxy(WORKER, timeout=10) as proxy:
+            assert proxy.notify.remember('hello')
+            deadline = time.time() + 5
+            while not proxy.recall() and time.time() < deadline:
+                time.sleep(0.01)
+            assert proxy.recall() == ['hello']
+
+    def test_requests_from_the_worker_are_not_responses(self):
+        with StdioServerProxy(WORKER, timeout=10) as proxy:
+            assert proxy.ask() == 'answered'
+
+    def test_timeout(self):
+        with StdioServerProxy(WORKER, timeout=0.1) as proxy:
+            with pytest.raises(ConnectionError):
+                proxy.sleep_then(1, 'late')
+            assert proxy.echo('next') == 'next'
+
+    def test_attach(self):
+        process = subprocess.Popen(WORKER, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        with StdioServerProxy(attach=[process], timeout=10) as proxy:
+            assert proxy.pid() == process.pid
+            assert proxy.host == 'stdio'
+            with pytest.raises(ConnectionError):
+                proxy.crash()
+            with pytest.raises(ConnectionError):
+                proxy.echo('attached workers are not restarted')
+        assert process.wait() == 3
+
+    def test_stubborn_worker_is_terminated(self):
+        # A worker that ignores the end of its stdin.
+        command = [sys.executable, '-c', 'import time; time.sleep(60)']
+        transport = StdioTransport(command, grace=0.1)
+        transport.start()
+        (process,) = transport.processes
+        started = time.time()
+        transport.close()
+        assert process.returncode is not None
+        assert time.time() - started < 5
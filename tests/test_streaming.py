@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.streaming import is_streaming, iterencode
+from tests.server import StandInServer
+
+
+@pytest.mark.parametrize('params,expected', [
+    ([1, 2], False),
+    ({'a': [1]}, False),
+    (iter([1]), True),
+    ([1, iter([2])], True),
+    ({'rows': (r for r in [])}, True),
+])
+def test_is_streaming(params, expected):
+    assert is_streaming(params) is expected
+
+
+@pytest.mark.parametrize('params,decoded', [
+    (iter([1, 2, 3]), [1, 2, 3]),
+    (['x', iter([]), iter([{'a': 1}])], ['x', [], [{'a': 1}]]),
+    ({'name': 'x', 'rows': iter(range(3))}, {'name': 'x', 'rows': [0, 1, 2]}),
+])
+def test_iterencode(params, decoded):
+    data = {'id': 1, 'method': 'upload', 'params': params}
+    body = b''.join(iterencode(data))
+    assert json.loads(body.decode('utf-8')) == {'id': 1, 'method': 'upload', 'params': decoded}
+
+
+def test_chunks_are_bounded():
+    data = {'id': 1, 'method': 'upload', 'params': [(('x' * 100) for _ in range(1000))]}
+    chunks = list(iterencode(data, chunk_size=1024))
+    assert len(chunks) > 50
+    assert max(len(c) for c in chunks) < 1024 + 110
+
+
+def test_streamed_upload():
+    with StandInServer({'count': lambda rows: len(rows)}) as server:
+        proxy = ServerProxy(server.uri, pool_connections=True)
+        proxy.chunk_size = 256
+        assert proxy.count((n for n in range(10000))) == 10000
+        assert proxy.count([1, 2]) == 2
+        (first_headers, _), (second_headers, _) = server.requests
+        assert first_headers['Transfer-Encoding'] == 'chunked'
+        assert 'Transfer-Encoding' not in second_headers
+
+
+def test_failed_stream_leaves_no_broken_connection():
+    def rows():
+        yield 1
+        raise ValueError('no more rows')
+
+    with StandInServer({'count': lambda rows: len(rows), 'ping': lambda: 'pong'}) as server:
+        proxy = ServerProxy(server.uri, pool_connections=True)
+        proxy.chunk_size = 1
+        with pytest.raises(ValueError):
+            proxy.count(rows())
+        assert proxy.ping() == 'pong'
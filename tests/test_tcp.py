@@ -0,0 +1,69 @@
+import io
+import threading
+
+import pytest
+
+from rpctools.jsonrpc.exc import ConnectionError, Fault, JsonRpcError
+from rpctools.jsonrpc.tcp import TCPServerProxy, TCPTransport, encode_frame, read_frame
+from tests.server import TCPStandInServer, sleep_then
+
+
+@pytest.mark.parametrize('framing', ['newline', 'length', 'content-length'])
+def test_frame_round_trip(framing):
+    stream = io.BytesIO(encode_frame(b'{"id": 1}', framing) + encode_frame(b'[]', framing))
+    assert read_frame(stream, framing).strip() == b'{"id": 1}'
+    assert read_frame(stream, framing).strip() == b'[]'
+    assert read_frame(stream, framing) is None
+
+
+def test_unknown_framing():
+    with pytest.raises(ValueError):
+        TCPTransport('localhost:1', framing='xml')
+
+
+class TestTCPServerProxy(object):
+
+    def test_requires_port(self):
+        with pytest.raises(JsonRpcError):
+            TCPServerProxy('tcp://localhost')
+
+    @pytest.mark.parametrize('framing', ['newline', 'length'])
+    def test_out_of_order_responses(self, framing):
+        with TCPStandInServer({'sleep_then': sleep_then}, framing=framing) as server:
+            proxy = TCPServerProxy(server.uri, framing=framing, timeout=5)
+            results = {}
+
+            def worker(n):
+                # Later calls answer sooner, so responses come back out of order.
+                results[n] = proxy.sleep_then(0.05 * (5 - n), n)
+
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(5)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+            assert results == dict((n, n) for n in range(5))
+            assert len(server.requests) == 5
+            proxy.transport.close()
+
+    def test_fault(self):
+        with TCPStandInServer({}) as server:
+            proxy = TCPServerProxy(server.uri, timeout=5)
+            with pytest.raises(Fault):
+                proxy.missing()
+            proxy.transport.close()
+
+    def test_connection_refused(self):
+        with TCPStandInServer() as server:
+            uri = server.uri
+        proxy = TCPServerProxy(uri, timeout=1)
+        with pytest.raises(ConnectionError):
+            proxy.anything()
+
+    def test_notify(self):
+        with TCPStandInServer({'log': lambda msg: None}) as server:
+            proxy = TCPServerProxy(server.uri, timeout=5)
+            assert proxy.notify.log('hello') is True
+            assert server.wait_for_requests(1)
+            assert b'"id"' not in server.requests[0][1]
+            proxy.transport.close()
@@ -0,0 +1,50 @@
+import pytest
+
+from rpctools.jsonrpc.client import ServerProxy
+from rpctools.jsonrpc.exc import Fault
+from rpctools.jsonrpc.tracing import NOOP_SPAN, RecordingTracer, Tracer
+from rpctools.jsonrpc.transport import Transport
+from tests.server import StandInServer
+
+
+def test_default_tracer_is_noop():
+    assert Tracer().start_span('localhost:80', '/', 'foo') is NOOP_SPAN
+    assert ServerProxy('http://foo.com/').tracer.start_span('localhost:80', '/', 'foo') is NOOP_SPAN
+
+
+class TestRecordingTracer(object):
+
+    def test_phases_and_reuse(self):
+        tracer = RecordingTracer()
+        with StandInServer({'echo': lambda x: x}) as server:
+            proxy = ServerProxy(server.uri, pool_connections=True, tracer=tracer)
+            assert proxy.echo(1) == 1
+            assert proxy.echo(2) == 2
+
+        first, second = tracer.spans
+        assert first.method == 'echo'
+        assert first.attributes['connection.reused'] is False
+        assert set(first.durations()) == set(['dns', 'connect', 'send', 'wait', 'read', 'decode', 'total'])
+        assert second.attributes['connection.reused'] is True
+        assert 'connect' not in second.durations()
+        assert first.error is None
+
+    def test_error_recorded(self):
+        tracer = RecordingTracer()
+        with StandInServer() as server:
+            proxy = ServerProxy(server.uri, tracer=tracer)
+            # Faults are raised after the span ends; the call itself succeeded.
+            with pytest.raises(Fault):
+                proxy.missing()
+        assert tracer.spans[0].error is None
+
+    def test_transport_starts_own_span(self):
+        tracer = RecordingTracer()
+        with StandInServer({'ping': lambda: 'pong'}) as server:
+            transport = Transport()
+            transport.tracer = tracer
+            host = '%s:%d' % server.server_address
+            transport.request(host, '/jsonrpc', '{"id": 1, "method": "ping", "params": []}').read()
+        span, = tracer.spans
+        assert span.method is None
+        assert 'wait' in span.durations()
@@ -0,0 +1,131 @@
+import datetime
+import threading
+
+import pytest
+
+try:
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+except ImportError:  # Python 2
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from rpctools.six.moves import socketserver, xmlrpc_client
+from rpctools.jsonrpc import pool as pool_module
+from rpctools.jsonrpc.exc import JsonRpcError, ResponseError
+from rpctools.xmlrpc import ServerProxy, MultiCall, Fault
+from rpctools.xmlrpc.unmarshal import loads
+
+
+class _KeepAliveHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class XmlRpcStandIn(object):
+
+    def __init__(self):
+        self.server = _ThreadingXMLRPCServer(('127.0.0.1', 0), requestHandler=_KeepAliveHandler,
+                                         logRequests=False, allow_none=True)
+        self.server.register_multicall_functions()
+        self.server.register_function(lambda a, b: a + b, 'add')
+        self.server.register_function(lambda x: x, 'echo')
+        self.server.register_function(self.fail, 'fail')
+        self.server.register_function(lambda: 'pong', 'ns.ping')
+
+    @staticmethod
+    def fail():
+        raise ValueError('nope')
+
+    @property
+    def uri(self):
+        return 'http://%s:%d/RPC2' % self.server.server_address
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestUnmarshal(object):
+
+    def test_round_trip(self):
+        value = {'ints': [1, -2, 2 ** 30], 'text': u'h\xe9llo', 'flag': True, 'pi': 3.5,
+                 'nested': [{'a': []}, {}], 'none': None}
+        params, methodname = loads(xmlrpc_client.dumps((value, 'x'), 'do.it', allow_none=True).encode('utf-8'))
+        assert methodname == 'do.it'
+        assert params == (value, 'x')
+
+    def test_untyped_value_is_string(self):
+        params, _ = loads(b'<methodResponse><params><param><value>plain</value></param>'
+                          b'<param><value></value></param></params></methodResponse>')
+        assert params == ('plain', '')
+
+    def test_dates_and_binary(self):
+        when = datetime.datetime(2015, 6, 1, 12, 30, 0)
+        body = xmlrpc_client.dumps(([xmlrpc_client.DateTime(when), xmlrpc_client.Binary(b'\x00\xff')],),
+                                   methodresponse=True)
+        (result,), _ = loads(body.encode('utf-8'), use_datetime=True)
+        assert result[0] == when
+        assert result[1].data == b'\x00\xff'
+
+    def test_fault(self):
+        body = xmlrpc_client.dumps(xmlrpc_client.Fault(4, 'Too many parameters.'), methodresponse=True)
+        with pytest.raises(Fault) as excinfo:
+            loads(body.encode('utf-8'))
+        assert (excinfo.value.errcode, excinfo.value.errmsg) == (4, 'Too many parameters.')
+
+    def test_malformed(self):
+        with pytest.raises(ResponseError):
+            loads(b'<methodResponse><params>')
+
+    @pytest.mark.parametrize('body', [
+        b'<methodResponse><fault></fault></methodResponse>',
+        b'<methodResponse><fault><value><string>oops</string></value></fault></methodResponse>',
+    ])
+    def test_malformed_fault(self, body):
+        with pytest.raises(ResponseError):
+            loads(body)
+
+
+class TestServerProxy(object):
+
+    def test_calls_share_pooled_connection(self):
+        with XmlRpcStandIn() as server:
+            proxy = ServerProxy(server.uri, pool_connections=True, allow_none=True)
+            assert proxy.add(2, 3) == 5
+            conn = pool_module.pool.connections[proxy.host]
+            assert proxy.echo(None) is None
+            assert proxy.ns.ping() == 'pong'
+            assert pool_module.pool.connections[proxy.host] is conn
+
+    def test_fault(self):
+        with XmlRpcStandIn() as server:
+            with pytest.raises(Fault):
+                ServerProxy(server.uri).fail()
+
+    def test_keyword_arguments_rejected(self):
+        with pytest.raises(JsonRpcError):
+            ServerProxy('http://localhost/RPC2').add(a=1)
+
+    def test_multicall(self):
+        with XmlRpcStandIn() as server:
+            multicall = MultiCall(ServerProxy(server.uri))
+            multicall.add(2, 3)
+            multicall.fail()
+            multicall.ns.ping()
+            results = multicall()
+            assert len(results) == 3
+            assert results[0] == 5
+            with pytest.raises(Fault):
+                results[1]
+            assert results[2] == 'pong'